@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# Measures the startup time of the toolkit on a no-op invocation (--help),
+# which only has to import the core module and discover the root.
+#
+# usage: bench-startup.py [runs] [--max-ms=<ms>]
+# With --max-ms, exits with 1 if the median run is slower than <ms>.
+import os
+import sys
+import time
+import subprocess
+import statistics
+
+entry_point = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "__main__.py")
+
+def time_run(args:list) -> float:
+    start = time.perf_counter()
+    subprocess.run([sys.executable, entry_point, *args], stdout=subprocess.DEVNULL, check=True)
+    return (time.perf_counter()-start)*1000
+
+def main(args:list):
+    runs = 20
+    max_ms = None
+    for a in args:
+        if a.startswith("--max-ms="):
+            max_ms = float(a[a.find("=")+1:])
+        elif a.isdigit():
+            runs = int(a)
+
+    baseline = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "pass"], check=True)
+        baseline.append((time.perf_counter()-start)*1000)
+
+    timings = [time_run(["--help", "--no-color"]) for _ in range(runs)]
+
+    interpreter = statistics.median(baseline)
+    median = statistics.median(timings)
+    print(f"interpreter startup : {interpreter:.1f} ms (median of {runs})")
+    print(f"toolkit --help      : {median:.1f} ms (median of {runs}, min {min(timings):.1f} ms)")
+    print(f"toolkit overhead    : {median-interpreter:.1f} ms")
+
+    if not max_ms is None and median > max_ms:
+        print(f"startup is slower than {max_ms:.0f} ms")
+        exit(1)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,7 +1,8 @@
 #!/bin/env python3
 from __future__ import print_function
-import os, platform
-import lib.dreams, lib.dreams_bundle, lib.dreams_install, lib.dreams_report, lib.dreams_upgrade, lib.dreams_publish
+import os, sys
+from importlib import import_module
+import lib.dreams
 from lib.dreams import Color
 
 class RunMode:
@@ -10,6 +11,13 @@ class RunMode:
     REPORT = "report"
     BUNDLE = "bundle"
     PUBLISH = "publish"
+    STORE = "store"
+    VERIFY = "verify"
+
+def run_mode(module_name:str, args:list):
+    # mode modules (and their network, archive... dependencies) are only
+    # imported when dispatched, to keep the startup fast.
+    import_module(f"lib.{module_name}").main(args)
 
 # Publish is voluntarly not in the help text to avoid users attempting to
 # publish without permission
@@ -31,16 +39,28 @@ args_help_text = """Command line arguments :
     --server, -s     use a custom installation process made for servers
     --import, -o     import the option.txt, resourcepacks/ and
                      shaderpacks/ from the .minecraft if it can be found
+    --link-imports   hardlink the imported files instead of copying them
+                     when possible (they are then shared with .minecraft)
     --interactive    will ask the user for what to import and if the
                      installation should proceed
     --profile, -p    install in a custom directory inside ".minecraft/profiles"
     --inject, -i     create a launcher profile for the installation
     -f="<file>"      skip to the installation using the provided archive
+    --segments=<n>   download the archive in <n> parallel parts
+                     before installing it
+    --no-stream      download the whole archive before installing it
+                     instead of installing it while it downloads
+    --workers=<n>    extract a downloaded archive on <n> threads
+    --shared-store[=<dir>]
+                     share the mods with the other profiles using the
+                     store in <dir> (default: .minecraft/dreams-store),
+                     the files already in it are not downloaded again
 
     UPGRADE:
     --server, -s     use a custom installation process made for servers
     --interactive    will print the patchnote and ask the user whether 
                      the upgrade should proceed or not
+    --rollback       undo an interrupted upgrade instead of finishing it
 
     REPORT:
     --no-note, -n    similar to --no-interact in this case, skip the
@@ -53,6 +73,27 @@ args_help_text = """Command line arguments :
                      This option does not bundle the modpack!
     --increment, -i  automatically try to increment the version based on
                      file changes
+    --rehash         invalidate the hash cache and hash every file again
+    --patches=<n>    also create the patch archives upgrading the <n> last
+                     releases to this one in a single download
+    --signatures     also write the block signatures of the big files, so
+                     that upgrades only download the parts that changed
+    --binary-content also write the version content as a compact binary
+                     manifest, read instead of the text one by the upgrades
+
+    VERIFY:
+    --server, -s     ignore the client side only files
+    --repair         download the missing and modified files again
+
+    STORE:
+    --gc             remove the shared files no profile uses anymore
+    --store=<dir>    use the store in <dir> instead of the one of the
+                     profile
+
+    Downloaded archives and upgrade files are kept in a download cache
+    shared by every profile (DREAMS_CACHE_DIR, default: the user cache
+    directory), so they are not downloaded again. Its size is set by the
+    "download-cache-size" option of the config (in MB, 0 disables it).
 """
 
 def main(args):
@@ -60,8 +101,10 @@ def main(args):
     # Bad way to do this, but since many users whose terminal does
     # not support color are on Windows 10 with their ugly default
     # terminal, it prevents most of the issues.
-    if platform.platform().replace(" ","-").startswith("Windows-10"):
-        args.append("--no-color")
+    if sys.platform == "win32":
+        import platform
+        if platform.platform().replace(" ","-").startswith("Windows-10"):
+            args.append("--no-color")
     
 
     lib.dreams._no_color_print = "--no-color" in args
@@ -103,7 +146,7 @@ def main(args):
         args.append("--server")
         print("\nServer install detected: using server mode by default. To force client mode, add the argument --client.\n")
     
-    if lib.dreams_upgrade.is_standalone():
+    if lib.dreams.is_standalone():
         # installing if dir is empty
         print("Modpack not installed, defaulting to install mode.")
         mode = RunMode.INSTALL
@@ -123,26 +166,30 @@ def main(args):
     match (str(mode).lower()):
         case RunMode.INSTALL | "1":
             print("installing...")
-            lib.dreams_install.main([*args, "--standalone"])
+            run_mode("dreams_install", [*args, "--standalone"])
         case RunMode.UPGRADE | "2":
             print("upgrading...")
-            lib.dreams_upgrade.main(args)
+            run_mode("dreams_upgrade", args)
         case RunMode.REPORT | "3":
             print("creating a report...")
-            lib.dreams_report.main(args)
+            run_mode("dreams_report", args)
         case RunMode.BUNDLE | "4":
             print("bundling...")
-            lib.dreams_bundle.main(args)
+            run_mode("dreams_bundle", args)
         case RunMode.PUBLISH | "5":
             print("starting publication...")
-            lib.dreams_publish.main(args)
+            run_mode("dreams_publish", args)
+        case RunMode.STORE:
+            run_mode("dreams_store", args)
+        case RunMode.VERIFY:
+            run_mode("dreams_verify", args)
         case "exit" | "x":
             exit()
         case _:
             print(f"ERROR: mode \'{mode}\' is not regonized.")
 
     if interactive and not "--no-hold" in args:
-        if platform.system() == "Windows":
+        if sys.platform == "win32":
             os.system("pause")
         else:
             os.system("/bin/bash -c 'read -s -n 1 -p \"Press any key to continue...\"'")
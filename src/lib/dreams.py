@@ -1,14 +1,16 @@
 #!/bin/env python3
-from http.client import HTTPSConnection
+# only cheap modules are imported here, since this module is
+# imported on every start of the toolkit.
+from bisect import bisect_right
 import os
+import sys
+import time
+import threading
 import json
+import copy
 import hashlib
 import math
-from pathlib import Path
-import platform
-import subprocess
 from typing import NamedTuple
-from urllib.parse import urlparse
 
 _no_color_print = False
 
@@ -42,19 +44,31 @@ class DirNames:
     RELEASES = f"{INSTALL}/releases"
     REPORTS = f"{INSTALL}/reports"
     PATCHNOTES = f"{INSTALL}/version"
+    PATCHES = f"{INSTALL}/patches"
+    BLOCKS = f"{INSTALL}/blocks"
     SERVER = f"{INSTALL}/server"
+    CACHE = f"{INSTALL}/cache"
+    DOWNLOADS = f"{CACHE}/downloads"
+    STAGING = f"{CACHE}/staging"
+    BACKUP = f"{CACHE}/backup"
     FILE_MANIFEST = f"{INSTALL}/dreams-manifest.json"
     FILE_CONFIG = f"{INSTALL}/config.json"
     FILE_CONFIG_PUBLICATION = f"{INSTALL}/publish.json"
     FILE_CONFIG_SERVER = f"{SERVER}/serverconfig.json"
     FILE_VERSION_CONTENT = f"{PATCHNOTES}/version_content.txt"
+    FILE_VERSION_CONTENT_BINARY = f"{PATCHNOTES}/version_content.bin"
     FILE_SERVER_MARKER = f"{SERVER}/is-server.json"
     FILE_VERSION_CHECKER = f"{CONFIG}/bcc.json"
+    FILE_HASH_CACHE = f"{CACHE}/hashes.json"
+    FILE_STORE = f"{CACHE}/store.json"
+    FILE_UPGRADE_JOURNAL = f"{CACHE}/upgrade.json"
+    FILE_PATCH_REMOVED = f"{PATCHES}/removed.txt"
 
     class Minecraft:
         PROFILES_DIR = "profiles"
         VERSIONS_DIR = "versions"
         LAUNCHER_PROFILES = "launcher_profiles.json"
+        SHARED_STORE = "dreams-store"
     
     class Server:
         LATEST_META = "latest.json"
@@ -77,9 +91,8 @@ def get_location() -> str:
 
     for i in range (len(path),0,-1):
         sub = "/".join(path[0:i])
-        if not os.path.isdir(sub):
-            continue
-        if manifest_name in os.listdir(sub+"/"):
+        # a single stat per parent, instead of listing each one of them
+        if os.path.isfile(f"{sub}/{manifest_name}"):
             return sub
     raise FileNotFoundError("the manifest file could not be found in order to determine root")
 
@@ -97,8 +110,9 @@ def get_minecraft_dir() -> str:
     # .minecraft not found by recursion, trying
     # to find it in the user home directory
     
+    import platform
     os_name = platform.platform()
-    home = Path.home()
+    home = os.path.expanduser("~")
     if os_name.startswith("Windows"):
         mc_dir = f"{home}/AppData/Roaming/.minecraft"
         if os.path.isdir(mc_dir) and len(os.listdir(mc_dir)) > 0:
@@ -116,80 +130,151 @@ def get_minecraft_dir() -> str:
     return None
         
 
-_ROOT = "."
-try:
-    _ROOT = os.path.dirname(get_location()).replace("\\","/")
-except FileNotFoundError:
-    _ROOT = os.getcwd()
-    pass
+# determined on first use, see get_root()
+_ROOT = None
 
 def get_root() -> str:
+    global _ROOT
+    if _ROOT is None:
+        try:
+            _ROOT = os.path.dirname(get_location()).replace("\\","/")
+        except FileNotFoundError:
+            _ROOT = os.getcwd().replace("\\","/")
     return _ROOT
 
 def _set_root(root:str):
+    global _ROOT
     if not os.path.isdir(root):
         raise FileNotFoundError("path to root does not exist")
-    _ROOT = root
+    _ROOT = root.replace("\\","/")
+    invalidate_config()
+
+class ConfigSnapshot:
+    """Lazily loaded view of the configuration files of a profile root.
+
+    Every file (or remote config) is read the first time it is needed and
+    memoized until `invalidate()` is called, which has to be done after
+    writing to one of them."""
+
+    def __init__(self, root:str):
+        self.root = root
+        self._values = dict()
+
+    def _memoize(self, key, loader):
+        if not key in self._values:
+            self._values[key] = loader()
+        return self._values[key]
+
+    def read_json(self, relative:str):
+        """returns the parsed content of `{root}/{relative}`, or None if it
+        does not exist or is invalid."""
+        def load():
+            try:
+                with open(get_as_path(relative, root=self.root),"r") as fp:
+                    return json.load(fp)
+            except:
+                return None
+        return self._memoize(("json", relative), load)
+
+    def manifest(self) -> dict:
+        manifest = self.read_json(DirNames.FILE_MANIFEST)
+        if manifest is None:
+            raise FileNotFoundError("manifest does not exist or is invalid")
+        return manifest
+
+    def local_config(self, is_client=True) -> dict:
+        config = self.read_json(DirNames.FILE_CONFIG if is_client else DirNames.FILE_CONFIG_SERVER)
+        return config if isinstance(config, dict) else dict()
+
+    def remote_config(self, remote_root:str, is_client=True) -> dict:
+        if remote_root is None or len(remote_root) < 1:
+            raise ConnectionRefusedError(f"remote '{remote_root}' does not exist")
+        rel_config = DirNames.FILE_CONFIG if is_client else DirNames.FILE_CONFIG_SERVER
+        def load():
+            from lib.dreams_net import RepositoryClient
+            config = RepositoryClient(remote_root).get_json(rel_config)
+            return config if isinstance(config, dict) else dict()
+        return self._memoize(("remote", remote_root, rel_config), load)
+
+    def config_type(self) -> ConfigType:
+        def load():
+            # in order :
+            # 1. local or remote ?
+            #       check on local config if anything forces local
+            # 2. client or server ?
+            is_local = get_config_option(
+                "force-local-config",
+                False,
+                overrides=[
+                    self.local_config(is_client=False),
+                    self.local_config(is_client=True)
+                ]
+            )
+            is_client = not (
+                os.path.isfile(get_as_path(DirNames.FILE_SERVER_MARKER, root=self.root))
+                and os.path.isfile(get_as_path(DirNames.FILE_CONFIG_SERVER, root=self.root))
+            )
+            return ConfigType(is_client, is_local)
+        return self._memoize(("type",), load)
+
+    def invalidate(self):
+        self._values.clear()
 
-def get_manifest(root=get_root()) -> dict:
-    path = f"{root}/{DirNames.FILE_MANIFEST}"
+_config_snapshots = dict()
+
+def get_config_snapshot(root=None) -> ConfigSnapshot:
+    root = get_root() if root is None else root.replace("\\","/")
+    if not root in _config_snapshots:
+        _config_snapshots[root] = ConfigSnapshot(root)
+    return _config_snapshots[root]
+
+def invalidate_config(root=None):
+    """drops the memoized configs of `root`, or of every root if not specified"""
+    if root is None:
+        _config_snapshots.clear()
+    else:
+        _config_snapshots.pop(root.replace("\\","/"), None)
+
+def is_standalone() -> bool:
+    """true if the modpack is not installed in the root"""
     try:
-        with open(path,"r") as fp:
-            return json.load(fp)
+        get_manifest()
     except:
-        raise FileNotFoundError("manifest does not exist or is invalid")
+        return True
+    root = get_root()
+    return len([f for f in os.listdir(root) if os.path.isdir(f"{root}/{f}")]) == 0
+
+def get_manifest(root=None) -> dict:
+    return copy.deepcopy(get_config_snapshot(root).manifest())
     
-def get_as_path(file:str, root=get_root()) -> str:
+def get_as_path(file:str, root=None) -> str:
     """returns the path to the file or directory within the profile root ({root}/{file})"""
+    if root is None:
+        root = get_root()
     flatten = file.replace("\\","/")
     return f"{root}/{flatten}" if not flatten.startswith(root) else flatten
 
 def get_config(
-        root=get_root(), 
+        root=None, 
         type=ConfigType(True,True),
         remote_root=None
         ) -> dict:
-    config = dict()
-    rel_config = (
-            DirNames.FILE_CONFIG
-        if type.is_client else 
-            DirNames.FILE_CONFIG_SERVER
-        )
+    snapshot = get_config_snapshot(root)
     if type.is_local:
-        path = get_as_path(rel_config,root=root)
-        try:
-            with open(path,"r") as fp:
-                config = json.load(fp)
-        except:
-            pass
+        config = snapshot.local_config(is_client=type.is_client)
     else:
-        if remote_root is None or len(remote_root) < 1:
-            raise ConnectionRefusedError(f"remote '{remote_root}' does not exist")
-        parsed = urlparse(remote_root)
-        split = remote_root.split("/")
-        domain = parsed.netloc
-        resource = f"{parsed.path}/{rel_config}"
-        connection = HTTPSConnection(domain, timeout=180)
-        # first, get the latest version
-        connection.request("GET",resource)
-        with connection.getresponse() as response:
-            if response.status == 200:
-                try:
-                    resp = response.read()
-                    config = json.loads(resp.decode("UTF-8"))
-                except:
-                    pass
-        connection.close()
-    return config
+        config = snapshot.remote_config(remote_root, is_client=type.is_client)
+    # callers are free to modify the config they get
+    return copy.deepcopy(config)
 
 def get_config_option(
         key:str,
         default=None,
-        overrides=[
-            get_config(type=ConfigType(True,True))
-        ]
+        overrides=None
         ):
     """
+    `overrides` defaults to the local client config.
+
     for server override behaviour :
     ```
     overrides=[
@@ -198,71 +283,118 @@ def get_config_option(
     ]
     ```
     """
+    if overrides is None:
+        overrides = [get_config_snapshot().local_config(is_client=True)]
     for d in overrides:
         if key in d:
             return d[key]
     return default
 
 def get_current_config_type() -> ConfigType:
-    # in order :
-    # 1. local or remote ?
-    #       check on local config if anything forces local
-    # 2. client or server ?
-    is_local = get_config_option(
-        "force-local-config",
-        False,
-        overrides=[
-            get_config(type=ConfigType(False,True)),
-            get_config(type=ConfigType(True,True))
-        ]
-    )
-    is_client = not (os.path.isfile(get_as_path(DirNames.FILE_SERVER_MARKER)) and os.path.isfile(get_as_path(DirNames.FILE_CONFIG_SERVER)))
+    return get_config_snapshot().config_type()
+
+
+class PathMatcher:
+    """Compiled list of relative path prefixes (as used by "bundle-exclude",
+    "client-side-only", "upgrade-ignore-*"...). A path matches if it starts
+    with any of the prefixes.
 
-    return ConfigType(is_client, is_local)
+    Prefixes covered by a shorter one are dropped and the others are kept
+    sorted, so the only candidate for a path is the greatest prefix not
+    greater than it: matching is a single binary search."""
 
+    def __init__(self, prefixes=[]):
+        self.prefixes = []
+        for prefix in sorted(set(p.replace("\\","/") for p in prefixes if len(p) > 0)):
+            if len(self.prefixes) == 0 or not prefix.startswith(self.prefixes[-1]):
+                self.prefixes.append(prefix)
+
+    def matches(self, path:str) -> bool:
+        index = bisect_right(self.prefixes, path) - 1
+        return index >= 0 and path.startswith(self.prefixes[index])
+
+    def matches_dir(self, path:str) -> bool:
+        """true if every path inside the directory `path` matches"""
+        return self.matches(f"{path}/" if not path.endswith("/") else path)
+
+    def __len__(self) -> int:
+        return len(self.prefixes)
+
+    def as_matcher(prefixes) -> "PathMatcher":
+        return prefixes if isinstance(prefixes, PathMatcher) else PathMatcher(prefixes)
 
 def is_excluded(path:str, exclude:list) -> bool:
     root = get_root()
     cleaned = path.replace("\\","/").replace(f"{root}/","")
-    return (
-        cleaned in exclude
-        or any(f for f in exclude if cleaned.startswith(f))
-    )
+    return PathMatcher.as_matcher(exclude).matches(cleaned)
 
 def list_content(root:str, include=["/"], exclude=[]) -> list:
     """Returns a list of relative paths to all the files found.
 
     `root` : the root directory where to start the search
     `include` : a list of directories to search (relatively to `path`)
-    `exclude` : a list of directories and files to ignore (relatively to `path`)"""
+    `exclude` : a list (or PathMatcher) of directories and files to ignore
+    (relatively to `path`), excluded directories are not walked through"""
 
+    root = root.replace("\\","/")
+    matcher = PathMatcher.as_matcher(exclude)
     content = []
+    seen = set()
     for path in include:
         cleaned = path if not path.endswith("/") or path.endswith("\\") else path[0:len(path)-1]
-        absolute = get_as_path(cleaned)
-        if os.path.isfile(absolute) and not cleaned in content:
-            content.append(cleaned.replace("\\","/"))
+        cleaned = cleaned.replace("\\","/")
+        absolute = get_as_path(cleaned, root=root)
+        if os.path.isfile(absolute) and not cleaned in seen:
+            seen.add(cleaned)
+            content.append(cleaned)
         elif os.path.isdir(absolute):
-            for w_root,_,files in os.walk(absolute):
-                root_name = w_root.replace(f"{root}/","")
-                if is_excluded(root_name,exclude):
+            for w_root,dirs,files in os.walk(absolute):
+                root_name = os.path.relpath(w_root, root).replace("\\","/")
+                prefix = f"{root_name}/" if not root_name == "." else ""
+                if len(prefix) > 0 and matcher.matches_dir(root_name):
+                    dirs.clear()
                     continue
+                # pruning excluded directories before descending into them
+                dirs[:] = [d for d in dirs if not matcher.matches_dir(f"{prefix}{d}")]
                 for file in files:
-                    rel_file = f"{root_name}/{file}"
-                    if is_excluded(rel_file,exclude) or rel_file in content:
+                    rel_file = f"{prefix}{file}"
+                    if rel_file in seen or matcher.matches(rel_file):
                         continue
-                    content.append(rel_file.replace("\\","/"))
+                    seen.add(rel_file)
+                    content.append(rel_file)
     return content
 
-def get_file_hash(absolute_file:str) -> str:
-    h = hashlib.md5()
-    with open(absolute_file, 'rb') as f:
-        while True:
-            # Reading is buffered, so we can read smaller chunks.
-            chunk = f.read(h.block_size)
-            if not chunk:
-                break
-            h.update(chunk)
+# md5 is the algorithm used by every version content file written
+# before the algorithm was recorded in it.
+LEGACY_HASH_ALGORITHM = "md5"
+DEFAULT_HASH_ALGORITHM = "blake2b"
+HASH_ALGORITHMS = {
+    "md5": hashlib.md5,
+    "sha1": hashlib.sha1,
+    "sha256": hashlib.sha256,
+    # same digest length as md5, but faster on 64 bits CPUs
+    "blake2b": lambda: hashlib.blake2b(digest_size=16),
+    "blake2s": hashlib.blake2s
+}
+_HASH_BUFFER_SIZE = 1024*1024
+
+def new_hash(algorithm=DEFAULT_HASH_ALGORITHM):
+    if algorithm in HASH_ALGORITHMS:
+        return HASH_ALGORITHMS[algorithm]()
+    try:
+        return hashlib.new(algorithm)
+    except (ValueError, TypeError):
+        raise ValueError(f"hash algorithm '{algorithm}' is not supported")
+
+def get_file_hash(absolute_file:str, algorithm=DEFAULT_HASH_ALGORITHM) -> str:
+    h = new_hash(algorithm)
+    buffer = bytearray(_HASH_BUFFER_SIZE)
+    view = memoryview(buffer)
+    # unbuffered, large reads: one syscall per MiB, and no copy
+    # between the file buffer and ours.
+    with open(absolute_file, 'rb', buffering=0) as f:
+        while size := f.readinto(buffer):
+            h.update(view[:size])
     return h.hexdigest()
 
 def print_progess_bar(
@@ -279,7 +411,8 @@ def print_progess_bar(
         fill_color=Color.from_int(92),
         current_color=Color.from_int(92),
         empty_color=Color.GREY,
-        done_color=Color.CYAN
+        done_color=Color.CYAN,
+        term_width=None
         ):
     """Styles :
     classic: 
@@ -291,11 +424,8 @@ def print_progess_bar(
         empty="·", 
         current=" ᗧ"
     """
-    term_width = 1920
-    try:
-        term_width = os.get_terminal_size()[0]
-    except:
-        pass
+    if term_width is None:
+        term_width = get_terminal_width()
     c_progess = min(max(progress,0),1)
     last_iter = c_progess == 1
 
@@ -319,6 +449,12 @@ def print_progess_bar(
         end="\r" if not last_iter else "\n"
         )
 
+def get_terminal_width() -> int:
+    try:
+        return os.get_terminal_size()[0]
+    except:
+        return 1920
+
 def byte_str(bytes:int, unit_name="auto", unit_byte_amount=-1, number_format="auto") -> str:
     format = number_format
     divider = unit_byte_amount
@@ -344,6 +480,103 @@ def byte_str(bytes:int, unit_name="auto", unit_byte_amount=-1, number_format="au
         format = "{:.1f}" if amount < 10 else "{:.0f}"
     return f"{format.format(amount)} {unit}"
 
+class ProgressUnit:
+    COUNT = "count"
+    BYTES = "bytes"
+
+class Progress:
+    """Progress bar for long loops, shared by every mode.
+
+    Rendering is throttled to one bar every `interval` seconds (plus the
+    final one), so its cost does not depend on the amount of updates.
+    Nothing is printed when the output is not a terminal.
+
+    ```
+    progress = Progress(len(files), "  hashing files")
+    for f in files:
+        ...
+        progress.update()
+    progress.close()
+    ```
+    """
+
+    def __init__(
+            self,
+            total:int,
+            label:str,
+            unit=ProgressUnit.COUNT,
+            interval=0.1,
+            length=50,
+            verbose=True
+            ):
+        self.total = max(total,0)
+        self.label = label
+        self.unit = unit
+        self.interval = interval
+        self.length = length
+        self.done = 0
+        self.enabled = verbose and sys.stdout.isatty()
+        self._closed = False
+        self._next_render = 0
+        self._lock = threading.Lock()
+        self._term_width = get_terminal_width() if self.enabled else 0
+
+    def update(self, amount=1):
+        with self._lock:
+            self.done += amount
+            if self.enabled and time.monotonic() >= self._next_render and self.done < self.total:
+                self._render()
+
+    def set(self, done:int):
+        with self._lock:
+            self.done = done
+            if self.enabled and time.monotonic() >= self._next_render and self.done < self.total:
+                self._render()
+
+    def close(self):
+        """renders the final state of the bar, only once"""
+        with self._lock:
+            if self.enabled and not self._closed and self.total > 0:
+                self.done = max(self.done, self.total)
+                self._render()
+            self._closed = True
+
+    def _render(self):
+        if self.unit == ProgressUnit.BYTES:
+            counter = f"{byte_str(self.done)}/{byte_str(self.total)}"
+        else:
+            counter = f"{self.done}/{self.total}"
+        print_progess_bar(
+            self.done/self.total if self.total > 0 else 1,
+            self.length,
+            prepend=f"{self.label}: {counter} [",
+            term_width=self._term_width
+        )
+        self._next_render = time.monotonic()+self.interval
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def get_int_arg(args:list, option:str, default=None, minimum=1):
+    """returns the value of the `{option}=<n>` argument, or `default` if it
+    is not given. Raises a ValueError explaining the expected value if it
+    is not a whole number of at least `minimum`."""
+    prefix = f"{option}="
+    value = default
+    for a in args:
+        if a.startswith(prefix):
+            raw = a[len(prefix):len(a)]
+            try:
+                value = int(raw)
+            except ValueError:
+                value = None
+            if value is None or value < minimum:
+                raise ValueError(f"{option} expects a whole number of at least {minimum}, got \"{raw}\"")
+    return value
+
 def accept_answer(
         answer:str, 
         default=True, 
@@ -390,6 +623,7 @@ def add_closing_task(task):
     closing_tasks.append(task)
 
 def execute_closing_tasks(fail_on_error=False):
+    import subprocess
     for task in closing_tasks:
         try:
             subprocess.Popen(
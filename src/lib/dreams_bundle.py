@@ -1,12 +1,14 @@
 #!/bin/env python3
 import os
-import tempfile
 import shutil
 import lib.dreams as dreams
 from zipfile import ZipFile, ZIP_DEFLATED
-import zipfile
 from lib.dreams import DirNames
-from lib.dreams_upgrade import ContentDifference
+from lib.dreams_upgrade import ContentDifference, VersionContent, format_version_content
+from lib.dreams_manifest import write_manifest
+from lib.dreams_hash import HashCache, hash_files
+from lib.dreams_place import place_file
+from lib.dreams_delta import DELTA_MIN_SIZE, get_signature_path, write_signature
 from os import sep as SEP
 import json
 
@@ -60,10 +62,6 @@ def get_version_adjustement(current_version:str, diff:ContentDifference) -> str:
 
     return ver_string
 
-def get_file_content_format(relative_filepath:str, root:str) -> str:
-    absolute = f"{root}/{relative_filepath}"
-    return f"{relative_filepath}:{dreams.get_file_hash(absolute)}"
-
 def split_file_hash(entry:str) -> (str,str):
     if ":" in entry:
         split = entry.split(":")
@@ -77,12 +75,51 @@ def exclude_from_diff(
         exclude_removed=True,
         exclude_modified=True
         ):
-    if exclude_added and relative in diff.added:
-        diff.added.remove(relative)
-    if exclude_removed and relative in diff.removed:
-        diff.removed.remove(relative)
-    if exclude_modified and relative in diff.modified:
-        diff.modified.remove(relative)
+    if exclude_added:
+        diff.added.discard(relative)
+    if exclude_removed:
+        diff.removed.discard(relative)
+    if exclude_modified:
+        diff.modified.discard(relative)
+
+def create_patch(release_path:str, content:VersionContent, previous_content:VersionContent, target:str) -> ContentDifference:
+    """Writes to `target` the patch archive upgrading the previous release
+    to the one in `release_path`: the added and modified files, and the
+    list of the removed ones (DirNames.FILE_PATCH_REMOVED)."""
+    diff = ContentDifference(previous_content, content)
+    files = [*diff.added, *diff.modified]
+    # always replaced by the upgrades
+    for f in (DirNames.FILE_VERSION_CONTENT, DirNames.FILE_VERSION_CONTENT_BINARY, DirNames.FILE_VERSION_CHECKER):
+        if not f in files and os.path.isfile(f"{release_path}/{f}"):
+            files.append(f)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with ZipFile(target, "w", compression=ZIP_DEFLATED) as zip:
+        for f in files:
+            zip.write(f"{release_path}/{f}", f)
+        zip.writestr(DirNames.FILE_PATCH_REMOVED, "".join(f"{r}\n" for r in diff.removed))
+    return diff
+
+def create_patches(release_dir:str, release_name:str, content:VersionContent, count:int):
+    """creates the patch archives from the `count` last releases to the
+    release `release_name`, in its DirNames.PATCHES directory"""
+    release_path = f"{release_dir}/{release_name}"
+    previous_releases = sorted(
+        [r for r in os.listdir(release_dir) if not r in (release_name, f"{release_name}.zip")],
+        reverse=True
+        )
+    for previous in previous_releases[0:count]:
+        previous_name = previous[0:-len(".zip")] if previous.endswith(".zip") else previous
+        try:
+            previous_content = ContentDifference.get_content(f"{release_dir}/{previous}", algorithm=content.algorithm)
+        except (FileNotFoundError, KeyError):
+            print(f"  no content found for release {previous_name}, skipping its patch.")
+            continue
+        if not previous_content.algorithm == content.algorithm:
+            print(f"  release {previous_name} is hashed with {previous_content.algorithm}, skipping its patch.")
+            continue
+        target = f"{release_path}/{DirNames.PATCHES}/{previous_name}.zip"
+        diff = create_patch(release_path, content, previous_content, target)
+        print(f"  patch from {previous_name}: {len(diff.added)+len(diff.modified)} file(s), {dreams.byte_str(os.path.getsize(target))}")
 
 def main(args:list):
     archive_result = "--archive" in args or "-a" in args
@@ -107,6 +144,26 @@ def main(args:list):
     content_config = dreams.get_config()
     include = content_config.get("bundle-include",[])
     exclude = content_config.get("bundle-exclude",[])
+    hash_algorithm = content_config.get("hash-algorithm", dreams.DEFAULT_HASH_ALGORITHM)
+    # fails early on an unsupported algorithm
+    dreams.new_hash(hash_algorithm)
+    try:
+        # 0 overrides the config, creating no patch archive
+        patch_count = dreams.get_int_arg(args, "--patches", default=content_config.get("bundle-patches", 0), minimum=0)
+    except ValueError as e:
+        print(f"ERROR: {e}, see --help.")
+        return
+
+    # the hash cache is local to this machine and changes on every run
+    exclude.append(DirNames.CACHE)
+    # the binary manifest of the profile describes an older version, it is
+    # written again with --binary-content
+    exclude.append(DirNames.FILE_VERSION_CONTENT_BINARY)
+
+    hash_cache = HashCache(root)
+    if "--rehash" in args:
+        print("  invalidating the hash cache...")
+        hash_cache.invalidate()
 
     if content_config.get("bundle-exclude-orphans", False):
         # auto exclude orphan configs
@@ -130,11 +187,20 @@ def main(args:list):
         if not last_version[last_version.rfind("-")+1:len(last_version)] == version:
             print("  version increment explicitly specified, skipping.")
         else:
+            last_content = ContentDifference.get_content(f"{dreams.get_as_path(DirNames.RELEASES)}/{last_version}")
             diff = ContentDifference(
-                ContentDifference.get_content(f"{dreams.get_as_path(DirNames.RELEASES)}/{last_version}"),
-                ContentDifference.get_content(root, use_cache=False, include=include, exclude=exclude)
+                last_content,
+                ContentDifference.get_content(
+                    root,
+                    use_cache=False,
+                    include=include,
+                    exclude=exclude,
+                    hash_cache=hash_cache,
+                    algorithm=last_content.algorithm
+                    )
                 )
             exclude_from_diff(DirNames.FILE_VERSION_CONTENT, diff)
+            exclude_from_diff(DirNames.FILE_VERSION_CONTENT_BINARY, diff)
             exclude_from_diff(DirNames.FILE_VERSION_CHECKER, diff)
             adj_version = get_version_adjustement(manifest["version"], diff)
             skip = adj_version == version
@@ -167,6 +233,7 @@ f"""  Version difference detected:
             data["version"] = version
         with open(man_file,"w") as out:
             json.dump(data,out,indent=4)
+        dreams.invalidate_config()
 
         print("✓ incrementation done!")
 
@@ -187,7 +254,8 @@ f"""  Version difference detected:
         out.write(version_config_str)
 
 
-    bundle_list = dreams.list_content(root, include=include, exclude=exclude)
+    exclude_matcher = dreams.PathMatcher(exclude)
+    bundle_list = dreams.list_content(root, include=include, exclude=exclude_matcher)
 
     release_dir = f"{root}/{DirNames.RELEASES}"
 
@@ -200,20 +268,18 @@ f"""  Version difference detected:
     if not os.path.isdir(release_dir):
         os.makedirs(release_dir)
 
-    for index, file in enumerate(bundle_list):
+    progress = dreams.Progress(len(bundle_list), "  bundling files")
+    for file in bundle_list:
         absolute = f"{root}{SEP}{file}"
-        dreams.print_progess_bar(
-                (index+1)/len(bundle_list),
-                50,
-                prepend=f"  bundling files: {index+1}/{len(bundle_list)} ["
-                )
-        if not dreams.is_excluded(file,exclude):
+        progress.update()
+        if not exclude_matcher.matches(file):
             dest_path = f"{dir_path}/{file}"
             if not os.path.isdir(os.path.dirname(dest_path)):
                 os.makedirs(os.path.dirname(dest_path))
-            shutil.copy(absolute,dest_path)
+            place_file(absolute,dest_path)
         else:
             continue
+    progress.close()
 
     print("✓ bundling done!")
 
@@ -221,30 +287,69 @@ f"""  Version difference detected:
 
     print("  creating version content file...")
 
-    content_str = ""
     content_queue = []
-    for root, _, files in os.walk(dir_path):
+    for w_root, _, files in os.walk(dir_path):
         for file in files:
-            relative = f"{root}/{file}".replace("\\","/").replace(f"{dir_path}/","")
+            relative = f"{w_root}/{file}".replace("\\","/").replace(f"{dir_path}/","")
             content_queue.append(relative)
 
-    for index, key in enumerate(content_queue):
-        dreams.print_progess_bar(
-            (index+1)/len(content_queue),
-            50,
-            f"  hashing files: {(index+1)}/{len(content_queue)} ["
+    # files in the release are exact copies of the ones in the profile,
+    # so hashing the profile allows to use the cache.
+    with dreams.Progress(len(content_queue), "  hashing files") as progress:
+        hashes = hash_files(
+            root,
+            content_queue,
+            hash_cache=hash_cache,
+            algorithm=hash_algorithm,
+            workers=content_config.get("hash-workers",None),
+            progress=progress
         )
-        content_str += (get_file_content_format(key, dir_path)+"\n")
-    content_str += DirNames.FILE_VERSION_CONTENT
+    sizes = {f: os.path.getsize(f"{dir_path}/{f}") for f in content_queue}
+    binary_content = "--binary-content" in args or content_config.get("bundle-binary-content", False)
+    content_str = format_version_content(
+        hashes,
+        hash_algorithm,
+        sizes=sizes,
+        unhashed=[DirNames.FILE_VERSION_CONTENT_BINARY] if binary_content else []
+        )
+    hash_cache.save()
+    print(f"  hash cache: {hash_cache.stats_str()}")
 
     content_path = f"{dir_path}/{DirNames.FILE_VERSION_CONTENT}"
     if not os.path.isdir(os.path.dirname(content_path)):
         os.makedirs(os.path.dirname(content_path))
     with open(content_path, "w") as out:
         out.write(content_str)
+    if binary_content:
+        write_manifest(
+            hashes,
+            f"{dir_path}/{DirNames.FILE_VERSION_CONTENT_BINARY}",
+            hash_algorithm,
+            sizes=sizes,
+            unhashed=[DirNames.FILE_VERSION_CONTENT, DirNames.FILE_VERSION_CONTENT_BINARY]
+            )
 
     print("✓ content file written!")
 
+    # written after the version content, signatures and patches are not
+    # part of the pack
+    if "--signatures" in args or content_config.get("bundle-signatures", False):
+        signed = [f for f in content_queue if os.path.getsize(f"{dir_path}/{f}") >= DELTA_MIN_SIZE]
+        with dreams.Progress(len(signed), "  writing block signatures") as progress:
+            for f in signed:
+                progress.update()
+                write_signature(f"{dir_path}/{f}", f"{dir_path}/{get_signature_path(f)}", algorithm=hash_algorithm)
+        print(f"✓ block signatures of {len(signed)} file(s) written!")
+
+    if patch_count > 0:
+        print("  creating patch archives...")
+        # the version content lists itself without hash
+        content = VersionContent({**hashes, DirNames.FILE_VERSION_CONTENT: ""}, algorithm=hash_algorithm)
+        if binary_content:
+            content[DirNames.FILE_VERSION_CONTENT_BINARY] = ""
+        create_patches(release_dir, dir_name, content, patch_count)
+        print("✓ patch archives created!")
+
     if archive_result:
 
         print("  creating the archive...")
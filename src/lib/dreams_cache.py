@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+import os
+import sys
+import threading
+import lib.dreams as dreams
+from lib.dreams_place import place_file
+
+DEFAULT_DOWNLOAD_CACHE_SIZE = 2*1024*1024*1024
+
+def get_user_cache_dir() -> str:
+    """returns the directory of the files cached for every profile of the
+    machine (DREAMS_CACHE_DIR if set)"""
+    path = os.environ.get("DREAMS_CACHE_DIR")
+    if path is None:
+        home = os.path.expanduser("~")
+        if sys.platform == "win32":
+            path = f"{os.environ.get('LOCALAPPDATA', f'{home}/AppData/Local')}/dreams"
+        elif sys.platform == "darwin":
+            path = f"{home}/Library/Caches/dreams"
+        else:
+            path = f"{os.environ.get('XDG_CACHE_HOME', f'{home}/.cache')}/dreams"
+    return path.replace("\\","/")
+
+class DownloadCache:
+    """Size bounded cache of downloaded files, shared by every profile of
+    the machine and keyed by the hash of the files, so a file downloaded
+    once (archive, upgrade file) is never downloaded again while it is
+    cached, whatever the version or profile asking for it.
+
+    Files are stored as `{path}/{algorithm}/{hash[0:2]}/{hash}`, their mtime
+    is their last use: `trim()` removes the least recently used ones once
+    the cache is bigger than `max_size` bytes."""
+
+    def __init__(self, path=None, max_size=DEFAULT_DOWNLOAD_CACHE_SIZE):
+        self.path = (path if not path is None else f"{get_user_cache_dir()}/downloads").replace("\\","/")
+        self.max_size = max_size
+        self.hits = 0
+        self.hit_bytes = 0
+        self._lock = threading.Lock()
+
+    def path_for(self, digest:str, algorithm=dreams.DEFAULT_HASH_ALGORITHM) -> str:
+        return f"{self.path}/{algorithm}/{digest[0:2]}/{digest}"
+
+    def contains(self, digest:str, algorithm=dreams.DEFAULT_HASH_ALGORITHM) -> bool:
+        return not digest is None and len(digest) > 0 and os.path.isfile(self.path_for(digest, algorithm))
+
+    def get(self, digest:str, target:str, algorithm=dreams.DEFAULT_HASH_ALGORITHM) -> bool:
+        """places the cached file at `target`, returns False if it is not
+        cached"""
+        if digest is None or len(digest) == 0:
+            return False
+        cached = self.path_for(digest, algorithm)
+        try:
+            os.utime(cached)
+            place_file(cached, target)
+        except OSError:
+            return False
+        with self._lock:
+            self.hits += 1
+            self.hit_bytes += os.path.getsize(target)
+        return True
+
+    def put(self, src:str, digest:str, algorithm=dreams.DEFAULT_HASH_ALGORITHM):
+        """caches a copy of `src`, whose hash is `digest`"""
+        if digest is None or len(digest) == 0 or self.max_size <= 0:
+            return
+        cached = self.path_for(digest, algorithm)
+        if os.path.isfile(cached):
+            os.utime(cached)
+            return
+        try:
+            os.makedirs(os.path.dirname(cached), exist_ok=True)
+            place_file(src, cached)
+        except OSError:
+            pass
+
+    def discard(self, digest:str, algorithm=dreams.DEFAULT_HASH_ALGORITHM):
+        """removes the cached file, found not to match its hash"""
+        try:
+            os.remove(self.path_for(digest, algorithm))
+        except OSError:
+            pass
+
+    def open_entry(self, digest:str, algorithm=dreams.DEFAULT_HASH_ALGORITHM):
+        """returns a CacheEntry to write a file whose hash is `digest` while
+        it downloads, or None if it is already cached or cannot be"""
+        if digest is None or len(digest) == 0 or self.max_size <= 0 or self.contains(digest, algorithm):
+            return None
+        try:
+            return CacheEntry(self.path_for(digest, algorithm))
+        except OSError:
+            return None
+
+    def trim(self):
+        """removes the least recently used files until the cache fits in
+        `max_size`"""
+        files = []
+        total = 0
+        for root, _, names in os.walk(self.path):
+            for name in names:
+                path = f"{root}/{name}"
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        if total <= self.max_size:
+            return
+        for _, size, path in sorted(files):
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            if total <= self.max_size:
+                break
+
+    def stats_str(self) -> str:
+        return f"{self.hits} files ({dreams.byte_str(self.hit_bytes)}) taken from the download cache"
+
+class CacheEntry:
+    """A file being written to the cache, only visible once `commit()` is
+    called (after its hash has been checked)."""
+
+    def __init__(self, target:str):
+        self.target = target
+        self._tmp = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        self._file = open(self._tmp,"wb")
+
+    def write(self, data:bytes):
+        self._file.write(data)
+
+    def commit(self):
+        self._file.close()
+        try:
+            os.replace(self._tmp, self.target)
+        except OSError:
+            self.discard()
+
+    def discard(self):
+        self._file.close()
+        if os.path.lexists(self._tmp):
+            os.remove(self._tmp)
+
+class TeeStream:
+    """Stream (anything with a `read(amount)` method) copying what is read
+    from `stream` to `output`."""
+
+    def __init__(self, stream, output):
+        self.stream = stream
+        self.output = output
+
+    def read(self, amount=-1) -> bytes:
+        data = self.stream.read(amount)
+        self.output.write(data)
+        return data
+
+def get_download_cache(config={}) -> DownloadCache:
+    """returns the download cache, sized by the "download-cache-size" option
+    (in MB, 0 disables it)"""
+    size = config.get("download-cache-size", None)
+    return DownloadCache(max_size=int(size)*1024*1024 if not size is None else DEFAULT_DOWNLOAD_CACHE_SIZE)
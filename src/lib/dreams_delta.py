@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+import os
+import json
+from zipfile import ZipFile, BadZipFile
+import lib.dreams as dreams
+from lib.dreams import DirNames
+
+# files smaller than this are always downloaded whole
+DELTA_MIN_SIZE = 1024*1024
+# blocks of the files that are not archives, and biggest block of archives
+BLOCK_SIZE = 64*1024
+# missing blocks closer than this are fetched with a single request
+MAX_RANGE_GAP = 64*1024
+
+def get_signature_path(relative:str) -> str:
+    """where the block signature of `relative` is kept in a release"""
+    return f"{DirNames.BLOCKS}/{relative}.json"
+
+def get_blocks(path:str) -> list:
+    """Splits the file in `(offset, length)` blocks.
+
+    Archives (jars) are split at the local header of each member and at
+    the central directory, so that a member added, removed or resized
+    does not change the blocks of the others. Other files, and members
+    bigger than BLOCK_SIZE, are split in fixed size blocks."""
+    size = os.path.getsize(path)
+    bounds = {0, size}
+    try:
+        with ZipFile(path, "r") as archive:
+            bounds.update(info.header_offset for info in archive.infolist())
+            bounds.add(archive.start_dir)
+    except (BadZipFile, OSError):
+        pass
+    bounds = sorted(b for b in bounds if 0 <= b <= size)
+    blocks = []
+    for start, end in zip(bounds, bounds[1:]):
+        for offset in range(start, end, BLOCK_SIZE):
+            blocks.append((offset, min(BLOCK_SIZE, end-offset)))
+    return blocks
+
+def compute_signature(path:str, algorithm=dreams.DEFAULT_HASH_ALGORITHM) -> dict:
+    """returns the size and the `[length, hash]` of every block of the file"""
+    signature = []
+    with open(path, "rb") as file:
+        for offset, length in get_blocks(path):
+            file.seek(offset)
+            block_hash = dreams.new_hash(algorithm)
+            block_hash.update(file.read(length))
+            signature.append([length, block_hash.hexdigest()])
+    return {"algorithm": algorithm, "size": os.path.getsize(path), "blocks": signature}
+
+def write_signature(path:str, target:str, algorithm=dreams.DEFAULT_HASH_ALGORITHM):
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(target, "w", encoding="UTF-8") as out:
+        json.dump(compute_signature(path, algorithm), out, separators=(",",":"))
+
+def download_delta(client, relative:str, local:str, target:str, algorithm=dreams.DEFAULT_HASH_ALGORITHM) -> tuple:
+    """Rebuilds the file `relative` of the repository at `target` from its
+    previous version `local`: the blocks `local` has are copied from it,
+    only the others are downloaded (Range requests).
+
+    `client` : the RepositoryClient of the release, providing the block
+    signature of the file (see `get_signature_path`)
+
+    Returns the hash of the rebuilt file and the amount of bytes
+    downloaded, or None if the release has no signature for the file or
+    the server cannot send parts of it. The hash has to be checked by the
+    caller."""
+    signature = client.get_json(get_signature_path(relative))
+    if not isinstance(signature, dict) or not signature.get("algorithm") == algorithm:
+        return None
+    info = client.get_file_info(relative)
+    if info is None or not info["ranges"] or info["validator"] is None or not info["size"] == signature["size"]:
+        return None
+
+    local_signature = compute_signature(local, algorithm)
+    local_blocks = {}
+    offset = 0
+    for length, block_hash in local_signature["blocks"]:
+        local_blocks.setdefault(block_hash, (offset, length))
+        offset += length
+
+    tmp_target = f"{target}.tmp"
+    missing = []
+    try:
+        with open(local, "rb") as source, open(tmp_target, "wb") as output:
+            output.truncate(signature["size"])
+            offset = 0
+            for length, block_hash in signature["blocks"]:
+                if block_hash in local_blocks:
+                    source.seek(local_blocks[block_hash][0])
+                    output.seek(offset)
+                    output.write(source.read(length))
+                elif len(missing) > 0 and offset-missing[-1][1] <= MAX_RANGE_GAP:
+                    missing[-1][1] = offset+length
+                else:
+                    missing.append([offset, offset+length])
+                offset += length
+        for start, end in missing:
+            client.download_range(relative, tmp_target, start, end, info["validator"])
+        digest = dreams.get_file_hash(tmp_target, algorithm=algorithm)
+        os.replace(tmp_target, target)
+    except BaseException:
+        if os.path.lexists(tmp_target):
+            os.remove(tmp_target)
+        raise
+    return (digest, sum(end-start for start, end in missing))
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+import os
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import lib.dreams as dreams
+from lib.dreams import DirNames
+
+# upper bound of the total size of the files being hashed at the same time
+DEFAULT_MAX_INFLIGHT_BYTES = 256*1024*1024
+
+class HashCache:
+    """Persistent on-disk cache of file hashes for a profile.
+
+    Entries are keyed by the path relative to `root` and are only trusted
+    while the size, mtime (ns) and inode of the file are unchanged, so an
+    unchanged file is never read twice."""
+
+    FORMAT_VERSION = 2
+
+    def __init__(self, root:str, path=None):
+        self.root = root.replace("\\","/")
+        self.path = path if not path is None else dreams.get_as_path(DirNames.FILE_HASH_CACHE, root=self.root)
+        self.hits = 0
+        self.misses = 0
+        self._entries = None
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def _load(self) -> dict:
+        if self._entries is None:
+            entries = dict()
+            try:
+                with open(self.path,"r",encoding="UTF-8") as fp:
+                    data = json.load(fp)
+                if data.get("version") == HashCache.FORMAT_VERSION:
+                    entries = data.get("entries",{})
+            except (OSError, ValueError):
+                pass
+            self._entries = entries
+        return self._entries
+
+    def get_file_hash(self, relative:str, algorithm=dreams.DEFAULT_HASH_ALGORITHM) -> str:
+        """returns the hash of `{root}/{relative}`, reading the file only if
+        its stat does not match the cached one."""
+        relative = relative.replace("\\","/")
+        absolute = f"{self.root}/{relative}"
+        stat = os.stat(absolute)
+        key = [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+        with self._lock:
+            entry = self._load().get(relative)
+            if not entry is None and entry[0:3] == key and algorithm in entry[3]:
+                self.hits += 1
+                return entry[3][algorithm]
+            self.misses += 1
+        digest = dreams.get_file_hash(absolute, algorithm=algorithm)
+        self._store(relative, key, digest, algorithm)
+        return digest
+
+    def record(self, relative:str, digest:str, algorithm=dreams.DEFAULT_HASH_ALGORITHM):
+        """stores the hash of a file that has just been written, computed
+        from the bytes written (see `write_hashed`), so that the file does
+        not have to be read again."""
+        relative = relative.replace("\\","/")
+        stat = os.stat(f"{self.root}/{relative}")
+        self._store(relative, [stat.st_size, stat.st_mtime_ns, stat.st_ino], digest, algorithm)
+
+    def _store(self, relative:str, key:list, digest:str, algorithm:str):
+        with self._lock:
+            entries = self._load()
+            entry = entries.get(relative)
+            if entry is None or not entry[0:3] == key:
+                entry = [*key, dict()]
+                entries[relative] = entry
+            entry[3][algorithm] = digest
+            self._dirty = True
+
+    def invalidate(self, relative=None):
+        """drops the entry of `relative`, or every entry if not specified."""
+        with self._lock:
+            if relative is None:
+                self._entries = dict()
+                self._dirty = True
+            elif relative.replace("\\","/") in self._load():
+                del self._entries[relative.replace("\\","/")]
+                self._dirty = True
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            if not os.path.isdir(os.path.dirname(self.path)):
+                os.makedirs(os.path.dirname(self.path))
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path,"w",encoding="UTF-8") as out:
+                json.dump({"version": HashCache.FORMAT_VERSION, "entries": self._entries}, out, separators=(",",":"))
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+
+    def stats_str(self) -> str:
+        return f"{self.hits} cached, {self.misses} hashed"
+
+def write_hashed(chunks, target:str, algorithm=dreams.DEFAULT_HASH_ALGORITHM) -> str:
+    """writes the bytes of `chunks` to `target` (replaced) and returns
+    their hash"""
+    file_hash = dreams.new_hash(algorithm)
+    # never writing through the existing target, which may be a hardlink
+    # to a shared file
+    tmp_target = f"{target}.tmp"
+    try:
+        with open(tmp_target,"wb") as out:
+            for chunk in chunks:
+                file_hash.update(chunk)
+                out.write(chunk)
+        os.replace(tmp_target, target)
+    except BaseException:
+        if os.path.lexists(tmp_target):
+            os.remove(tmp_target)
+        raise
+    return file_hash.hexdigest()
+
+def hash_files(
+        root:str,
+        files:list,
+        hash_cache=None,
+        algorithm=dreams.DEFAULT_HASH_ALGORITHM,
+        workers=None,
+        max_inflight_bytes=DEFAULT_MAX_INFLIGHT_BYTES,
+        progress=None
+        ) -> dict:
+    """Hashes `files` (relative to `root`) on a bounded thread pool.
+
+    `hash_cache` : optional HashCache to read from and update
+    `algorithm` : the hash algorithm to use (see `dreams.HASH_ALGORITHMS`)
+    `workers` : amount of threads, defaults to the amount of cores
+    `max_inflight_bytes` : no new file is scheduled while the files being
+    hashed exceed this size (a single bigger file is still allowed)
+    `progress` : optional dreams.Progress, updated once per file
+
+    The returned dict follows the order of `files`, whatever the order in
+    which the hashes were computed."""
+    if workers is None:
+        workers = min(32, os.cpu_count() or 1)
+    root = root.replace("\\","/")
+    total = len(files)
+    results = [None]*total
+
+    def hash_one(relative:str) -> str:
+        if not hash_cache is None:
+            return hash_cache.get_file_hash(relative, algorithm=algorithm)
+        return dreams.get_file_hash(f"{root}/{relative}", algorithm=algorithm)
+
+    if workers <= 1 or total <= 1:
+        for index, relative in enumerate(files):
+            results[index] = hash_one(relative)
+            if not progress is None:
+                progress.update()
+        return dict(zip(files, results))
+
+    inflight = 0
+    pending = dict()
+    def collect():
+        nonlocal inflight
+        done, _ = wait(pending.keys(), return_when=FIRST_COMPLETED)
+        for future in done:
+            index, size = pending.pop(future)
+            results[index] = future.result()
+            inflight -= size
+            if not progress is None:
+                progress.update()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for index, relative in enumerate(files):
+            size = os.path.getsize(f"{root}/{relative}")
+            while len(pending) > 0 and (
+                len(pending) >= 2*workers
+                or inflight+size > max_inflight_bytes
+            ):
+                collect()
+            pending[pool.submit(hash_one, relative)] = (index, size)
+            inflight += size
+        while len(pending) > 0:
+            collect()
+
+    return dict(zip(files, results))
@@ -1,41 +1,60 @@
 #!/bin/env python3
 import os
-import shutil
+import time
 import tempfile
-from http.client import HTTPSConnection
-from zipfile import ZipFile
+from zipfile import ZipFile, BadZipFile
 import json
 from datetime import datetime
 from urllib.parse import urlparse
 import lib.dreams as dreams
 from lib.dreams import Color
+from lib.dreams_hash import HashCache, hash_files, write_hashed
+from lib.dreams_place import place_file
+from lib.dreams_store import SharedStore, get_profile_store, enable_profile_store
+from lib.dreams_net import RepositoryClient, ResumableStream, CONNECTION_ERRORS
+from lib.dreams_zipstream import ZipStreamReader, UnsupportedLayout
+from lib.dreams_cache import TeeStream, get_download_cache
 import string
+from concurrent.futures import ThreadPoolExecutor
 
 DEFAULT_REPOSITORY_PATH = "https://sawors.net/modpacks"
+# decompression and writes release the GIL, threads are enough
+DEFAULT_EXTRACT_WORKERS = min(8, os.cpu_count() or 1)
 
 class InstallMode:
     CLIENT = "client"
     SERVER = "server"
 
+def get_latest_meta(repo:str) -> dict:
+    """returns the content of the latest release description of the
+    repository, or None if it could not be retrieved"""
+    data = RepositoryClient(repo).get_json(dreams.DirNames.Server.LATEST_META)
+    return data if isinstance(data, dict) else None
+
 def get_latest_release_name(repo:str) -> tuple[str,str]:
-    latest_version_name = None
-    latest_version = None
-    parsed = urlparse(repo)
-    connection = HTTPSConnection(parsed.netloc, timeout=180)
-    # first, get the latest version
-    connection.request("GET",f"{parsed.path}/{dreams.DirNames.Server.LATEST_META}")
-    with connection.getresponse() as response:
-        if not response.status == 200:
-            return None
-        try:
-            resp = response.read()
-            data = json.loads(resp.decode("UTF-8"))
-            latest_version = data.get("version",None)
-            latest_version_name = data.get("version-name",None)
-        except:
-            pass
-    connection.close()
-    return (latest_version,latest_version_name)
+    data = get_latest_meta(repo)
+    if data is None:
+        return None
+    return (data.get("version",None),data.get("version-name",None))
+
+def get_release_algorithm(repo:str, version_name:str) -> str:
+    """returns the hash algorithm of the version content of the release
+    `version_name`, read from the header of its version content file
+    (DEFAULT_HASH_ALGORITHM if it could not be retrieved)"""
+    from lib.dreams_upgrade import get_version_content
+    if version_name is None:
+        return dreams.DEFAULT_HASH_ALGORITHM
+    client = RepositoryClient(f"{repo}/{dreams.DirNames.Server.VERSIONS}/{version_name}")
+    try:
+        # the header is the first line, no need for the whole file
+        with client.request(dreams.DirNames.FILE_VERSION_CONTENT, headers={"Range": "bytes=0-255"}) as response:
+            if not response.status in (200, 206):
+                response.read()
+                return dreams.DEFAULT_HASH_ALGORITHM
+            first_line = response.read(256).split(b"\n")[0]
+    except CONNECTION_ERRORS:
+        return dreams.DEFAULT_HASH_ALGORITHM
+    return get_version_content([first_line]).algorithm
 
 def get_custom_profile(profile_path:str, mc_path:str) -> dict:
     if not (
@@ -89,40 +108,83 @@ def inject_profile(minecraft_dir:str, custom_profile:dict) -> dict:
 
 
 
-def download_pack(url:str, download_location:str, verbose=True) -> str:
+def verify_archive(archive:str, expected_size=None, expected_hash=None, hash_algorithm=dreams.DEFAULT_HASH_ALGORITHM, deep=False):
+    """Checks that `archive` is a complete and valid modpack archive,
+    raises a BadZipFile error if it is not.
+
+    `expected_size`, `expected_hash` : checked if provided
+    `deep` : also checks the CRC of every member (reads the whole archive)"""
+    if not expected_size is None and not os.path.getsize(archive) == expected_size:
+        raise BadZipFile(f"archive size is {os.path.getsize(archive)}, expected {expected_size}")
+    if not expected_hash is None and not dreams.get_file_hash(archive, algorithm=hash_algorithm) == expected_hash:
+        raise BadZipFile("archive hash does not match the one of the repository")
+    # reading the central directory fails on truncated archives
+    with ZipFile(archive,"r") as zip:
+        if not dreams.DirNames.FILE_MANIFEST in zip.namelist():
+            raise BadZipFile("archive does not contain a modpack manifest")
+        if deep:
+            bad_member = zip.testzip()
+            if not bad_member is None:
+                raise BadZipFile(f"archive member {bad_member} is corrupted")
+
+def download_pack(url:str, download_location:str, verbose=True, segments=1, cache=None) -> str:
+    """Downloads the latest archive of the repository in `download_location`.
+    An interrupted download left there is resumed (see
+    `RepositoryClient.download_resumable`), and the archive is verified
+    before being returned.
+
+    `cache` : optional DownloadCache (see dreams_cache) the archive is taken
+    from if it has it, and added to otherwise"""
     _chunk_size = 1024*1024
     if os.path.isfile(download_location):
         raise FileExistsError("file already exists")
     dl_target = f"{download_location}/{dreams.DirNames.Server.LATEST_ARCHIVE}"
-    parsed_url = urlparse(url)
-    connection = HTTPSConnection(parsed_url.netloc, timeout=10)
-    connection.request("GET", f"{parsed_url.path}/{dreams.DirNames.Server.LATEST_ARCHIVE}")
-    with connection.getresponse() as response:
-        headers = response.getheaders()
-        length_header = [v for k,v in headers if k == "Content-Length"]
-        total_size = int(length_header[0]) if len(length_header) > 0 else 1
-        total_size_str = dreams.byte_str(total_size)
-        downloaded = 0
-        with open(dl_target, "ab") as data_output:
-            last_percent = 0
-            while chunk := response.read(_chunk_size):
-                downloaded += len(chunk)
-                if verbose:
-                    progress = downloaded/total_size
-                    percent = int(100*progress)
-                    if percent > last_percent:
-                        last_percent = percent
-                        if verbose:
-                            dreams.print_progess_bar(
-                                progress,
-                                50,
-                                prepend=f"  downloading files: {dreams.byte_str(downloaded)}/{total_size_str} ["
-                                )
-                data_output.write(chunk)
-    connection.close()
+    # the latest release description may describe the archive
+    latest = get_latest_meta(url) or dict()
+    expected_hash = latest.get("archive-hash")
+    hash_algorithm = latest.get("archive-hash-algorithm", dreams.DEFAULT_HASH_ALGORITHM)
+    if not cache is None and cache.get(expected_hash, dl_target, hash_algorithm):
+        try:
+            verify_archive(
+                dl_target,
+                expected_size=latest.get("archive-size"),
+                expected_hash=expected_hash,
+                hash_algorithm=hash_algorithm
+            )
+            if verbose: print("  archive found in the download cache")
+            return dl_target
+        except BadZipFile:
+            os.remove(dl_target)
+            cache.discard(expected_hash, hash_algorithm)
+
+    client = RepositoryClient(url)
+    info = client.get_file_info(dreams.DirNames.Server.LATEST_ARCHIVE)
+    if info is None:
+        raise FileNotFoundError("the repository does not provide the modpack archive")
+    progress = dreams.Progress(info["size"] or 0, "  downloading files", unit=dreams.ProgressUnit.BYTES, verbose=verbose)
+    client.download_resumable(dreams.DirNames.Server.LATEST_ARCHIVE, dl_target, progress=progress, segments=segments, chunk_size=_chunk_size, info=info)
+    progress.close()
+
+    try:
+        verify_archive(
+            dl_target,
+            expected_size=latest.get("archive-size", info["size"]),
+            expected_hash=expected_hash,
+            hash_algorithm=hash_algorithm
+        )
+    except BadZipFile:
+        os.remove(dl_target)
+        raise
+    if not cache is None:
+        cache.put(dl_target, expected_hash, hash_algorithm)
+        cache.trim()
     return dl_target
 
-def import_options(dest:str, import_list:list, override=True, verbose=True):
+def import_options(dest:str, import_list:list, override=True, verbose=True, hardlink=False):
+    """Imports `import_list` from the .minecraft in `dest`.
+
+    `hardlink` : link the files instead of copying them when possible, the
+    imported files are then shared with the .minecraft"""
     
     minecraft_dir = dreams.get_minecraft_dir()
             
@@ -144,36 +206,79 @@ def import_options(dest:str, import_list:list, override=True, verbose=True):
         elif os.path.isfile(source_path):
             import_content.append(source_path)
 
-    for index, f in enumerate(import_content):
-        if verbose:
-            name = f[f.rfind("/")+1:len(f)]
-            dreams.print_progess_bar(
-                (index+1)/len(import_content),
-                50,
-                f"  importing files: {(index+1)}/{len(import_content)} ["
-            )
+    progress = dreams.Progress(
+        sum(os.path.getsize(f) for f in import_content),
+        "  importing files",
+        unit=dreams.ProgressUnit.BYTES,
+        verbose=verbose
+        )
+    for f in import_content:
+        progress.update(os.path.getsize(f))
         dest_path = f.replace(minecraft_dir, dest)
-        if os.path.exists(dest_path):
-            if not override:
-                continue
-            os.remove(dest_path)
+        if os.path.exists(dest_path) and not override:
+            continue
         if not os.path.isdir(os.path.dirname(dest_path)):
             os.makedirs(os.path.dirname(dest_path))
-        shutil.copy(f, dest_path)
+        place_file(f, dest_path, hardlink=hardlink)
+    progress.close()
+
+
+
+def get_member_target(install_location:str, name:str) -> str:
+    """returns where the archive member `name` is extracted, sanitized the
+    same way as ZipFile.extract, or None if nothing is left of it"""
+    parts = [p for p in name.replace("\\","/").split("/") if not p in ("", ".", "..")]
+    if len(parts) == 0:
+        return None
+    return "/".join([install_location, *parts])
+
+def get_archive_content(zip:ZipFile):
+    """returns the version content listed in the archive, or None if the
+    archive does not have a version content file"""
+    from lib.dreams_upgrade import get_version_content
+    try:
+        with zip.open(dreams.DirNames.FILE_VERSION_CONTENT) as raw:
+            return get_version_content(raw)
+    except KeyError:
+        return None
+
+def get_unchanged_members(members:list, install_location:str, content:dict, hash_cache:HashCache, workers=None) -> set:
+    """returns the names of the `members` already installed with the
+    hash listed in `content` (the version content of the archive). Only
+    the files with the expected size are hashed, through `hash_cache`."""
+    candidates = []
+    for member in members:
+        if member.is_dir() or not content.get(member.filename):
+            continue
+        target = get_member_target(install_location, member.filename)
+        try:
+            if not target is None and os.path.getsize(target) == member.file_size:
+                candidates.append(member.filename)
+        except OSError:
+            continue
+    if len(candidates) == 0:
+        return set()
 
+    hashes = hash_files(install_location, candidates, hash_cache=hash_cache, algorithm=content.algorithm, workers=workers)
+    return set(name for name, file_hash in hashes.items() if file_hash == content[name])
 
+def extract_pack(archive:str, install_location:str, verbose=True, install_mode=InstallMode.CLIENT, workers=None, store=None) -> list:
+    """Extracts the archive in `install_location` on `workers` threads
+    (default: DEFAULT_EXTRACT_WORKERS), each one with its own handle on the
+    archive and its own share of the members, balanced by size. Members
+    already installed with the expected content are not extracted again
+    (see `get_unchanged_members`).
 
-def install_pack(
-        archive:str, 
-        install_location:str, 
-        install_defaults=True, 
-        import_list=[], 
-        verbose=True, 
-        install_mode=InstallMode.CLIENT
-        ):
-    if not os.path.isfile(archive):
-        raise FileNotFoundError("The archive specified does not exist.")
+    Files are hashed while they are written, and their hashes stored in the
+    hash cache of the installation.
 
+    `store` : optional shared store (see dreams_store), the members it has
+    are linked from it instead of being extracted, the others are added
+    to it
+
+    Returns the members that could not be extracted, as (name, error)."""
+    if workers is None:
+        workers = DEFAULT_EXTRACT_WORKERS
     install_exclude = []
 
     with ZipFile(archive,"r") as zip:
@@ -182,26 +287,190 @@ def install_pack(
                 with zip.open(dreams.DirNames.FILE_CONFIG_SERVER) as raw:
                     serverconfig = json.load(raw)
                     install_exclude = serverconfig.get("client-side-only",[])
-            except:
+            except (KeyError, ValueError):
                 pass
 
-        fl = [f for f in zip.filelist if not any(m for m in install_exclude if f.filename.startswith(m))]
-
-        for index, member in enumerate(fl):
-            target_file = f"{install_location}/{member.filename}".replace("\\","/")
-            progress = (index+1)/len(fl)
-            name = member.filename[member.filename.rfind("/")+1:len(member.filename)]
-            dreams.print_progess_bar(
-                progress,
-                50,
-                prepend=f"  installing files: {index+1}/{len(fl)} ["
-                )
-            
-            try:
-                zip.extract(member,install_location)
-            except:
-                pass
+        # patch archives and block signatures are for the upgrades
+        exclude_matcher = dreams.PathMatcher([*install_exclude, dreams.DirNames.PATCHES, dreams.DirNames.BLOCKS])
+        fl = [f for f in zip.filelist if not exclude_matcher.matches(f.filename)]
+
+        content = get_archive_content(zip)
+        algorithm = content.algorithm if not content is None else dreams.DEFAULT_HASH_ALGORITHM
+        hash_cache = HashCache(install_location)
+        # reinstalling over an existing installation only extracts
+        # what is missing or changed
+        unchanged = set()
+        if not content is None:
+            unchanged = get_unchanged_members(fl, install_location, content, hash_cache, workers=workers)
+        skipped_size = sum(m.file_size for m in fl if m.filename in unchanged)
+        fl = [f for f in fl if not f.filename in unchanged]
+
+    # creating the directories beforehand, workers would race for them
+    directories = set()
+    for member in fl:
+        target = get_member_target(install_location, member.filename)
+        if not target is None:
+            directories.add(target if member.is_dir() else os.path.dirname(target))
+    for directory in directories:
+        os.makedirs(directory, exist_ok=True)
+
+    def share(name:str, target:str, digest:str):
+        if not store is None and store.accepts(name):
+            store.adopt(target, digest, algorithm=algorithm)
+        hash_cache.record(target[len(install_location)+1:], digest, algorithm=algorithm)
+
+    linked = []
+    if not store is None and not content is None:
+        for name in unchanged:
+            share(name, get_member_target(install_location, name), content[name])
+        for member in fl:
+            target = get_member_target(install_location, member.filename)
+            if (
+                not target is None
+                and store.accepts(member.filename)
+                and store.link(content.get(member.filename,""), target, algorithm=algorithm)
+            ):
+                hash_cache.record(target[len(install_location)+1:], content[member.filename], algorithm=algorithm)
+                linked.append(member)
+        linked_names = set(m.filename for m in linked)
+        fl = [f for f in fl if not f.filename in linked_names]
+
+    if len(fl) == 0:
+        hash_cache.save()
+        if verbose: print(f"  all files are already installed or shared ({dreams.byte_str(skipped_size+sum(m.file_size for m in linked))} not written)")
+        return []
+
+    workers = max(1, min(workers, len(fl)))
+    shares = [[] for _ in range(workers)]
+    loads = [0]*workers
+    for member in sorted(fl, key=lambda m: m.file_size, reverse=True):
+        lightest = loads.index(min(loads))
+        shares[lightest].append(member)
+        loads[lightest] += member.file_size
+
+    _chunk_size = 1024*1024
+    progress = dreams.Progress(len(fl), "  installing files", verbose=verbose)
+    def extract_share(members:list) -> list:
+        errors = []
+        with ZipFile(archive,"r") as zip:
+            for member in members:
+                try:
+                    target = get_member_target(install_location, member.filename)
+                    if not target is None and not member.is_dir():
+                        with zip.open(member) as source:
+                            digest = write_hashed(iter(lambda: source.read(_chunk_size), b""), target, algorithm=algorithm)
+                        share(member.filename, target, digest)
+                except Exception as e:
+                    errors.append((member.filename, e))
+                progress.update()
+        return errors
+
+    start = time.monotonic()
+    if workers == 1:
+        errors = extract_share(shares[0])
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            errors = [e for share_errors in pool.map(extract_share, shares) for e in share_errors]
+    elapsed = time.monotonic()-start
+    progress.close()
+    hash_cache.save()
 
+    if verbose:
+        failed = set(name for name, _ in errors)
+        size = sum(m.file_size for m in fl if not m.filename in failed)
+        print(
+            f"  extracted {len(fl)-len(errors)} files ({dreams.byte_str(size)}) in {elapsed:.1f}s, "
+            f"{dreams.byte_str(size/elapsed if elapsed > 0 else size)}/s on {workers} thread{'s' if workers > 1 else ''}"
+        )
+        if len(unchanged) > 0:
+            print(f"  {len(unchanged)} files already installed, {dreams.byte_str(skipped_size)} not rewritten")
+        if len(linked) > 0:
+            print(f"  {len(linked)} files linked from the shared store, {dreams.byte_str(sum(m.file_size for m in linked))} not written")
+        if len(errors) > 0:
+            print(f"  {len(errors)} files could not be extracted:")
+            for name, error in errors:
+                print(f"    {name}: {error}")
+    return errors
+
+def stream_pack(repo:str, install_location:str, install_exclude=[], verbose=True, store=None, cache=None):
+    """Extracts the latest archive of the repository while it downloads,
+    without storing it.
+
+    The members are read from their local headers as the bytes arrive and
+    checked against the central directory once the download is done, along
+    with the size and hash published in the latest release description.
+    Raises an UnsupportedLayout error before extracting anything the
+    archive cannot be read this way, and a BadZipFile error if the
+    archive turns out to be invalid.
+
+    `store` : optional shared store (see dreams_store) to add the files to
+    `cache` : optional DownloadCache (see dreams_cache) the archive is
+    written to while it downloads"""
+    client = RepositoryClient(repo)
+    info = client.get_file_info(dreams.DirNames.Server.LATEST_ARCHIVE)
+    if info is None:
+        raise FileNotFoundError("the repository does not provide the modpack archive")
+    latest = get_latest_meta(repo) or dict()
+    expected_hash = latest.get("archive-hash")
+    hash_algorithm = latest.get("archive-hash-algorithm", dreams.DEFAULT_HASH_ALGORITHM)
+    archive_hash = None
+    cache_entry = None
+    if not expected_hash is None:
+        archive_hash = dreams.new_hash(hash_algorithm)
+        if not cache is None:
+            cache_entry = cache.open_entry(expected_hash, hash_algorithm)
+
+    # the files are filed in the store and the hash cache under the
+    # algorithm of the pack, as extract_pack does
+    algorithm = get_release_algorithm(repo, latest.get("version-name"))
+
+    exclude_matcher = dreams.PathMatcher([*install_exclude, dreams.DirNames.PATCHES, dreams.DirNames.BLOCKS])
+    hash_cache = HashCache(install_location)
+    installed = []
+    progress = dreams.Progress(info["size"] or 0, "  installing files", unit=dreams.ProgressUnit.BYTES, verbose=verbose)
+    try:
+        with ResumableStream(client, dreams.DirNames.Server.LATEST_ARCHIVE, info=info) as stream:
+            reader = ZipStreamReader(stream if cache_entry is None else TeeStream(stream, cache_entry), hash=archive_hash, progress=progress)
+            for member in reader:
+                target = get_member_target(install_location, member.name)
+                if target is None or exclude_matcher.matches(member.name):
+                    continue
+                if member.is_dir():
+                    os.makedirs(target, exist_ok=True)
+                    continue
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                digest = write_hashed(member.chunks(), target, algorithm=algorithm)
+                if not store is None and store.accepts(member.name):
+                    store.adopt(target, digest, algorithm=algorithm)
+                hash_cache.record(target[len(install_location)+1:], digest, algorithm=algorithm)
+                installed.append(member.name)
+        progress.close()
+        hash_cache.save()
+
+        if not dreams.DirNames.FILE_MANIFEST in (m.name for m in reader.members):
+            raise BadZipFile("archive does not contain a modpack manifest")
+        expected_size = latest.get("archive-size", info["size"])
+        if not expected_size is None and not reader.position == expected_size:
+            raise BadZipFile(f"archive size is {reader.position}, expected {expected_size}")
+        if not archive_hash is None and not archive_hash.hexdigest() == expected_hash:
+            raise BadZipFile("archive hash does not match the one of the repository")
+    except BaseException:
+        if not cache_entry is None:
+            cache_entry.discard()
+        raise
+    if not cache_entry is None:
+        cache_entry.commit()
+        cache.trim()
+    return installed
+
+def finish_install(
+        install_location:str,
+        install_defaults=True,
+        import_list=[],
+        verbose=True,
+        install_mode=InstallMode.CLIENT,
+        link_imports=False
+        ):
     ## CLIENT ONLY ##
     # importing from base profile
     if len(import_list) > 0 and install_mode == InstallMode.CLIENT:
@@ -210,7 +479,8 @@ def install_pack(
             import_options(
             install_location,
             import_list=import_list,
-            verbose=True
+            verbose=True,
+            hardlink=link_imports
             )
         except RecursionError:
             if verbose: print("  .minecraft not found, ignoring settings import...")
@@ -233,7 +503,7 @@ def install_pack(
                     rel_path = dest.replace(f"{install_location}/","")
                     if verbose: print(f"    moving {rel_path}...")
                     if not os.path.isfile(dest):
-                        shutil.copy(f"{root}/{file}", dest)
+                        place_file(f"{root}/{file}", dest)
         except:
             if verbose: print("  defaults could not be moved!")
 
@@ -259,11 +529,9 @@ def install_pack(
                     for file in files:
                         src_file = f"{root}/{file}"
                         dest_file = src_file.replace(ref_world_dir,world_dir)
-                        if os.path.isfile(dest_file):
-                            os.remove(dest_file)
                         if not os.path.isdir(os.path.dirname(dest_file)):
                             os.makedirs(os.path.dirname(dest_file))
-                        shutil.copy(src_file,dest_file)
+                        place_file(src_file,dest_file)
         
         # add a marker file to automatically detect this install as a server install in the future
         marker_file = dreams.get_as_path(dreams.DirNames.FILE_SERVER_MARKER)
@@ -274,23 +542,168 @@ def install_pack(
                 mk.write("true")
 
 
-def install_standalone(repo: str, mode: str, install_location:str, create_launcher_profile=False, import_list=[], verbose=True, archive=None):
-    download_tmp = tempfile.TemporaryDirectory()
+def install_pack(
+        archive:str, 
+        install_location:str, 
+        install_defaults=True, 
+        import_list=[], 
+        verbose=True, 
+        install_mode=InstallMode.CLIENT,
+        workers=None,
+        link_imports=False
+        ) -> list:
+    """Installs the archive in `install_location`, returns the members that
+    could not be extracted (see `extract_pack`)"""
+    if not os.path.isfile(archive):
+        raise FileNotFoundError("The archive specified does not exist.")
 
+    errors = extract_pack(archive, install_location, verbose=verbose, install_mode=install_mode, workers=workers)
+    finish_install(
+        install_location,
+        install_defaults=install_defaults,
+        import_list=import_list,
+        verbose=verbose,
+        install_mode=install_mode,
+        link_imports=link_imports
+        )
+    return errors
+
+def store_install(repo:str, install_location:str, store:SharedStore, install_exclude=[], verbose=True, cache=None) -> bool:
+    """Installs the latest version of the repository file by file: the
+    files the shared `store` has are linked from it, only the others are
+    downloaded. Files already installed with the right content are kept.
+
+    Returns False, without installing anything, if the repository does not
+    list the files of its latest version or if the store has none of them."""
+    from lib.dreams_upgrade import ContentDifference, VersionContent, get_version_content, download_upgrade, install_upgrade
+    latest = get_latest_release_name(repo)
+    if latest is None or latest[1] is None:
+        return False
+    raw_content = RepositoryClient(repo).get_bytes(f"{dreams.DirNames.Server.VERSIONS}/{latest[1]}/{dreams.DirNames.FILE_VERSION_CONTENT}")
+    if raw_content is None:
+        return False
+    content = get_version_content(raw_content.splitlines())
+    exclude_matcher = dreams.PathMatcher(install_exclude)
+    for name in [n for n in content if exclude_matcher.matches(n)]:
+        del content[name]
+    shared = [n for n in content if store.accepts(n) and store.contains(content[n], content.algorithm)]
+    if len(shared) == 0:
+        return False
+    if verbose: print(f"  {len(shared)} of {len(content)} files found in the shared store")
+
+    existing = [n for n in content if len(content[n]) > 0 and os.path.isfile(f"{install_location}/{n}")]
+    hash_cache = HashCache(install_location)
+    installed = VersionContent(
+        hash_files(install_location, existing, hash_cache=hash_cache, algorithm=content.algorithm),
+        algorithm=content.algorithm
+        )
+    hash_cache.save()
+    diff = ContentDifference(installed, content)
+    # only installing, files that are not part of the pack are kept
+    diff.removed = []
+    # files without hash (the version content file) are always replaced
+    replaced = [a for a in diff.added if os.path.isfile(f"{install_location}/{a}")]
+    diff.modified.update(replaced)
+    for a in replaced:
+        diff.added.discard(a)
+
+    downloads_dir = dreams.get_as_path(dreams.DirNames.DOWNLOADS, root=install_location)
+    os.makedirs(downloads_dir, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=downloads_dir) as download_location:
+        failed = download_upgrade(repo, download_location, latest[1], diff, verbose=verbose, store=store, cache=cache)
+        if len(failed) > 0:
+            if verbose: print(f"  {len(failed)} file(s) could not be downloaded, installing from the archive instead...")
+            return False
+        install_upgrade(
+            download_location,
+            install_location,
+            diff,
+            install_defaults=False,
+            verbose=verbose,
+            config={},
+            move=True,
+            store=store
+            )
+    return True
+
+def install_standalone(repo: str, mode: str, install_location:str, create_launcher_profile=False, import_list=[], verbose=True, archive=None, segments=1, stream=True, workers=None, link_imports=False, store=None, cache=None):
+    # downloading in the install location so that an interrupted
+    # download can be resumed by the next attempt.
+    install_location = install_location.replace("\\","/")
+    download_dir = dreams.get_as_path(dreams.DirNames.DOWNLOADS, root=install_location)
+    partial = f"{download_dir}/{dreams.DirNames.Server.LATEST_ARCHIVE}.part"
+    downloaded = False
+    if store is None:
+        store = get_profile_store(install_location)
+    latest = dict()
+    release_root = None
+    if archive is None:
+        latest = get_latest_meta(repo) or dict()
+        if not latest.get("version-name") is None:
+            release_root = f"{repo}/{dreams.DirNames.Server.VERSIONS}/{latest['version-name']}"
+    if cache is None:
+        # sized by the config of the release installed
+        if not release_root is None:
+            config = dreams.get_config(root=install_location, type=dreams.ConfigType(True,False), remote_root=release_root)
+        else:
+            config = dreams.get_config(root=install_location, type=dreams.ConfigType(True,True))
+        cache = get_download_cache(config)
+    # an archive already downloaded once is installed without the network
+    cached = False
     if archive is None:
-        if verbose: print(f"downloading the modpack from {repo}...")
-        archive = download_pack(repo,download_tmp.name)
-        if verbose: print("download done!")
-
-    if verbose: print("installing the modpack...")
-    install_pack(
-        archive,
-        install_location.replace("\\","/"),
+        cached = cache.contains(latest.get("archive-hash"), latest.get("archive-hash-algorithm", dreams.DEFAULT_HASH_ALGORITHM))
+    # segmented downloads and interrupted ones need the archive on disk
+    streamed = stream and archive is None and not cached and segments <= 1 and not os.path.isfile(partial)
+    # installing from the shared store needs the list of files
+    from_store = not store is None and archive is None and not cached
+
+    install_exclude = []
+    if (streamed or from_store) and mode == InstallMode.SERVER:
+        # the archive may only list the client side files after
+        # some of them, the copy of the config in the release is used instead.
+        server_config = None
+        if not release_root is None:
+            server_config = RepositoryClient(release_root).get_json(dreams.DirNames.FILE_CONFIG_SERVER)
+        if isinstance(server_config, dict):
+            install_exclude = server_config.get("client-side-only",[])
+        else:
+            streamed = False
+            from_store = False
+
+    installed = False
+    if from_store:
+        if verbose: print(f"installing the modpack from {repo} and the shared store...")
+        installed = store_install(repo, install_location, store, install_exclude=install_exclude, verbose=verbose, cache=cache)
+
+    if not installed and streamed:
+        if verbose: print(f"installing the modpack from {repo}...")
+        try:
+            stream_pack(repo, install_location, install_exclude=install_exclude, verbose=verbose, store=store, cache=cache)
+            installed = True
+        except (UnsupportedLayout, BadZipFile) as e:
+            if verbose: print(f"  the archive cannot be installed while downloading ({e}), downloading it first...")
+
+    if not installed:
+        if archive is None:
+            if verbose: print(f"downloading the modpack from {repo}...")
+            os.makedirs(download_dir, exist_ok=True)
+            archive = download_pack(repo,download_dir,segments=segments,cache=cache)
+            downloaded = True
+            if verbose: print("download done!")
+        else:
+            verify_archive(archive)
+
+        if verbose: print("installing the modpack...")
+        extract_pack(archive, install_location, verbose=True, install_mode=mode, workers=workers, store=store)
+
+    finish_install(
+        install_location,
         import_list=import_list,
         verbose=True,
-        install_mode=mode
+        install_mode=mode,
+        link_imports=link_imports
         )
-    dreasm._set_root(install_location)
+    dreams._set_root(install_location)
     if verbose: print("installation done!")
     
     if create_launcher_profile and mode == InstallMode.CLIENT:
@@ -307,7 +720,8 @@ def install_standalone(repo: str, mode: str, install_location:str, create_launch
                 print("profile could not be added to the launcher.")
         if verbose: print("profile added to the launcher!")
 
-    download_tmp.cleanup()
+    if downloaded:
+        os.remove(archive)
     if verbose:
         print("cleanup done!")
         if mode == InstallMode.CLIENT:
@@ -336,11 +750,27 @@ def main(args:list):
                 print("Archive not found!\nAborting installation...")
                 return
             break
+
+    try:
+        segments = dreams.get_int_arg(args, "--segments", default=1)
+        workers = dreams.get_int_arg(args, "--workers")
+    except ValueError as e:
+        print(f"ERROR: {e}, see --help.")
+        return
+    stream = not "--no-stream" in args
     
     install_in_custom_dir = "--profile" in args or "-p" in args
     inject_profile = "--inject" in args or "-i" in args
 
     imports = []
+    link_imports = "--link-imports" in args
+    store_path = None
+    use_store = False
+    for a in args:
+        if a == "--shared-store" or a.startswith("--shared-store="):
+            use_store = True
+            if "=" in a:
+                store_path = a[a.find("=")+1:len(a)].replace('"','')
 
     if "--import" in args or "-o" in args:
         imports = [
@@ -352,8 +782,8 @@ def main(args:list):
     mc_dir = dreams.get_minecraft_dir()
     
 
-    if install_in_custom_dir and os.path.isdir(mc_dir):
-        install_dir = f"{mc_dir}/{PROFILES_DIR}"
+    if install_in_custom_dir and not mc_dir is None and os.path.isdir(mc_dir):
+        install_dir = f"{mc_dir}/{dreams.DirNames.Minecraft.PROFILES_DIR}"
 
     if "--interactive" in args:
         while len(repo) < 1:
@@ -402,10 +832,15 @@ def main(args:list):
         repo,
         mode,
         install_dir,
-        inject_profile=inject_profile,
+        create_launcher_profile=inject_profile,
         import_list=imports,
         verbose=True,
-        archive=archive
+        archive=archive,
+        segments=segments,
+        stream=stream,
+        workers=workers,
+        link_imports=link_imports,
+        store=enable_profile_store(install_dir, path=store_path) if use_store else None
         )
 
 if __name__ == "__main__":
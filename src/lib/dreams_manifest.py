@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+import mmap
+import struct
+from bisect import bisect_left
+from collections.abc import Mapping
+import lib.dreams as dreams
+
+MANIFEST_MAGIC = b"DRMC"
+MANIFEST_FORMAT = 1
+# magic, format, digest size, algorithm name length, directory count,
+# entry count, size of the strings
+_HEADER = struct.Struct("<4sHBBIII")
+# offset and length of a directory in the strings
+_DIRECTORY = struct.Struct("<IH")
+# an entry is followed by the digest: directory index, offset and length
+# of the name in the strings, flags, size
+_ENTRY = struct.Struct("<IIHBQ")
+
+_FLAG_NO_HASH = 0x1
+_FLAG_NO_SIZE = 0x2
+
+def write_manifest(content:dict, target:str, algorithm:str, sizes={}, unhashed=()):
+    """Writes `content` ({relative_path: hash}) as a binary manifest.
+
+    Entries are sorted by path and have a fixed size (the directory of the
+    path is stored once for all its files, the hash as raw bytes), so that
+    a file can be found by binary search without reading the manifest.
+
+    `unhashed` : paths listed without hash (the version content files)"""
+    entries = {p: h for p, h in content.items()}
+    for p in unhashed:
+        entries[p] = ""
+    digest_size = dreams.new_hash(algorithm).digest_size
+    paths = sorted(entries.keys())
+    directories = sorted(set(p.rpartition("/")[0] for p in paths))
+    directory_index = {d: i for i, d in enumerate(directories)}
+
+    strings = bytearray()
+    directory_table = bytearray()
+    for d in directories:
+        raw = d.encode("UTF-8")
+        directory_table += _DIRECTORY.pack(len(strings), len(raw))
+        strings += raw
+    entry = struct.Struct(f"{_ENTRY.format}{digest_size}s")
+    entry_table = bytearray()
+    for p in paths:
+        directory, _, name = p.rpartition("/")
+        raw = name.encode("UTF-8")
+        file_hash = entries[p]
+        if len(file_hash) > 0 and not len(file_hash) == 2*digest_size:
+            raise ValueError(f"hash of {p} is not a {algorithm} hash")
+        size = sizes.get(p)
+        flags = (_FLAG_NO_HASH if len(file_hash) == 0 else 0) | (_FLAG_NO_SIZE if size is None else 0)
+        entry_table += entry.pack(
+            directory_index[directory], len(strings), len(raw), flags,
+            size if not size is None else 0,
+            bytes.fromhex(file_hash) if len(file_hash) > 0 else bytes(digest_size)
+        )
+        strings += raw
+
+    raw_algorithm = algorithm.encode("UTF-8")
+    with open(target, "wb") as out:
+        out.write(_HEADER.pack(MANIFEST_MAGIC, MANIFEST_FORMAT, digest_size, len(raw_algorithm), len(directories), len(paths), len(strings)))
+        out.write(raw_algorithm)
+        out.write(directory_table)
+        out.write(entry_table)
+        out.write(strings)
+
+class _Sizes(Mapping):
+    """The sizes recorded by a BinaryManifest, as a read only dict"""
+
+    def __init__(self, manifest):
+        self._manifest = manifest
+        self._length = None
+
+    def __getitem__(self, path:str) -> int:
+        index = self._manifest._find(path)
+        if index is None or self._manifest._entry(index)[3] & _FLAG_NO_SIZE:
+            raise KeyError(path)
+        return self._manifest._entry(index)[4]
+
+    def __iter__(self):
+        for index in range(self._manifest._count):
+            if not self._manifest._entry(index)[3] & _FLAG_NO_SIZE and self._manifest._is_listed(index):
+                yield self._manifest._path(index)
+
+    def __len__(self) -> int:
+        if self._length is None:
+            self._length = sum(1 for _ in self)
+        return self._length
+
+class BinaryManifest(Mapping):
+    """Read only `{relative_path: hash}` view of a binary manifest (see
+    `write_manifest`), usable wherever a VersionContent is.
+
+    Nothing is decoded in advance: the manifest stays in `data` (bytes,
+    or the memory map of the file with `BinaryManifest.open`), entries are
+    found by binary search and iterated in path order, which allows
+    `diff_manifests` to compare two manifests in a single pass.
+
+    Entries can be dropped (`del manifest[path]`), only the dropped paths
+    are kept in memory."""
+
+    def __init__(self, data):
+        self._data = data
+        if len(data) < _HEADER.size:
+            raise ValueError("not a binary manifest")
+        (
+            magic, format, digest_size, algorithm_length,
+            directory_count, self._count, strings_size
+        ) = _HEADER.unpack_from(data, 0)
+        if not magic == MANIFEST_MAGIC or format > MANIFEST_FORMAT:
+            raise ValueError("not a binary manifest, or made by a newer version")
+        offset = _HEADER.size
+        self.algorithm = bytes(data[offset:offset+algorithm_length]).decode("UTF-8")
+        offset += algorithm_length
+        self._directories_offset = offset
+        offset += directory_count*_DIRECTORY.size
+        self._entry_struct = struct.Struct(f"{_ENTRY.format}{digest_size}s")
+        self._entries_offset = offset
+        self._strings_offset = offset + self._count*self._entry_struct.size
+        if len(data) < self._strings_offset + strings_size:
+            raise ValueError("binary manifest is truncated")
+        self._directories = [None]*directory_count
+        self._removed = set()
+        self.sizes = _Sizes(self)
+
+    def open(path:str) -> "BinaryManifest":
+        """maps the manifest file in memory"""
+        with open(path, "rb") as file:
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return BinaryManifest(data)
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+
+    def __deepcopy__(self, memo):
+        # the manifest is read only, only the dropped paths are copied
+        manifest = BinaryManifest(self._data)
+        manifest._removed = set(self._removed)
+        return manifest
+
+    def _string(self, offset:int, length:int) -> str:
+        start = self._strings_offset + offset
+        return bytes(self._data[start:start+length]).decode("UTF-8")
+
+    def _entry(self, index:int) -> tuple:
+        return self._entry_struct.unpack_from(self._data, self._entries_offset + index*self._entry_struct.size)
+
+    def _path(self, index:int) -> str:
+        directory_index, offset, length, _, _, _ = self._entry(index)
+        directory = self._directories[directory_index]
+        if directory is None:
+            directory = self._string(*_DIRECTORY.unpack_from(self._data, self._directories_offset + directory_index*_DIRECTORY.size))
+            self._directories[directory_index] = directory
+        name = self._string(offset, length)
+        return f"{directory}/{name}" if len(directory) > 0 else name
+
+    def _hash(self, index:int) -> str:
+        entry = self._entry(index)
+        return "" if entry[3] & _FLAG_NO_HASH else entry[5].hex()
+
+    def _is_listed(self, index:int) -> bool:
+        return len(self._removed) == 0 or not self._path(index) in self._removed
+
+    def _find(self, path:str) -> int:
+        if path in self._removed:
+            return None
+        index = bisect_left(range(self._count), path, key=self._path)
+        if index < self._count and self._path(index) == path:
+            return index
+        return None
+
+    def __getitem__(self, path:str) -> str:
+        index = self._find(path)
+        if index is None:
+            raise KeyError(path)
+        return self._hash(index)
+
+    def __delitem__(self, path:str):
+        if self._find(path) is None:
+            raise KeyError(path)
+        self._removed.add(path)
+
+    def __contains__(self, path) -> bool:
+        return isinstance(path, str) and not self._find(path) is None
+
+    def __iter__(self):
+        for index in range(self._count):
+            if self._is_listed(index):
+                yield self._path(index)
+
+    def __len__(self) -> int:
+        return self._count - len(self._removed)
+
+    def entries(self):
+        """yields the `(path, raw hash)` of every entry, in path order"""
+        for index in range(self._count):
+            path = self._path(index)
+            if len(self._removed) == 0 or not path in self._removed:
+                entry = self._entry(index)
+                yield (path, None if entry[3] & _FLAG_NO_HASH else entry[5])
+
+def diff_manifests(old:BinaryManifest, new:BinaryManifest) -> tuple:
+    """returns the added, removed and modified paths from `old` to `new`,
+    walking both manifests once, side by side"""
+    added = []
+    removed = []
+    modified = []
+    old_entries = old.entries()
+    new_entries = new.entries()
+    old_entry = next(old_entries, None)
+    new_entry = next(new_entries, None)
+    while not old_entry is None or not new_entry is None:
+        if new_entry is None or (not old_entry is None and old_entry[0] < new_entry[0]):
+            removed.append(old_entry[0])
+            old_entry = next(old_entries, None)
+        elif old_entry is None or new_entry[0] < old_entry[0]:
+            added.append(new_entry[0])
+            new_entry = next(new_entries, None)
+        else:
+            if not old_entry[1] == new_entry[1]:
+                modified.append(new_entry[0])
+            old_entry = next(old_entries, None)
+            new_entry = next(new_entries, None)
+    return (added, removed, modified)
@@ -0,0 +1,448 @@
+#!/usr/bin/env python3
+import os
+import time
+import json
+import socket
+import threading
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection, HTTPSConnection
+from urllib.parse import urlparse, quote
+import lib.dreams as dreams
+
+# socket timeout (connection and each read), used for every request
+DEFAULT_TIMEOUT = 30
+DEFAULT_RETRIES = 4
+# delay before the first retry, doubled on every other one
+RETRY_BACKOFF = 0.5
+# statuses considered as temporary server errors
+RETRY_STATUSES = (408, 429, 500, 502, 503, 504)
+# the state of a resumable download is saved every time a segment has
+# written that many bytes, so that a killed download does not restart
+DOWNLOAD_STATE_INTERVAL = 8*1024*1024
+
+# errors raised by a dropped, stale or timed out connection
+CONNECTION_ERRORS = (
+    http.client.HTTPException,
+    ConnectionError,
+    socket.timeout
+)
+
+class RepositoryError(ConnectionError):
+    pass
+
+class ConnectionPool:
+    """Keep-alive connections to a single host. Connections are reused as
+    long as the server keeps them open, so a whole run only needs one TLS
+    handshake per concurrently used connection."""
+
+    def __init__(self, scheme:str, host:str, timeout=DEFAULT_TIMEOUT, max_idle=16):
+        self.scheme = scheme
+        self.host = host
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.connections_opened = 0
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def acquire(self) -> (HTTPConnection, bool):
+        """returns a connection, and whether it has already been used"""
+        with self._lock:
+            if len(self._idle) > 0:
+                return (self._idle.pop(), True)
+            self.connections_opened += 1
+        connection_type = HTTPSConnection if self.scheme == "https" else HTTPConnection
+        return (connection_type(self.host, timeout=self.timeout), False)
+
+    def release(self, connection:HTTPConnection, reusable=True):
+        with self._lock:
+            if reusable and len(self._idle) < self.max_idle:
+                self._idle.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        with self._lock:
+            idle = self._idle
+            self._idle = []
+        for connection in idle:
+            connection.close()
+
+_pools = dict()
+_pools_lock = threading.Lock()
+
+def get_pool(scheme:str, host:str) -> ConnectionPool:
+    with _pools_lock:
+        key = (scheme, host)
+        if not key in _pools:
+            _pools[key] = ConnectionPool(scheme, host)
+        return _pools[key]
+
+def close_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+class PooledResponse:
+    """Response of a RepositoryClient request. Use it as a context manager:
+    its connection goes back to the pool on exit if the body has been fully
+    read, and is closed otherwise."""
+
+    def __init__(self, pool:ConnectionPool, connection:HTTPConnection, response:http.client.HTTPResponse):
+        self._pool = pool
+        self._connection = connection
+        self.response = response
+        self.status = response.status
+
+    def read(self, amount=None) -> bytes:
+        return self.response.read(amount)
+
+    def readinto(self, buffer) -> int:
+        return self.response.readinto(buffer)
+
+    def getheader(self, name:str, default=None):
+        return self.response.getheader(name, default)
+
+    def release(self):
+        if self._connection is None:
+            return
+        if self.response.length == 0:
+            # nothing left to read (HEAD, empty body...), closes the response
+            self.response.read()
+        reusable = self.response.isclosed() and not self.response.will_close
+        if not reusable:
+            self.response.close()
+        self._pool.release(self._connection, reusable=reusable)
+        self._connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if not exc_type is None and not self._connection is None:
+            # the body may be half read, the connection cannot be reused
+            self.response.close()
+            self._pool.release(self._connection, reusable=False)
+            self._connection = None
+        self.release()
+
+class RepositoryClient:
+    """HTTP(S) client for the files of a repository (`url`).
+
+    Requests go through the keep-alive pool of the host and are retried with
+    an exponential backoff on connection errors and temporary server errors.
+    A failure on a reused connection (closed by the server while idle) is
+    retried at once on a new one."""
+
+    def __init__(self, url:str, retries=DEFAULT_RETRIES):
+        parsed = urlparse(url)
+        self.url = url
+        self.base_path = parsed.path.rstrip("/")
+        self.retries = retries
+        self.pool = get_pool(parsed.scheme if len(parsed.scheme) > 0 else "https", parsed.netloc)
+
+    def path_for(self, relative:str) -> str:
+        return quote(f"{self.base_path}/{relative.lstrip('/')}")
+
+    def request(self, relative:str, method="GET", headers={}) -> PooledResponse:
+        path = self.path_for(relative)
+        attempt = 0
+        while True:
+            connection, reused = self.pool.acquire()
+            try:
+                connection.request(method, path, headers=headers)
+                response = connection.getresponse()
+            except (*CONNECTION_ERRORS, OSError) as e:
+                connection.close()
+                if reused:
+                    # stale keep-alive connection, does not count as a try
+                    continue
+                if attempt >= self.retries:
+                    raise RepositoryError(f"{method} {path} failed: {e}")
+                time.sleep(RETRY_BACKOFF*(2**attempt))
+                attempt += 1
+                continue
+            if response.status in RETRY_STATUSES and attempt < self.retries:
+                response.read()
+                self.pool.release(connection, reusable=not response.will_close)
+                time.sleep(RETRY_BACKOFF*(2**attempt))
+                attempt += 1
+                continue
+            return PooledResponse(self.pool, connection, response)
+
+    def get_bytes(self, relative:str) -> bytes:
+        """returns the content of the file, or None if the server does not
+        return it"""
+        attempt = 0
+        while True:
+            try:
+                with self.request(relative) as response:
+                    if not response.status == 200:
+                        response.read()
+                        return None
+                    return response.read()
+            except CONNECTION_ERRORS as e:
+                if isinstance(e, RepositoryError) or attempt >= self.retries:
+                    raise
+                attempt += 1
+
+    def get_json(self, relative:str):
+        """returns the parsed file, or None if it is missing or invalid"""
+        content = self.get_bytes(relative)
+        if content is None:
+            return None
+        try:
+            return json.loads(content.decode("UTF-8"))
+        except ValueError:
+            return None
+
+    def download(self, relative:str, target:str, progress=None, chunk_size=1024*1024, algorithm=None):
+        """downloads the file to `target` (overwritten), retrying it from
+        the beginning if the connection drops. Returns False if the server
+        does not return the file, True otherwise, or the hash of the file
+        if `algorithm` is set (computed while writing it)."""
+        attempt = 0
+        while True:
+            written = 0
+            try:
+                with self.request(relative) as response:
+                    if not response.status == 200:
+                        response.read()
+                        return False
+                    file_hash = dreams.new_hash(algorithm) if not algorithm is None else None
+                    with open(target, "wb") as output:
+                        while chunk := response.read(chunk_size):
+                            output.write(chunk)
+                            if not file_hash is None:
+                                file_hash.update(chunk)
+                            written += len(chunk)
+                            if not progress is None:
+                                progress.update(len(chunk))
+                    return file_hash.hexdigest() if not file_hash is None else True
+            except CONNECTION_ERRORS as e:
+                if not progress is None:
+                    progress.update(-written)
+                if isinstance(e, RepositoryError) or attempt >= self.retries:
+                    raise
+                time.sleep(RETRY_BACKOFF*(2**attempt))
+                attempt += 1
+
+    def get_file_info(self, relative:str) -> dict:
+        """returns the size, validator (strong ETag or Last-Modified) and
+        range support of the file, or None if the server does not have it"""
+        with self.request(relative, method="HEAD") as response:
+            if not response.status == 200:
+                return None
+            etag = response.getheader("ETag")
+            length = response.getheader("Content-Length")
+            return {
+                "size": int(length) if not length is None and length.isdigit() else None,
+                # weak ETags cannot be used with If-Range
+                "validator": etag if not etag is None and not etag.startswith("W/") else response.getheader("Last-Modified"),
+                "ranges": response.getheader("Accept-Ranges","") == "bytes"
+            }
+
+    def download_resumable(self, relative:str, target:str, progress=None, segments=1, chunk_size=1024*1024, info=None) -> dict:
+        """Downloads the file to `target`, through `{target}.part`.
+
+        The partial file and its state (`{target}.part.json`) are kept if the
+        download fails, and the next call resumes it with Range requests, as
+        long as the file on the server is still the same (If-Range). With
+        `segments` > 1, that many ranges of the file are fetched in parallel.
+        Servers without range support get a plain download.
+
+        `info` : the result of `get_file_info` if already known
+
+        Returns the info of the file (see `get_file_info`)."""
+        part = f"{target}.part"
+        state_file = f"{part}.json"
+        if info is None:
+            info = self.get_file_info(relative)
+        if info is None:
+            raise FileNotFoundError(f"{relative} is not provided by the repository")
+        if not info["ranges"] or info["size"] is None or info["validator"] is None:
+            if not self.download(relative, part, progress=progress, chunk_size=chunk_size):
+                raise FileNotFoundError(f"{relative} is not provided by the repository")
+            os.replace(part, target)
+            return info
+
+        state = None
+        try:
+            with open(state_file,"r",encoding="UTF-8") as fp:
+                state = json.load(fp)
+        except (OSError, ValueError):
+            pass
+        if (
+            state is None
+            or not os.path.isfile(part)
+            or not state.get("validator") == info["validator"]
+            or not state.get("size") == info["size"]
+        ):
+            size = info["size"]
+            count = max(1, min(segments, size//chunk_size))
+            bounds = [size*i//count for i in range(count+1)]
+            # [start, end, position] of each segment
+            state = {
+                "validator": info["validator"],
+                "size": size,
+                "segments": [[bounds[i], bounds[i+1], bounds[i]] for i in range(count)]
+            }
+            with open(part,"wb") as output:
+                output.truncate(size)
+        if not progress is None:
+            progress.update(sum(s[2]-s[0] for s in state["segments"]))
+
+        # the positions saved are the ones written to the disk (fsync),
+        # the others may be lost with the system
+        saved = {id(s): s[2] for s in state["segments"]}
+        state_lock = threading.Lock()
+        def save_state():
+            with state_lock:
+                tmp_state_file = f"{state_file}.tmp"
+                with open(tmp_state_file,"w",encoding="UTF-8") as out:
+                    json.dump({**state, "segments": [[s[0], s[1], saved[id(s)]] for s in state["segments"]]}, out)
+                os.replace(tmp_state_file, state_file)
+        def checkpoint(segment:list):
+            saved[id(segment)] = segment[2]
+            save_state()
+
+        save_state()
+        try:
+            remaining = [s for s in state["segments"] if s[2] < s[1]]
+            if len(remaining) == 1:
+                self._fetch_segment(relative, part, remaining[0], info["validator"], progress, chunk_size, checkpoint=checkpoint)
+            elif len(remaining) > 1:
+                with ThreadPoolExecutor(max_workers=len(remaining)) as pool:
+                    futures = [
+                        pool.submit(self._fetch_segment, relative, part, s, info["validator"], progress, chunk_size, checkpoint=checkpoint)
+                        for s in remaining
+                    ]
+                    for future in futures:
+                        future.result()
+        finally:
+            with open(part,"r+b") as output:
+                os.fsync(output.fileno())
+            for s in state["segments"]:
+                saved[id(s)] = s[2]
+            save_state()
+        os.replace(part, target)
+        os.remove(state_file)
+        return info
+
+    def download_range(self, relative:str, target:str, start:int, end:int, validator:str, progress=None, chunk_size=1024*1024):
+        """writes the bytes `start` to `end` (excluded) of the file at the
+        same offsets of `target`, which must exist. Raises a RepositoryError
+        if the file is not the one of `validator` anymore."""
+        self._fetch_segment(relative, target, [start, end, start], validator, progress, chunk_size)
+
+    def _fetch_segment(self, relative:str, part:str, segment:list, validator:str, progress, chunk_size:int, checkpoint=None):
+        """`checkpoint(segment)` is called every DOWNLOAD_STATE_INTERVAL
+        bytes, once they are written to the disk"""
+        attempt = 0
+        unsaved = 0
+        while segment[2] < segment[1]:
+            headers = {
+                "Range": f"bytes={segment[2]}-{segment[1]-1}",
+                "If-Range": validator
+            }
+            try:
+                with self.request(relative, headers=headers) as response:
+                    if response.status == 200:
+                        response.read()
+                        raise RepositoryError(f"{relative} changed on the server during the download")
+                    if not response.status == 206:
+                        response.read()
+                        raise RepositoryError(f"unexpected status {response.status} for {relative}")
+                    with open(part,"r+b") as output:
+                        output.seek(segment[2])
+                        while segment[2] < segment[1] and (chunk := response.read(min(chunk_size, segment[1]-segment[2]))):
+                            output.write(chunk)
+                            segment[2] += len(chunk)
+                            attempt = 0
+                            if not progress is None:
+                                progress.update(len(chunk))
+                            unsaved += len(chunk)
+                            if not checkpoint is None and unsaved >= DOWNLOAD_STATE_INTERVAL:
+                                output.flush()
+                                os.fsync(output.fileno())
+                                checkpoint(segment)
+                                unsaved = 0
+            except CONNECTION_ERRORS as e:
+                if isinstance(e, RepositoryError) or attempt >= self.retries:
+                    raise
+                time.sleep(RETRY_BACKOFF*(2**attempt))
+                attempt += 1
+
+class ResumableStream:
+    """Sequential reader (`read(amount)`) of a file of the repository.
+
+    If the connection drops, the rest of the file is requested again from
+    the current position (Range, guarded by If-Range), so the reader never
+    sees the interruption. Raises a RepositoryError if the file changed on
+    the server or if the server cannot resume it."""
+
+    def __init__(self, client:RepositoryClient, relative:str, info=None):
+        self.client = client
+        self.relative = relative
+        self.info = info if not info is None else client.get_file_info(relative)
+        if self.info is None:
+            raise FileNotFoundError(f"{relative} is not provided by the repository")
+        self.position = 0
+        self._response = None
+        self._attempt = 0
+
+    def _open(self):
+        headers = {}
+        if self.position > 0:
+            if not self.info["ranges"] or self.info["validator"] is None:
+                raise RepositoryError(f"{self.relative} was interrupted and the server cannot resume it")
+            headers = {
+                "Range": f"bytes={self.position}-",
+                "If-Range": self.info["validator"]
+            }
+        response = self.client.request(self.relative, headers=headers)
+        expected = 206 if self.position > 0 else 200
+        if not response.status == expected:
+            status = response.status
+            response.release()
+            if status == 200:
+                raise RepositoryError(f"{self.relative} changed on the server during the download")
+            raise RepositoryError(f"unexpected status {status} for {self.relative}")
+        self._response = response
+
+    def read(self, amount:int) -> bytes:
+        """returns up to `amount` bytes, or b"" at the end of the file"""
+        size = self.info["size"]
+        while True:
+            if amount == 0 or (not size is None and self.position >= size):
+                return b""
+            if self._response is None:
+                self._open()
+            try:
+                data = self._response.read(amount)
+                if len(data) == 0 and not size is None:
+                    raise http.client.IncompleteRead(b"", size-self.position)
+            except CONNECTION_ERRORS as e:
+                self.close()
+                if isinstance(e, RepositoryError) or self._attempt >= self.client.retries:
+                    raise
+                time.sleep(RETRY_BACKOFF*(2**self._attempt))
+                self._attempt += 1
+                continue
+            self.position += len(data)
+            # only consecutive failures count
+            self._attempt = 0
+            return data
+
+    def close(self):
+        if not self._response is None:
+            self._response.release()
+            self._response = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
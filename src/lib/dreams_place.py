@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+import os
+import sys
+import shutil
+
+# ioctl cloning a whole file on Linux (btrfs, xfs, bcachefs...)
+_FICLONE = 0x40049409
+
+class PlaceMethod:
+    RENAME = "rename"
+    REFLINK = "reflink"
+    HARDLINK = "hardlink"
+    KERNEL_COPY = "copy_file_range"
+    COPY = "copy"
+
+def _reflink(src:str, target:str) -> bool:
+    if not sys.platform.startswith("linux"):
+        return False
+    import fcntl
+    with open(src,"rb") as source, open(target,"wb") as output:
+        try:
+            fcntl.ioctl(output.fileno(), _FICLONE, source.fileno())
+            return True
+        except OSError:
+            return False
+
+def _kernel_copy(src:str, target:str) -> bool:
+    if not hasattr(os, "copy_file_range"):
+        return False
+    with open(src,"rb") as source, open(target,"wb") as output:
+        try:
+            # may share the blocks (reflink) or copy them server side (NFS)
+            while os.copy_file_range(source.fileno(), output.fileno(), 1 << 30) > 0:
+                pass
+            return True
+        except OSError:
+            return False
+
+def _hardlink(src:str, target:str) -> bool:
+    if os.path.lexists(target):
+        os.remove(target)
+    try:
+        os.link(src, target)
+        return True
+    except OSError:
+        return False
+
+def place_file(src:str, target:str, move=False, hardlink=False) -> str:
+    """Places the content of `src` at `target` (replaced if it exists) the
+    cheapest way available, in order:
+    - rename, if `move` is set and both are on the same file system
+    - reflink, sharing the blocks of `src` until one of them is modified
+    - hardlink, if `hardlink` is set: both paths are then the same file,
+    modifying one modifies the other
+    - copy_file_range, copying in the kernel
+    - streamed binary copy
+
+    Copies keep the permissions of `src`, like shutil.copy.
+    Returns the PlaceMethod used."""
+    if move:
+        try:
+            os.replace(src, target)
+            return PlaceMethod.RENAME
+        except OSError:
+            pass
+
+    if os.path.isdir(target):
+        raise IsADirectoryError(f"{target} is a directory")
+    # never writing through the existing target, which may be a hardlink
+    # to another file. Replacing it also makes the placement atomic.
+    tmp_target = f"{target}.tmp"
+    if os.path.lexists(tmp_target):
+        os.remove(tmp_target)
+    try:
+        if _reflink(src, tmp_target):
+            method = PlaceMethod.REFLINK
+        elif hardlink and _hardlink(src, tmp_target):
+            method = PlaceMethod.HARDLINK
+        elif _kernel_copy(src, tmp_target):
+            method = PlaceMethod.KERNEL_COPY
+        else:
+            # shutil uses the fast copy of the platform if there is one
+            shutil.copyfile(src, tmp_target)
+            method = PlaceMethod.COPY
+        if not method == PlaceMethod.HARDLINK:
+            shutil.copymode(src, tmp_target)
+        os.replace(tmp_target, target)
+    except BaseException:
+        if os.path.lexists(tmp_target):
+            os.remove(tmp_target)
+        raise
+    if move:
+        os.remove(src)
+    return method
@@ -2,6 +2,44 @@
 import os
 import json
 import lib.dreams as dreams
+from lib.dreams import DirNames
+
+class _HashingSink:
+    """file-like object hashing and counting the bytes written to it"""
+
+    def __init__(self, algorithm:str):
+        self.hash = dreams.new_hash(algorithm)
+        self.size = 0
+
+    def write(self, data:bytes):
+        self.hash.update(data)
+        self.size += len(data)
+
+def describe_release_archive(sftp, pack_root:str, algorithm=dreams.DEFAULT_HASH_ALGORITHM) -> dict:
+    """Records the size and hash of the archive built by the release script
+    of the server (`{pack_root}/latest.zip`) in the latest release
+    description next to it, which the installs and upgrades check the
+    archive against: "archive-size", "archive-hash" and
+    "archive-hash-algorithm". The archive is read, never replaced.
+
+    `sftp` : the sftp client of the server
+    Returns the recorded fields."""
+    sink = _HashingSink(algorithm)
+    sftp.getfo(f"{pack_root}/{DirNames.Server.LATEST_ARCHIVE}", sink)
+    archive_meta = {
+        "archive-size": sink.size,
+        "archive-hash": sink.hash.hexdigest(),
+        "archive-hash-algorithm": algorithm
+    }
+    meta_path = f"{pack_root}/{DirNames.Server.LATEST_META}"
+    with sftp.open(meta_path, "r") as remote_meta:
+        latest_meta = json.load(remote_meta)
+    latest_meta.update(archive_meta)
+    # replaced at once, never seen half written by an install
+    with sftp.open(f"{meta_path}.tmp", "w") as out:
+        out.write(json.dumps(latest_meta))
+    sftp.posix_rename(f"{meta_path}.tmp", meta_path)
+    return archive_meta
 
 def main(args:list):
     import pysftp
@@ -17,11 +55,8 @@ def main(args:list):
     if not os.path.isfile(config_publish_file):
         print("Publication config not found, aborting.")
         return
-    config_publish = {}
-    try:
-        with open(config_publish_file,"r",encoding="UTF-8") as infile:
-            config_publish = json.load(infile)
-    except Exception:
+    config_publish = dreams.get_config_snapshot().read_json(dreams.DirNames.FILE_CONFIG_PUBLICATION)
+    if not isinstance(config_publish, dict):
         print("Could not load the publication config, aborting.")
         return
 
@@ -112,17 +147,15 @@ def main(args:list):
                 transfer_queue[full_path] = rem_file_path
         print("local files discovered!")
         print("sending to remote...")
-        for index,data in enumerate(transfer_queue.items()):
-            dreams.print_progess_bar(
-                (index+1)/len(transfer_queue),
-                50,
-                f"transfering files : ({index+1}/{len(transfer_queue)}) ["
-            )
+        progress = dreams.Progress(len(transfer_queue), "transfering files")
+        for data in transfer_queue.items():
+            progress.update()
             sftp.put(
                 localpath=data[0],
                 remotepath=data[1],
                 confirm=True
             )
+        progress.close()
         print("all files sent to remote, executing release script on remote...")
 
     _, stdout, _ = ssh_client.exec_command(release_bundle_command)  # Non-blocking call
@@ -132,6 +165,17 @@ def main(args:list):
         print ("release successfully sent and bundled!")
     else:
         print("release was sent, but could not be bundled. ", exit_status)
+        ssh_client.close()
+        return
+
+    print("describing the release archive...")
+    algorithm = dreams.get_config().get("hash-algorithm", dreams.DEFAULT_HASH_ALGORITHM)
+    try:
+        with ssh_client.open_sftp() as sftp:
+            archive_meta = describe_release_archive(sftp, remote_pack_root, algorithm=algorithm)
+        print(f"release archive described ({dreams.byte_str(archive_meta['archive-size'])})!")
+    except (IOError, ValueError) as e:
+        print(f"the release archive could not be described ({e}), the installs will not be able to check it.")
     ssh_client.close()
 
 if __name__ == "__main__":
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+import os
+import json
+import stat
+import lib.dreams as dreams
+from lib.dreams import DirNames
+
+# what is shared by default: mods are never modified once installed,
+# unlike configs
+DEFAULT_STORE_INCLUDE = [f"{DirNames.MODS}/"]
+
+class SharedStore:
+    """Content addressed store of files shared between profiles.
+
+    Files are stored once, as `{path}/{algorithm}/{hash[0:2]}/{hash}`, and
+    placed in the profiles as hardlinks. The link count of a stored file
+    is its reference count: a file only linked by the store (count of 1)
+    is not used by any profile anymore, and is removed by `collect()`.
+    Stored files are read only, they must be replaced, never modified.
+
+    `include` : the relative paths (prefixes) of the files to share"""
+
+    def __init__(self, path:str, include=DEFAULT_STORE_INCLUDE):
+        self.path = path.replace("\\","/")
+        self.include = list(include)
+        self.matcher = dreams.PathMatcher(include)
+
+    def accepts(self, relative:str) -> bool:
+        return self.matcher.matches(relative.replace("\\","/"))
+
+    def path_for(self, digest:str, algorithm=dreams.DEFAULT_HASH_ALGORITHM) -> str:
+        return f"{self.path}/{algorithm}/{digest[0:2]}/{digest}"
+
+    def contains(self, digest:str, algorithm=dreams.DEFAULT_HASH_ALGORITHM) -> bool:
+        return len(digest) > 0 and os.path.isfile(self.path_for(digest, algorithm))
+
+    def link(self, digest:str, target:str, algorithm=dreams.DEFAULT_HASH_ALGORITHM) -> bool:
+        """places the stored file at `target` (replaced if it exists),
+        returns False if it is not stored or cannot be linked there"""
+        if not self.contains(digest, algorithm):
+            return False
+        tmp_target = f"{target}.tmp"
+        try:
+            if os.path.lexists(tmp_target):
+                os.remove(tmp_target)
+            os.link(self.path_for(digest, algorithm), tmp_target)
+            os.replace(tmp_target, target)
+            return True
+        except OSError:
+            if os.path.lexists(tmp_target):
+                os.remove(tmp_target)
+            return False
+
+    def adopt(self, absolute:str, digest:str, algorithm=dreams.DEFAULT_HASH_ALGORITHM) -> bool:
+        """shares the file `absolute` of a profile, whose hash is `digest`:
+        the file is linked in the store, or replaced by the stored one if
+        the store already has it. Returns False if it cannot be linked."""
+        blob = self.path_for(digest, algorithm)
+        if self.contains(digest, algorithm):
+            if os.path.samestat(os.stat(absolute), os.stat(blob)):
+                return True
+            return self.link(digest, absolute, algorithm)
+        try:
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            os.link(absolute, blob)
+        except FileExistsError:
+            # stored by another profile in the meantime
+            return self.link(digest, absolute, algorithm)
+        except OSError:
+            return False
+        # read only files cannot be replaced on Windows
+        if not os.name == "nt":
+            mode = os.stat(blob).st_mode
+            os.chmod(blob, mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+        return True
+
+    def blobs(self):
+        """yields the path and stat of every stored file"""
+        for root, _, files in os.walk(self.path):
+            for file in files:
+                path = f"{root}/{file}".replace("\\","/")
+                yield (path, os.stat(path))
+
+    def stats(self) -> dict:
+        count = 0
+        size = 0
+        unused = 0
+        saved = 0
+        for _, blob_stat in self.blobs():
+            count += 1
+            size += blob_stat.st_size
+            if blob_stat.st_nlink <= 1:
+                unused += 1
+            # every profile past the first one would have needed a copy
+            saved += blob_stat.st_size*max(0, blob_stat.st_nlink-2)
+        return {"files": count, "size": size, "unused": unused, "saved": saved}
+
+    def collect(self) -> tuple:
+        """removes the stored files no profile uses anymore, returns the
+        amount of files and bytes freed"""
+        count = 0
+        size = 0
+        for path, blob_stat in list(self.blobs()):
+            if blob_stat.st_nlink <= 1:
+                os.chmod(path, blob_stat.st_mode | stat.S_IWUSR)
+                os.remove(path)
+                count += 1
+                size += blob_stat.st_size
+        return (count, size)
+
+def get_default_store_path() -> str:
+    mc_dir = dreams.get_minecraft_dir()
+    if mc_dir is None:
+        return None
+    return f"{mc_dir}/{DirNames.Minecraft.SHARED_STORE}"
+
+def get_profile_store(root=None) -> SharedStore:
+    """returns the store used by the profile, or None if it does not use
+    one (see `enable_profile_store`)"""
+    try:
+        with open(dreams.get_as_path(DirNames.FILE_STORE, root=root),"r",encoding="UTF-8") as fp:
+            data = json.load(fp)
+        return SharedStore(data["path"], include=data.get("include", DEFAULT_STORE_INCLUDE))
+    except (OSError, ValueError, KeyError):
+        return None
+
+def enable_profile_store(root:str, path=None, include=DEFAULT_STORE_INCLUDE) -> SharedStore:
+    """makes the profile use the store at `path` (default: in the .minecraft)
+    for its next installs and upgrades"""
+    if path is None:
+        path = get_default_store_path()
+    if path is None:
+        raise FileNotFoundError("no .minecraft found to keep the shared store in")
+    store = SharedStore(path, include=include)
+    os.makedirs(store.path, exist_ok=True)
+    store_file = dreams.get_as_path(DirNames.FILE_STORE, root=root)
+    os.makedirs(os.path.dirname(store_file), exist_ok=True)
+    with open(store_file,"w",encoding="UTF-8") as out:
+        json.dump({"path": store.path, "include": store.include}, out, indent=4)
+    return store
+
+def main(args:list):
+    store = get_profile_store()
+    for a in args:
+        if a.startswith("--store="):
+            store = SharedStore(a[a.find("=")+1:len(a)].replace('"',''))
+    if store is None and not get_default_store_path() is None:
+        store = SharedStore(get_default_store_path())
+    if store is None or not os.path.isdir(store.path):
+        print("No shared store found.")
+        return
+
+    print(f"shared store: {store.path}")
+    if "--gc" in args:
+        print("  removing the files no profile uses anymore...")
+        count, size = store.collect()
+        print(f"✓ {count} files removed, {dreams.byte_str(size)} freed")
+    stats = store.stats()
+    print(f"  {stats['files']} files, {dreams.byte_str(stats['size'])}, {stats['unused']} unused")
+    print(f"  {dreams.byte_str(stats['saved'])} saved by sharing them between profiles")
+
+if __name__ == "__main__":
+    main(os.sys.argv)
@@ -1,64 +1,197 @@
 #!/usr/bin/env python3
 import os
 import shutil
-import tempfile
-from urllib.parse import urlparse
 import lib.dreams as dreams
 import lib.dreams_install as dreams_install
 from lib.dreams_install import InstallMode
-from http.client import HTTPSConnection
-from zipfile import ZipFile
+from lib.dreams_hash import HashCache, hash_files, write_hashed
+from lib.dreams import is_standalone
+from lib.dreams_place import place_file
+from lib.dreams_store import get_profile_store
+from lib.dreams_cache import get_download_cache
+from lib.dreams_delta import DELTA_MIN_SIZE, download_delta
+from lib.dreams_manifest import BinaryManifest, diff_manifests
+from lib.dreams_net import RepositoryClient, RepositoryError, CONNECTION_ERRORS
+import zlib
+from zipfile import ZipFile, BadZipFile
+from contextlib import nullcontext
 from datetime import datetime
 import json
-import copy
-import urllib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-def get_version_content(lines:list) -> dict:
-    content = dict()
+DEFAULT_DOWNLOAD_CONCURRENCY = 4
+# what a request costs on top of the file it downloads (latency, headers),
+# in bytes, when comparing a file by file upgrade with the whole archive
+REQUEST_COST = 32*1024
+
+# first line of the version content files recording how they were made,
+# files without it are legacy md5 files.
+VERSION_CONTENT_HEADER = "#dreams-content"
+VERSION_CONTENT_FORMAT = 2
+
+class VersionContent(dict):
+    """A `{relative_path: hash}` dict which knows the hash algorithm used,
+    and the size of the files when the version content file records it."""
+    algorithm: str
+    sizes: dict
+
+    def __init__(self, *args, algorithm=dreams.LEGACY_HASH_ALGORITHM, sizes=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.algorithm = algorithm
+        self.sizes = sizes if not sizes is None else dict()
+
+def get_version_content(lines:list) -> VersionContent:
+    content = VersionContent()
     for l in lines:
-        stripped = l.decode("UTF-8").strip().replace("\\","/")
+        stripped = (l.decode("UTF-8") if isinstance(l, bytes) else l).strip().replace("\\","/")
+        if len(stripped) == 0:
+            continue
+        if stripped.startswith("#"):
+            if stripped.startswith(VERSION_CONTENT_HEADER):
+                for field in stripped.split()[1:]:
+                    key, _, value = field.partition("=")
+                    if key == "algorithm" and len(value) > 0:
+                        content.algorithm = value
+            continue
         if ":" in stripped:
+            # path:hash[:size], older versions only read the first two fields
             split = stripped.split(":")
             content[split[0]] = split[1]
+            if len(split) > 2 and split[2].isdigit():
+                content.sizes[split[0]] = int(split[2])
         else:
             content[stripped] = ""
     return content
 
+def format_version_content(content:dict, algorithm:str, sizes={}, unhashed=()) -> str:
+    """returns the text of a version content file listing `content`.
+    The `unhashed` files are listed without hash, then the version content
+    file itself last."""
+    content_str = f"{VERSION_CONTENT_HEADER} format={VERSION_CONTENT_FORMAT} algorithm={algorithm}\n"
+    for key, file_hash in content.items():
+        size = sizes.get(key)
+        content_str += f"{key}:{file_hash}:{size}\n" if not size is None else f"{key}:{file_hash}\n"
+    for key in unhashed:
+        content_str += f"{key}\n"
+    content_str += dreams.DirNames.FILE_VERSION_CONTENT
+    return content_str
+
+class PathSet:
+    """Set of relative paths keeping the order they were added in, with
+    constant time lookup and removal.
+
+    `copy()` is copy-on-write: the copies share their paths until one of
+    them is changed."""
+    __slots__ = ("_paths", "_shared")
+
+    def __init__(self, paths=()):
+        self._paths = dict.fromkeys(paths)
+        self._shared = False
+
+    def _own(self):
+        if self._shared:
+            self._paths = dict(self._paths)
+            self._shared = False
+
+    def add(self, path:str):
+        if not path in self._paths:
+            self._own()
+            self._paths[path] = None
+
+    def update(self, paths):
+        for path in paths:
+            self.add(path)
+
+    def discard(self, path:str):
+        if path in self._paths:
+            self._own()
+            del self._paths[path]
+
+    def filter(self, predicate) -> "PathSet":
+        """the paths for which `predicate(path)` is true"""
+        return PathSet(p for p in self._paths if predicate(p))
+
+    def exclude(self, matcher:dreams.PathMatcher) -> "PathSet":
+        """the paths not matched by `matcher`"""
+        if len(matcher) == 0:
+            return self.copy()
+        return self.filter(lambda p: not matcher.matches(p))
+
+    def copy(self) -> "PathSet":
+        paths = PathSet()
+        paths._paths = self._paths
+        paths._shared = self._shared = True
+        return paths
+
+    def __contains__(self, path) -> bool:
+        return path in self._paths
+
+    def __iter__(self):
+        return iter(self._paths)
+
+    def __len__(self) -> int:
+        return len(self._paths)
+
+    def __repr__(self) -> str:
+        return f"PathSet({list(self._paths)})"
+
 class ContentDifference:
-    added: list
-    removed: list
-    modified: list
-    old_version = None
-    new_version = None
+    """Files added, removed and modified from a content to another, as
+    PathSets in the order of the contents.
 
-    def __init__(self, added:list, removed:list, modified:list, old_version:str, new_version:str):
-        self.added = added
-        self.removed = removed
-        self.modified = modified
-        self.old_version = old_version
-        self.new_version = new_version
+    `sizes` : sizes of the files of the new version, when known
+    `hashes` : hashes of the files of the new version
+    `algorithm` : hash algorithm of both contents, when known"""
+    __slots__ = ("_added", "_removed", "_modified", "sizes", "hashes", "algorithm", "old_version", "new_version")
 
-    def get_content(path:str, use_cache=True, include=[], exclude=[], config=None) -> dict:
+    def get_content(path:str, use_cache=True, include=[], exclude=[], config=None, hash_cache=None, algorithm=None) -> VersionContent:
+        """`algorithm` : the hash algorithm the content should use, a version
+        content file using another one is ignored and the files are hashed.
+        The binary manifest of the version content is used if there is one
+        (see dreams_manifest)."""
         if os.path.isdir(path):
             content_list_file = dreams.get_as_path(dreams.DirNames.FILE_VERSION_CONTENT,root=path)
-            if use_cache and os.path.isfile(content_list_file):
+            binary_file = dreams.get_as_path(dreams.DirNames.FILE_VERSION_CONTENT_BINARY,root=path)
+            vc = None
+            if use_cache and os.path.isfile(binary_file):
+                try:
+                    vc = BinaryManifest.open(binary_file)
+                except (OSError, ValueError):
+                    vc = None
+                if not vc is None and not (algorithm is None or vc.algorithm == algorithm):
+                    vc.close()
+                    vc = None
+            if vc is None and use_cache and os.path.isfile(content_list_file):
                 with open(content_list_file,"rb") as file:
                     vc = get_version_content(file.readlines())
-                    for f in set(vc.keys()):
-                        if not os.path.isfile(f"{path}/{f}"):
-                            del vc[f]
-                    return vc
+            if not vc is None and (algorithm is None or vc.algorithm == algorithm):
+                for f in [f for f in vc.keys() if not os.path.isfile(f"{path}/{f}")]:
+                    del vc[f]
+                return vc
             else:
-                content = dict()
                 if config is None:
                     config = dreams.get_config(root=path)
-                for c in dreams.list_content(
+                if algorithm is None:
+                    algorithm = config.get("hash-algorithm", dreams.DEFAULT_HASH_ALGORITHM)
+                if hash_cache is None:
+                    hash_cache = HashCache(path)
+                content = hash_files(
                     path,
-                    include=include if len(include) > 0 else config.get("bundle-include",["/"]),
-                    exclude=exclude if len(exclude) > 0 else config.get("bundle-exclude",[])
-                    ):
-                    content[c] = dreams.get_file_hash(f"{dreams.get_as_path(c)}")
-                return content
+                    dreams.list_content(
+                        path,
+                        include=include if len(include) > 0 else config.get("bundle-include",["/"]),
+                        exclude=[
+                            *(exclude if len(exclude) > 0 else config.get("bundle-exclude",[])),
+                            dreams.DirNames.CACHE
+                        ]
+                    ),
+                    hash_cache=hash_cache,
+                    algorithm=algorithm,
+                    workers=config.get("hash-workers",None)
+                )
+                hash_cache.save()
+                return VersionContent(content, algorithm=algorithm)
             
         elif os.path.isfile(path) and path.endswith(".zip"):
             with ZipFile(path) as zipf:
@@ -67,16 +200,74 @@ class ContentDifference:
         raise FileNotFoundError("found nowhere to search for content")
 
     def __init__(self, old_content:dict, new_content:dict):
+        old_algorithm = getattr(old_content, "algorithm", None)
+        new_algorithm = getattr(new_content, "algorithm", None)
+        if not (old_algorithm is None or new_algorithm is None or old_algorithm == new_algorithm):
+            raise ValueError(f"contents hashed with {old_algorithm} and {new_algorithm} cannot be compared")
 
-        removed = [o for o in old_content.keys() if not o in new_content.keys()]
-        added = [o for o in new_content.keys() if not o in old_content.keys()]
-        modified = [k for k,v in new_content.items() if k in old_content.keys() and not old_content[k] == v]
+        if isinstance(old_content, BinaryManifest) and isinstance(new_content, BinaryManifest):
+            # both sorted, compared without being loaded
+            added, removed, modified = diff_manifests(old_content, new_content)
+        else:
+            added = []
+            modified = []
+            for path, file_hash in new_content.items():
+                if not path in old_content:
+                    added.append(path)
+                elif not old_content[path] == file_hash:
+                    modified.append(path)
+            removed = [path for path in old_content if not path in new_content]
 
         self.added = added
         self.removed = removed
         self.modified = modified
+        self.sizes = getattr(new_content, "sizes", {})
+        self.hashes = new_content
+        self.algorithm = new_algorithm if not new_algorithm is None else old_algorithm
+        self.old_version = None
+        self.new_version = None
+
+    # the lists assigned are turned into PathSets
+    @property
+    def added(self) -> PathSet:
+        return self._added
+
+    @added.setter
+    def added(self, paths):
+        self._added = paths if isinstance(paths, PathSet) else PathSet(paths)
+
+    @property
+    def removed(self) -> PathSet:
+        return self._removed
+
+    @removed.setter
+    def removed(self, paths):
+        self._removed = paths if isinstance(paths, PathSet) else PathSet(paths)
+
+    @property
+    def modified(self) -> PathSet:
+        return self._modified
+
+    @modified.setter
+    def modified(self, paths):
+        self._modified = paths if isinstance(paths, PathSet) else PathSet(paths)
+
+    def copy(self) -> "ContentDifference":
+        """copy sharing the contents of this difference, its paths are only
+        copied once changed"""
+        diff = ContentDifference.__new__(ContentDifference)
+        for attribute in ContentDifference.__slots__:
+            value = getattr(self, attribute)
+            setattr(diff, attribute, value.copy() if isinstance(value, PathSet) else value)
+        return diff
+
+    def exclude(self, matcher:dreams.PathMatcher):
+        """drops every path matched by `matcher`"""
+        self.added = self.added.exclude(matcher)
+        self.removed = self.removed.exclude(matcher)
+        self.modified = self.modified.exclude(matcher)
     
-    def from_path(self, old_path:str, new_path:str, config=dreams.get_config()):
+    def from_path(self, old_path:str, new_path:str, config=None):
         old_version = None
         new_version = None
 
@@ -155,69 +346,382 @@ class ContentDifference:
 
         return patch_str  
 
+class UpgradeJournal:
+    """Journal of an upgrade being committed, allowing an interrupted one
+    to be resumed or rolled back without downloading anything again.
+
+    The upgrade is staged first (see `download_upgrade`) in the staging
+    directory of the profile. Before the first file is changed, the lists
+    of files to change are written to the journal. Every file replaced or
+    removed is then moved to the backup directory, and every staged file
+    renamed in place. So for each file of the journal:
+    - still staged: not committed yet
+    - backed up and not staged anymore: committed
+    The journal is removed once every file is committed."""
+
+    def __init__(self, root:str):
+        self.root = root.replace("\\","/")
+        self.path = dreams.get_as_path(dreams.DirNames.FILE_UPGRADE_JOURNAL, root=self.root)
+        self.staging = dreams.get_as_path(dreams.DirNames.STAGING, root=self.root)
+        self.backup = dreams.get_as_path(dreams.DirNames.BACKUP, root=self.root)
+        self.data = None
+
+    def load(root:str) -> "UpgradeJournal":
+        """returns the journal of the interrupted upgrade of the profile, or
+        None if there is none"""
+        journal = UpgradeJournal(root)
+        try:
+            with open(journal.path,"r",encoding="UTF-8") as fp:
+                journal.data = json.load(fp)
+        except (OSError, ValueError):
+            return None
+        return journal
+
+    def difference(self) -> ContentDifference:
+        """the difference being committed"""
+        algorithm = self.data["algorithm"]
+        diff = ContentDifference(VersionContent(algorithm=algorithm), VersionContent(self.data["hashes"], algorithm=algorithm))
+        diff.added = self.data["added"]
+        diff.removed = self.data["removed"]
+        diff.modified = self.data["modified"]
+        diff.old_version = self.data["old-version"]
+        diff.new_version = self.data["new-version"]
+        return diff
+
+    def begin(self, difference:ContentDifference):
+        """records the changes of `difference` before they are committed"""
+        if os.path.isdir(self.backup):
+            # left by an upgrade that has been committed
+            shutil.rmtree(self.backup)
+        changed = [*difference.added, *difference.modified]
+        self.data = {
+            "old-version": difference.old_version,
+            "new-version": difference.new_version,
+            "algorithm": difference.algorithm,
+            "added": list(difference.added),
+            "removed": list(difference.removed),
+            "modified": list(difference.modified),
+            "hashes": {f: difference.hashes[f] for f in changed if f in difference.hashes}
+        }
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path,"w",encoding="UTF-8") as out:
+            json.dump(self.data, out)
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp_path, self.path)
+
+    def is_committed(self, relative:str) -> bool:
+        return not os.path.isfile(f"{self.staging}/{relative}")
+
+    def backup_file(self, relative:str):
+        """moves the installed file out of the way, unless it already is"""
+        target = f"{self.root}/{relative}"
+        backup = f"{self.backup}/{relative}"
+        if os.path.isfile(target) and not os.path.isfile(backup):
+            os.makedirs(os.path.dirname(backup), exist_ok=True)
+            os.replace(target, backup)
+
+    def rollback(self, verbose=True):
+        """puts the backed up files back in place, the new ones are moved
+        back to the staging directory for the next attempt"""
+        files = self.data["added"] + self.data["modified"] + self.data["removed"]
+        removed = set(self.data["removed"])
+        progress = dreams.Progress(len(files), "  restoring files", verbose=verbose)
+        for relative in files:
+            progress.update()
+            target = f"{self.root}/{relative}"
+            backup = f"{self.backup}/{relative}"
+            staged = f"{self.staging}/{relative}"
+            if os.path.isfile(target) and not os.path.isfile(staged) and not relative in removed:
+                os.makedirs(os.path.dirname(staged), exist_ok=True)
+                os.replace(target, staged)
+            if os.path.isfile(backup):
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(backup, target)
+        progress.close()
+        os.remove(self.path)
+        shutil.rmtree(self.backup, ignore_errors=True)
+
+    def finish(self):
+        """marks the upgrade as committed and removes what it left"""
+        # the journal goes first: without the backups it would not
+        # allow to roll back anymore.
+        os.remove(self.path)
+        shutil.rmtree(self.backup, ignore_errors=True)
+        shutil.rmtree(self.staging, ignore_errors=True)
+
 def compute_difference(server_domain:str, reference_install:str, target_version:str, config:dict) -> ContentDifference:
-    parsed = urlparse(server_domain)
-    
-    old_content = ContentDifference.get_content(reference_install,config)
-    new_content = {}
-    connection = HTTPSConnection(parsed.netloc, timeout=10)
-    # first, get the latest version
-    
-    if not target_version is None:
-        version_content_file = f"{target_version}/{dreams.DirNames.FILE_VERSION_CONTENT}"
-    else:
+    if target_version is None:
         return None
-    connection.request("GET",f"{parsed.path}/{dreams.DirNames.Server.VERSIONS}/{version_content_file}")
-    with connection.getresponse() as response:
-        if not response.status == 200:
+    client = RepositoryClient(f"{server_domain}/{dreams.DirNames.Server.VERSIONS}/{target_version}")
+    new_content = None
+    # both binary manifests are compared without being loaded, so the
+    # remote one is only useful if the installation has one
+    if os.path.isfile(dreams.get_as_path(dreams.DirNames.FILE_VERSION_CONTENT_BINARY, root=reference_install)):
+        raw_content = client.get_bytes(dreams.DirNames.FILE_VERSION_CONTENT_BINARY)
+        try:
+            new_content = BinaryManifest(raw_content) if not raw_content is None else None
+        except ValueError:
+            new_content = None
+    if new_content is None:
+        raw_content = client.get_bytes(dreams.DirNames.FILE_VERSION_CONTENT)
+        if raw_content is None:
             return None
-        new_content = get_version_content(response.readlines())
+        new_content = get_version_content(raw_content.splitlines())
     if len(new_content) == 0:
         return None
-    
-    connection.close()
-    
-    return ContentDifference(old_content, new_content)
+
+    # the local content has to be hashed the same way as the remote one,
+    # which may not be the case of the local version content file.
+    old_content = ContentDifference.get_content(reference_install, config=config, algorithm=new_content.algorithm)
+    diff = ContentDifference(old_content, new_content)
+    if isinstance(old_content, BinaryManifest):
+        # the mapped file is replaced by the upgrade
+        old_content.close()
+    return diff
+
+class UpgradeMethod:
+    FILES = "files"
+    ARCHIVE = "archive"
+    PATCH = "patch"
+
+class UpgradePlan:
+    """How an upgrade gets its files: downloading each of them, or
+    downloading the whole archive of the version, or the patch archive from
+    the installed version, and extracting them.
+
+    `files_size` : estimated cost of downloading the files (None if the
+    version content does not record the sizes)
+    `archive_size` : cost of downloading the archive (None if unknown, 0
+    if it is in the download cache)
+    `patch_size` : size of the patch archive (None if there is none)"""
+
+    def __init__(self, method:str, file_count:int, files_size:int, archive_size:int, patch_size=None):
+        self.method = method
+        self.file_count = file_count
+        self.files_size = files_size
+        self.archive_size = archive_size
+        self.patch_size = patch_size
+
+    def summary(self) -> str:
+        if self.file_count == 0:
+            return "every file is available locally, nothing to download"
+        files_str = f"{self.file_count} file(s)" if self.files_size is None else f"{self.file_count} file(s), about {dreams.byte_str(self.files_size)}"
+        if self.method == UpgradeMethod.PATCH:
+            return f"using the patch archive, {dreams.byte_str(self.patch_size)}, instead of downloading {files_str}"
+        if self.archive_size is None:
+            return f"downloading {files_str}"
+        archive_str = "the archive, in the download cache" if self.archive_size == 0 else f"the archive, {dreams.byte_str(self.archive_size)}"
+        if self.method == UpgradeMethod.ARCHIVE:
+            return f"using {archive_str}, instead of downloading {files_str}"
+        return f"downloading {files_str}, instead of {archive_str}"
+
+def plan_upgrade(diff:ContentDifference, latest:dict, store=None, cache=None, patch_size=None) -> UpgradePlan:
+    """Chooses the cheapest way to get the files of `diff`, whatever the
+    amount of versions between the installed one and the latest: the
+    difference is computed against the latest version directly, so a file
+    changed by several versions is still only downloaded once.
+
+    `latest` : the latest release description (see dreams_install.get_latest_meta)
+    `patch_size` : size of the patch archive from the installed version,
+    if there is one (made for this exact upgrade)
+
+    The files available locally cost nothing, the others their size plus
+    REQUEST_COST each, an archive its size plus REQUEST_COST (nothing if
+    it is in the download cache). When the sizes of the files are unknown,
+    an archive is used if it is cached, the patch archive otherwise."""
+    algorithm = diff.algorithm if not diff.algorithm is None else dreams.DEFAULT_HASH_ALGORITHM
+    def is_available(f:str) -> bool:
+        digest = diff.hashes.get(f,"")
+        return (
+            (not store is None and store.accepts(f) and store.contains(digest, algorithm))
+            or (not cache is None and cache.contains(digest, algorithm))
+        )
+    to_download = [f for f in [*diff.added, *diff.modified] if not is_available(f)]
+    files_size = None
+    if len(diff.sizes) > 0:
+        files_size = sum(diff.sizes.get(f,0) + REQUEST_COST for f in to_download)
+
+    archive_size = latest.get("archive-size")
+    archive_hash = latest.get("archive-hash")
+    if not cache is None and cache.contains(archive_hash, latest.get("archive-hash-algorithm", dreams.DEFAULT_HASH_ALGORITHM)):
+        archive_size = 0
+    costs = {UpgradeMethod.FILES: files_size}
+    if not patch_size is None:
+        costs[UpgradeMethod.PATCH] = patch_size + REQUEST_COST
+    # the archive is only used if it can be verified
+    if not archive_size is None and not archive_hash is None:
+        costs[UpgradeMethod.ARCHIVE] = archive_size + REQUEST_COST if archive_size > 0 else 0
+
+    method = UpgradeMethod.FILES
+    if len(to_download) > 0:
+        if not files_size is None:
+            # the first of the cheapest, downloading the files on a tie
+            method = min(costs, key=lambda m: costs[m])
+        elif costs.get(UpgradeMethod.ARCHIVE) == 0:
+            method = UpgradeMethod.ARCHIVE
+        elif UpgradeMethod.PATCH in costs:
+            method = UpgradeMethod.PATCH
+    return UpgradePlan(method, len(to_download), files_size, archive_size, patch_size=patch_size)
 
 def download_upgrade(
         server_domain:str, 
         download_location:str, 
         target_version:str, 
         diff:ContentDifference,
-        verbose=True
-    ):
-    parsed = urlparse(server_domain)
+        verbose=True,
+        concurrency=DEFAULT_DOWNLOAD_CONCURRENCY,
+        store=None,
+        cache=None,
+        archive=None,
+        reference=None
+    ) -> list:
+    """Downloads the added and modified files of `diff`, `concurrency` at a
+    time, biggest first. Each file is retried on its own. Files found in
+    the shared `store` (see dreams_store) are not downloaded, those found in
+    the download `cache` (see dreams_cache) are copied from it, the others
+    are added to it. If `archive` (the ZipFile of the version, or a patch
+    archive) is set, the files it has are extracted from it instead of
+    being downloaded. If `reference` (the installation being upgraded) is
+    set, the big modified files are rebuilt from their installed copy,
+    downloading only the blocks that changed (see dreams_delta).
+
+    `download_location` is the staging directory of the upgrade: each file
+    is staged as soon as it is downloaded, while the others download. It is
+    hashed while it is written and checked against its hash in `diff`, and
+    shared files are linked to the store, so that installing the upgrade
+    (see `install_upgrade`) only has to move the files in place. Files of
+    the store are staged as links to it. The hashes of the staged files
+    are stored in the hash cache of `download_location`, and the files
+    already staged there with the right content are kept.
+
+    Returns the list of `(file, error)` that could not be staged."""
     _chunk_size = 65536
     if os.path.isfile(download_location):
         raise FileExistsError("file already exists")
     if not os.path.isdir(download_location):
         raise FileNotFoundError("download loaction does not exist")
 
-    connection = HTTPSConnection(parsed.netloc, timeout=180)
-    # downloading files in diff.added and diff.modified
-    download_queue = diff.added + diff.modified
-    queue_length = len(download_queue)
-    try:
-        for index, f in enumerate(download_queue):
-            connection.request("GET",urllib.parse.quote(f"{parsed.path}/{dreams.DirNames.Server.VERSIONS}/{target_version}/{f}"))
-            dl_target = f"{download_location}/{f}"
-            if not os.path.isdir(os.path.dirname(dl_target)):
-                os.makedirs(os.path.dirname(dl_target))
-            if verbose:
-                dreams.print_progess_bar(
-                    (index+1)/queue_length,
-                    50,
-                    prepend=f"  downloading upgrade patch: ["
-                    )
-            with connection.getresponse() as response:
-                with open(dl_target, "ab") as data_output:
-                    while chunk := response.read(_chunk_size):
-                        data_output.write(chunk)
-    except RuntimeError as e:
-        print(f"error dl: {e}")
-        return None
-    
-    connection.close()
+    client = RepositoryClient(f"{server_domain}/{dreams.DirNames.Server.VERSIONS}/{target_version}")
+    algorithm = diff.algorithm if not diff.algorithm is None else dreams.DEFAULT_HASH_ALGORITHM
+    def is_stored(f:str) -> bool:
+        return not store is None and store.accepts(f) and store.contains(diff.hashes.get(f,""), algorithm)
+    stored = [f for f in [*diff.added, *diff.modified] if is_stored(f)]
+    # downloading files in diff.added and diff.modified, the biggest
+    # first so that they do not end up alone at the end.
+    download_queue = sorted(
+        [f for f in [*diff.added, *diff.modified] if not is_stored(f)],
+        key=lambda f: diff.sizes.get(f,0),
+        reverse=True
+        )
+    # version content files written before the sizes were recorded
+    # only allow to count files.
+    sized = len(diff.sizes) > 0
+    progress = dreams.Progress(
+        sum(diff.sizes.get(f,0) for f in download_queue) if sized else len(download_queue),
+        "  downloading upgrade patch",
+        unit=dreams.ProgressUnit.BYTES if sized else dreams.ProgressUnit.COUNT,
+        verbose=verbose
+        )
+    failed = []
+    hash_cache = HashCache(download_location)
+    archive_names = set(archive.namelist()) if not archive is None else set()
+
+    delta_stats = [0, 0]
+    delta_lock = threading.Lock()
+    def get_delta(f:str, dl_target:str) -> str:
+        local = f"{reference}/{f}" if not reference is None else None
+        if local is None or not f in diff.modified or diff.sizes.get(f,0) < DELTA_MIN_SIZE or not os.path.isfile(local):
+            return None
+        try:
+            delta = download_delta(client, f, local, dl_target, algorithm=algorithm)
+        except (*CONNECTION_ERRORS, OSError):
+            # a part could not be downloaded, or the file changed on the
+            # server meanwhile: downloaded whole instead
+            return None
+        if delta is None:
+            return None
+        if not delta[0] == diff.hashes.get(f):
+            # downloaded whole instead
+            os.remove(dl_target)
+            return None
+        with delta_lock:
+            delta_stats[0] += 1
+            delta_stats[1] += diff.sizes.get(f,0)-delta[1]
+        return delta[0]
+
+    def extract(f:str, dl_target:str) -> str:
+        """returns the hash of the file extracted from the archive, or None
+        if its member is corrupted"""
+        try:
+            with archive.open(f) as member:
+                return write_hashed(iter(lambda: member.read(_chunk_size), b""), dl_target, algorithm=algorithm)
+        except (BadZipFile, zlib.error):
+            # downloaded on its own instead
+            return None
+
+    def link(f:str):
+        dl_target = f"{download_location}/{f}"
+        os.makedirs(os.path.dirname(dl_target), exist_ok=True)
+        if not store.link(diff.hashes[f], dl_target, algorithm=algorithm):
+            raise FileNotFoundError("could not be linked from the shared store")
+        hash_cache.record(f, diff.hashes[f], algorithm=algorithm)
+
+    def download(f:str):
+        dl_target = f"{download_location}/{f}"
+        os.makedirs(os.path.dirname(dl_target), exist_ok=True)
+        expected_hash = diff.hashes.get(f)
+        if (
+            # staged by a previous attempt
+            not expected_hash in (None, "") and os.path.isfile(dl_target)
+            and hash_cache.get_file_hash(f, algorithm=algorithm) == expected_hash
+        ):
+            digest = expected_hash
+            progress.update(diff.sizes.get(f,0) if sized else 1)
+        elif not cache is None and cache.get(expected_hash, dl_target, algorithm):
+            digest = expected_hash
+            progress.update(diff.sizes.get(f,0) if sized else 1)
+        elif f in archive_names and not (digest := extract(f, dl_target)) is None:
+            if not expected_hash in (None, "", digest):
+                os.remove(dl_target)
+                raise RepositoryError(f"content does not match version {target_version}")
+            progress.update(diff.sizes.get(f,0) if sized else 1)
+        elif not (delta := get_delta(f, dl_target)) is None:
+            digest = delta
+            progress.update(diff.sizes.get(f,0) if sized else 1)
+        else:
+            digest = client.download(f, dl_target, progress=progress if sized else None, chunk_size=_chunk_size, algorithm=algorithm)
+            if not digest:
+                raise FileNotFoundError("not provided by the repository")
+            # files without hash (the version content file) cannot be checked
+            if not expected_hash in (None, "", digest):
+                os.remove(dl_target)
+                raise RepositoryError(f"content does not match version {target_version}")
+            if not cache is None:
+                cache.put(dl_target, digest, algorithm)
+            if not sized:
+                progress.update()
+        if not store is None and store.accepts(f):
+            store.adopt(dl_target, digest, algorithm=algorithm)
+        hash_cache.record(f, digest, algorithm=algorithm)
+
+    with ThreadPoolExecutor(max_workers=max(1,concurrency)) as pool:
+        futures = {pool.submit(link, f): f for f in stored}
+        futures.update({pool.submit(download, f): f for f in download_queue})
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except (RepositoryError, OSError, BadZipFile, zlib.error) as e:
+                failed.append((futures[future], e))
+    progress.close()
+    hash_cache.save()
+    if verbose and delta_stats[0] > 0:
+        print(f"  {delta_stats[0]} file(s) rebuilt from their installed copy, {dreams.byte_str(delta_stats[1])} not downloaded")
+    if not cache is None:
+        if verbose and cache.hits > 0: print(f"  {cache.stats_str()}")
+        cache.trim()
+    return failed
 
 def install_upgrade(
         source:str, 
@@ -226,81 +730,110 @@ def install_upgrade(
         install_defaults=True, 
         verbose=True, 
         install_mode=InstallMode.CLIENT,
-        config=dreams.get_config()
+        config=None,
+        move=False,
+        store=None,
+        journal=None
     ) -> ContentDifference:
     # "source" is the new version, "install location" points to where
     # the old one is installed.
+    # "move" allows to move the files out of "source" instead of copying
+    # them, when it is a download directory.
+    # "store" is the shared store of the profile (see dreams_store), the
+    # files it has are linked from it instead of being taken from "source".
+    # "journal" is the UpgradeJournal of a staged upgrade, "source" being
+    # its staging directory: the files replaced or removed are backed up,
+    # and the files already committed by an interrupted attempt skipped.
     if not os.path.isdir(source):
         raise FileNotFoundError("source is not a directory")
     if not os.path.isdir(install_location):
         raise NotADirectoryError("install location is not a directory")
     
-    result_diff = copy.deepcopy(difference)
+    if config is None:
+        config = dreams.get_config()
+
+    result_diff = difference.copy()
 
+    # "upgrade-ignore-global" entries are ignored for every kind of change
     ignore_global = config.get("upgrade-ignore-global",[])
-    ignore_remove = config.get("upgrade-ignore-remove",[])
-    ignore_add = config.get("upgrade-ignore-add",[])
-    ignore_modify = config.get("upgrade-ignore-modify",[])
+    ignore_remove = dreams.PathMatcher([*ignore_global, *config.get("upgrade-ignore-remove",[])])
+    ignore_add = dreams.PathMatcher([*ignore_global, *config.get("upgrade-ignore-add",[])])
+    ignore_modify = dreams.PathMatcher([*ignore_global, *config.get("upgrade-ignore-modify",[])])
+    result_diff.added = difference.added.exclude(ignore_add)
+    result_diff.removed = difference.removed.exclude(ignore_remove)
+    result_diff.modified = difference.modified.exclude(ignore_modify)
+    if not journal is None:
+        if journal.data is None:
+            journal.begin(result_diff)
+        # only committing what is left
+        result_diff.added = result_diff.added.filter(lambda a: not journal.is_committed(a))
+        result_diff.modified = result_diff.modified.filter(lambda m: not journal.is_committed(m))
 
-    # adding added
-    for index, a in enumerate(difference.added):
-        if any(s for s in ignore_add if a.startswith(s)) or a in ignore_global:
-            result_diff.added.remove(a)
-            continue
-        dreams.print_progess_bar(
-            (index+1)/len(difference.added),
-            50,
-            prepend=f"  adding files: {index+1}/{len(difference.added)} ["
-        )
+    # the hashes of the new files are known from the source, they are
+    # stored for the installed copies so that they are not read again.
+    algorithm = result_diff.algorithm if not result_diff.algorithm is None else dreams.DEFAULT_HASH_ALGORITHM
+    source_cache = HashCache(source)
+    hash_cache = HashCache(install_location)
+    def place(relative:str):
+        src = f"{source}/{relative}"
+        target = f"{install_location}/{relative}"
+        shared = not store is None and store.accepts(relative)
+        # files staged by download_upgrade are already in the store
+        if shared and not os.path.isfile(src) and store.link(difference.hashes.get(relative,""), target, algorithm=algorithm):
+            hash_cache.record(relative, difference.hashes[relative], algorithm=algorithm)
+            return
+        digest = source_cache.get_file_hash(relative, algorithm=algorithm)
+        place_file(src, target, move=move)
+        if shared:
+            store.adopt(target, digest, algorithm=algorithm)
+        hash_cache.record(relative, digest, algorithm=algorithm)
 
-        src = f"{source}/{a}"
+    # adding added
+    progress = dreams.Progress(len(result_diff.added), "  adding files", verbose=verbose)
+    for a in result_diff.added:
+        progress.update()
         target = f"{install_location}/{a}"
         if not os.path.isdir(os.path.dirname(target)):
             os.makedirs(os.path.dirname(target))
         if not os.path.isfile(target):
-            shutil.copy(src,target)
+            place(a)
         else:
             print(f"warning: file {a} already exists")
+    progress.close()
 
     # removing removed
-    for index, r in enumerate(difference.removed) or r in ignore_global:
-        if any(s for s in ignore_remove if r.startswith(s)):
-            result_diff.removed.remove(r)
-            continue
+    progress = dreams.Progress(len(result_diff.removed), "  removing files", verbose=verbose)
+    for r in result_diff.removed:
         target = f"{install_location}/{r}"
+        progress.update()
         if os.path.isfile(target):
-            dreams.print_progess_bar(
-                (index+1)/len(difference.removed),
-                50,
-                prepend=f"  removing files: {index+1}/{len(difference.removed)} ["
-                )
-
-            os.remove(target)
-        else:
+            if not journal is None:
+                journal.backup_file(r)
+            else:
+                os.remove(target)
+            hash_cache.invalidate(r)
+        elif journal is None or not os.path.isfile(f"{journal.backup}/{r}"):
             print(f"warning: file {r} has already been removed")
+    progress.close()
 
     # replacing modified
-    for index, m in enumerate(difference.modified) or m in ignore_global:
-        if any(s for s in ignore_modify if m.startswith(s)):
-            result_diff.modified.remove(m)
-            continue
-        if verbose: dreams.print_progess_bar(
-            (index+1)/len(difference.modified),
-            50,
-            prepend=f"  replacing files: {index+1}/{len(difference.modified)} ["
-            )
-        
-        src = f"{source}/{m}"
+    progress = dreams.Progress(len(result_diff.modified), "  replacing files", verbose=verbose)
+    for m in result_diff.modified:
+        progress.update()
         target = f"{install_location}/{m}"
         if not os.path.isdir(os.path.dirname(target)):
             os.makedirs(os.path.dirname(target))
 
         try:
-            with open(src,"r") as input:
-                with open(target,"w") as output:
-                    output.write(input.read())
-        except:
-            pass
+            if not journal is None:
+                journal.backup_file(m)
+            place(m)
+        except OSError as e:
+            if not journal is None and os.path.isfile(f"{journal.backup}/{m}"):
+                os.replace(f"{journal.backup}/{m}", target)
+            print(f"warning: file {m} could not be replaced ({e})")
+    progress.close()
+    hash_cache.save()
 
     if install_defaults:
         if verbose: print("  moving defaults...")
@@ -313,7 +846,7 @@ def install_upgrade(
                     rel_path = dest.replace(f"{install_location}/","")
                     if not os.path.isfile(dest): 
                         if verbose: print(f"    moving {rel_path}...")
-                        shutil.copy(f"{root}/{file}", dest)
+                        place_file(f"{root}/{file}", dest)
         except:
             if verbose: print("  defaults could not be moved!")
     
@@ -341,18 +874,63 @@ def install_upgrade(
                         dest_file = src_file.replace(ref_world_dir, world_dir)
                         rel_file = src_file.replace("\\","/").replace(f"{root}/","")
                         if os.path.isfile(dest_file):
-                            result_diff.modified.append(rel_file)
-                            os.remove(dest_file)
+                            result_diff.modified.add(rel_file)
                         else:
-                            result_diff.added.append(rel_file)
+                            result_diff.added.add(rel_file)
                         if not os.path.isdir(os.path.dirname(dest_file)):
                             os.makedirs(os.path.dirname(dest_file))
-                        shutil.copy(src_file,dest_file)
+                        place_file(src_file,dest_file)
 
     return result_diff
 
-def upgrade_pack(install_mode: str, install_location:str, repository:str, verbose=True, generate_patchnote=True, wait_for_confirm=False):
-    download_tmp = tempfile.TemporaryDirectory()
+def write_patchnote(diff:ContentDifference, install_location:str):
+    patch_str = f"{datetime.now().isoformat()}\n\n{diff.patchnote()}"
+    patch_file_name = f"patchnote_{diff.old_version}-{diff.new_version}.log"
+    patch_target = f"{dreams.get_as_path(dreams.DirNames.PATCHNOTES, root=install_location)}/{patch_file_name}"
+    if not os.path.isdir(os.path.dirname(patch_target)):
+        os.makedirs(os.path.dirname(patch_target))
+    with open(patch_target,"w") as wrt:
+        wrt.write(patch_str)
+
+def resume_upgrade(journal:UpgradeJournal, install_mode:str, install_location:str, verbose=True, rollback=False, generate_patchnote=True) -> ContentDifference:
+    """finishes the upgrade interrupted while being committed, or rolls it
+    back if `rollback` is set. Returns the difference committed, or None
+    if it has been rolled back"""
+    diff = journal.difference()
+    if rollback:
+        if verbose: print(f"rolling back the upgrade from {diff.old_version} to {diff.new_version}...")
+        journal.rollback(verbose=verbose)
+        dreams.invalidate_config()
+        if verbose: print("rollback done!")
+        return None
+    if verbose: print(f"resuming the upgrade from {diff.old_version} to {diff.new_version}...")
+    result_diff = install_upgrade(
+        journal.staging,
+        install_location,
+        diff,
+        install_mode=install_mode,
+        config=dreams.get_config(root=install_location),
+        move=True,
+        store=get_profile_store(install_location),
+        journal=journal
+        )
+    journal.finish()
+    dreams.invalidate_config()
+    if generate_patchnote:
+        # the whole upgrade, not only what was left to commit
+        write_patchnote(diff, install_location)
+    if verbose: print("upgrade done!")
+    return result_diff
+
+def upgrade_pack(install_mode: str, install_location:str, repository:str, verbose=True, generate_patchnote=True, wait_for_confirm=False, rollback=False):
+    journal = UpgradeJournal.load(install_location)
+    if not journal is None:
+        resume_upgrade(journal, install_mode, install_location, verbose=verbose, rollback=rollback, generate_patchnote=generate_patchnote)
+        return
+    if rollback:
+        print("No interrupted upgrade to roll back.")
+        return
+    store = get_profile_store(install_location)
     latest = dreams_install.get_latest_release_name(repository)
 
     is_local = dreams.get_current_config_type().is_local
@@ -380,18 +958,30 @@ def upgrade_pack(install_mode: str, install_location:str, repository:str, verbos
 
     if install_mode == InstallMode.SERVER:
         # removing every entry marked "client side only" from the difference.
-        # MEMORY FOOTPRINT HERE WE GOOOOOOOOOOOOOOOO !!!!!!!!!!!!!!!!
-        # COPY! COPY! COPY!, WASTE THAT RAM !!(haven't found a better way)
-        client_only = config.get("client-side-only",[])
-        for k in diff.added.copy():
-            if any(i for i in client_only if k.startswith(i)):
-                diff.added.remove(k)
-        for k in diff.modified.copy():
-            if any(i for i in client_only if k.startswith(i)):
-                diff.modified.remove(k)
-        for k in diff.removed.copy():
-            if any(i for i in client_only if k.startswith(i)):
-                diff.removed.remove(k)
+        diff.exclude(dreams.PathMatcher(config.get("client-side-only",[])))
+
+    if len(diff.added) == 0 and len(diff.removed) == 0 and len(diff.modified) == 0:
+        if verbose: print("the modpack is already up to date.")
+        return
+
+    try:
+        old_manifest = dreams.get_manifest()
+        diff.old_version = old_manifest.get("version","?")
+    except:
+        diff.old_version = "?"
+
+    # patch archive made by the bundle for this exact upgrade
+    patch_file = f"{dreams.DirNames.Server.VERSIONS}/{latest[1]}/{dreams.DirNames.PATCHES}/{diff.old_version}.zip"
+    patch_info = RepositoryClient(repository).get_file_info(patch_file)
+    cache = get_download_cache(config)
+    plan = plan_upgrade(
+        diff,
+        dreams_install.get_latest_meta(repository) or dict(),
+        store=store,
+        cache=cache,
+        patch_size=patch_info["size"] if not patch_info is None else None
+        )
+    if verbose: print(f"  {plan.summary()}")
 
     if wait_for_confirm:
         print(f"\nThe modpack will be upgraded from {dreams.get_manifest().get('version','?')} to {latest[0]}.")
@@ -400,53 +990,77 @@ def upgrade_pack(install_mode: str, install_location:str, repository:str, verbos
             print("Aborting the upgrade process.")
             return
 
+    # staging on the file system of the installation, so that the files
+    # can then be moved in place instead of copied. The staging directory
+    # is kept if the upgrade is aborted, the files already staged are not
+    # downloaded again by the next attempt.
+    journal = UpgradeJournal(install_location)
+    os.makedirs(journal.staging, exist_ok=True)
+
     # adding to modified will add it to the old install even if it does not exist
-    if not dreams.DirNames.FILE_VERSION_CONTENT in diff.modified:
-        diff.modified.append(dreams.DirNames.FILE_VERSION_CONTENT)
-    if dreams.DirNames.FILE_VERSION_CONTENT in diff.added:
-        diff.added.remove(dreams.DirNames.FILE_VERSION_CONTENT)
-    if not dreams.DirNames.FILE_VERSION_CHECKER in diff.modified:
-        diff.modified.append(dreams.DirNames.FILE_VERSION_CHECKER)
-    if dreams.DirNames.FILE_VERSION_CHECKER in diff.added:
-        diff.added.remove(dreams.DirNames.FILE_VERSION_CHECKER)
+    always_replaced = [dreams.DirNames.FILE_VERSION_CONTENT, dreams.DirNames.FILE_VERSION_CHECKER]
+    if dreams.DirNames.FILE_VERSION_CONTENT_BINARY in diff.hashes:
+        always_replaced.append(dreams.DirNames.FILE_VERSION_CONTENT_BINARY)
+    for f in always_replaced:
+        diff.added.discard(f)
+        diff.modified.add(f)
     diff.new_version = latest[0]
-    download_loc = download_tmp.name
-    if verbose: print("downloading the modpack...")
-    download_upgrade(repository, download_loc, latest[1], diff)
+    archive = None
+    downloads_dir = dreams.get_as_path(dreams.DirNames.DOWNLOADS, root=install_location)
+    if plan.method == UpgradeMethod.ARCHIVE:
+        if verbose: print("downloading the modpack archive...")
+        os.makedirs(downloads_dir, exist_ok=True)
+        archive = dreams_install.download_pack(repository, downloads_dir, verbose=verbose, cache=cache)
+        if verbose: print("extracting the upgrade...")
+    elif plan.method == UpgradeMethod.PATCH:
+        if verbose: print("downloading the patch archive...")
+        os.makedirs(downloads_dir, exist_ok=True)
+        archive = f"{downloads_dir}/patch_{diff.old_version}-{latest[1]}.zip"
+        progress = dreams.Progress(patch_info["size"] or 0, "  downloading patch", unit=dreams.ProgressUnit.BYTES, verbose=verbose)
+        try:
+            RepositoryClient(repository).download_resumable(patch_file, archive, progress=progress, info=patch_info)
+            progress.close()
+            if verbose: print("extracting the upgrade...")
+        except (RepositoryError, OSError) as e:
+            progress.close()
+            if verbose: print(f"  the patch archive could not be downloaded ({e}), downloading the files instead...")
+            archive = None
+    elif verbose: print("downloading the modpack...")
+    with (ZipFile(archive,"r") if not archive is None else nullcontext()) as zip:
+        failed = download_upgrade(
+            repository,
+            journal.staging,
+            latest[1],
+            diff,
+            verbose=verbose,
+            concurrency=config.get("download-concurrency", DEFAULT_DOWNLOAD_CONCURRENCY),
+            store=store,
+            cache=cache,
+            archive=zip,
+            reference=install_location
+            )
+    if not archive is None:
+        os.remove(archive)
+    if len(failed) > 0:
+        print(f"{len(failed)} file(s) could not be downloaded:")
+        for f, error in failed:
+            print(f"  {f}: {error}")
+        print("Aborting the upgrade, nothing has been changed.")
+        return
     if verbose: print("download done!")
 
     if verbose: print("upgrading the modpack...")
-    try:
-        old_manifest = dreams.get_manifest()
-        diff.old_version = old_manifest.get("version","?")
-    except:
-        diff.old_version = "?"
-
-    result_diff = install_upgrade(download_loc, install_location, diff, install_mode=install_mode, config=config)
+    result_diff = install_upgrade(journal.staging, install_location, diff, install_mode=install_mode, config=config, move=True, store=store, journal=journal)
+    journal.finish()
+    # the manifest and configs have been replaced by the new ones
+    dreams.invalidate_config()
 
     if generate_patchnote:
-        patch_str = f"{datetime.now().isoformat()}\n\n{result_diff.patchnote()}"
-        patch_file_name = f"patchnote_{result_diff.old_version}-{result_diff.new_version}.log"
-        patch_target = f"{dreams.get_as_path(dreams.DirNames.PATCHNOTES)}/{patch_file_name}"
-        if not os.path.isdir(os.path.dirname(patch_target)):
-            os.makedirs(os.path.dirname(patch_target))
-        with open(patch_target,"w") as wrt:
-            wrt.write(patch_str)
-    if verbose: print("upgrade done!")
-
-    download_tmp.cleanup()
+        write_patchnote(result_diff, install_location)
     if verbose: 
-        print("cleanup done!")
+        print("upgrade done!")
         print(f"\n\n\nModpack upgraded from version {diff.old_version} to {diff.new_version}!")
 
-def is_standalone() -> bool:
-    try:
-        dreams.get_manifest()
-    except:
-        return True
-    root = dreams.get_root()
-    return len([f for f in os.listdir(root) if os.path.isdir(f"{root}/{f}")]) == 0
-
 def main(args:list):
     install_mode = InstallMode.CLIENT
     if "--server" in args or "-s" in args:
@@ -468,7 +1082,7 @@ def main(args:list):
         print("No repository has been found in the config, aborting upgrade.")
         return
     interactive = "--interactive" in args
-    upgrade_pack(install_mode,dreams.get_root(),repository_url,wait_for_confirm=interactive)
+    upgrade_pack(install_mode,dreams.get_root(),repository_url,wait_for_confirm=interactive,rollback="--rollback" in args)
 
 if __name__ == "__main__":
     main(os.sys.argv)
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+import os
+import tempfile
+import lib.dreams as dreams
+from lib.dreams import DirNames, Color
+from lib.dreams_install import InstallMode
+from lib.dreams_hash import HashCache, hash_files
+from lib.dreams_store import get_profile_store
+from lib.dreams_cache import get_download_cache
+from lib.dreams_upgrade import ContentDifference, VersionContent, get_version_content, download_upgrade, install_upgrade
+
+class VerifyResult:
+    """Drift of an installation from its version content file.
+
+    `missing` : files of the version that are not installed
+    `modified` : installed files whose content is not the one of the version
+    `extra` : installed files that are not part of the version"""
+
+    def __init__(self, content:VersionContent, missing:list, modified:dict, extra:list):
+        self.content = content
+        self.missing = missing
+        # {file: hash found}, the hash is empty for files whose size
+        # already shows they are modified
+        self.modified = modified
+        self.extra = extra
+
+    def is_healthy(self) -> bool:
+        return len(self.missing) == 0 and len(self.modified) == 0
+
+    def report(self, indent=0) -> str:
+        indent_chars = indent*" "
+        lines = []
+        for f in self.missing:
+            lines.append(f"{indent_chars}[-] {f}")
+        for f in self.modified:
+            lines.append(f"{indent_chars}[~] {f}")
+        for f in self.extra:
+            lines.append(f"{indent_chars}[+] {f}")
+        return "\n".join(lines)
+
+    def as_difference(self) -> ContentDifference:
+        """the difference repairing the installation: the missing files are
+        added and the modified ones replaced, extra files are kept"""
+        installed = VersionContent(
+            {f: self.modified.get(f, h) for f, h in self.content.items() if not f in self.missing},
+            algorithm=self.content.algorithm
+            )
+        diff = ContentDifference(installed, self.content)
+        diff.removed = []
+        return diff
+
+def get_verify_config(root:str, install_mode=InstallMode.CLIENT) -> dict:
+    config = dreams.get_config(root=root)
+    if install_mode == InstallMode.SERVER:
+        for k, v in dreams.get_config(root=root, type=dreams.ConfigType(False,True)).items():
+            config[k] = v
+    return config
+
+def verify_install(root:str, install_mode=InstallMode.CLIENT, config=None, verbose=True) -> VerifyResult:
+    """Compares the installation at `root` with its version content file.
+
+    Files whose size differs from the recorded one are modified without
+    being read, the others are hashed in parallel through the hash cache,
+    so that only the files changed since they were last hashed are read."""
+    root = root.replace("\\","/")
+    content_file = dreams.get_as_path(DirNames.FILE_VERSION_CONTENT, root=root)
+    if not os.path.isfile(content_file):
+        raise FileNotFoundError("the installation has no version content file")
+    with open(content_file,"rb") as file:
+        content = get_version_content(file.readlines())
+    if config is None:
+        config = get_verify_config(root, install_mode)
+    if install_mode == InstallMode.SERVER:
+        client_only = dreams.PathMatcher(config.get("client-side-only",[]))
+        for f in [f for f in content if client_only.matches(f)]:
+            del content[f]
+
+    missing = []
+    modified = {}
+    to_hash = []
+    for f, expected in content.items():
+        # files without hash (the version content file) cannot be checked
+        if len(expected) == 0:
+            continue
+        try:
+            size = os.stat(f"{root}/{f}").st_size
+        except OSError:
+            missing.append(f)
+            continue
+        if f in content.sizes and not content.sizes[f] == size:
+            modified[f] = ""
+        else:
+            to_hash.append(f)
+
+    hash_cache = HashCache(root)
+    with dreams.Progress(len(to_hash), "  checking files", verbose=verbose) as progress:
+        hashes = hash_files(
+            root,
+            to_hash,
+            hash_cache=hash_cache,
+            algorithm=content.algorithm,
+            workers=config.get("hash-workers",None),
+            progress=progress
+        )
+    hash_cache.save()
+    for f, digest in hashes.items():
+        if not digest == content[f]:
+            modified[f] = digest
+
+    installed = dreams.list_content(
+        root,
+        include=config.get("bundle-include",["/"]),
+        exclude=[*config.get("bundle-exclude",[]), DirNames.CACHE]
+    )
+    extra = [f for f in installed if not f in content]
+    return VerifyResult(content, missing, modified, extra)
+
+def repair_install(root:str, repository:str, result:VerifyResult, install_mode=InstallMode.CLIENT, config=None, verbose=True) -> bool:
+    """Downloads the missing and modified files of `result` from the version
+    installed, and puts them in place through the upgrade process.
+    Returns False if some files could not be downloaded, nothing is
+    changed then."""
+    if config is None:
+        config = get_verify_config(root, install_mode)
+    version = dreams.get_manifest(root=root).get("version")
+    if version is None:
+        raise FileNotFoundError("the installed version is unknown")
+    diff = result.as_difference()
+    diff.old_version = version
+    diff.new_version = version
+    store = get_profile_store(root)
+
+    downloads_dir = dreams.get_as_path(DirNames.DOWNLOADS, root=root)
+    os.makedirs(downloads_dir, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=downloads_dir) as download_location:
+        failed = download_upgrade(
+            repository,
+            download_location,
+            version,
+            diff,
+            verbose=verbose,
+            store=store,
+            cache=get_download_cache(config)
+            )
+        if len(failed) > 0:
+            print(f"{len(failed)} file(s) could not be downloaded:")
+            for f, error in failed:
+                print(f"  {f}: {error}")
+            return False
+        install_upgrade(
+            download_location,
+            root,
+            diff,
+            install_defaults=False,
+            verbose=verbose,
+            install_mode=install_mode,
+            config=config,
+            move=True,
+            store=store
+            )
+    return True
+
+def main(args:list):
+    install_mode = InstallMode.CLIENT
+    if "--server" in args or "-s" in args:
+        install_mode = InstallMode.SERVER
+    if dreams.is_standalone():
+        print("The modpack does not seem to be installed, nothing to verify.")
+        return
+    root = dreams.get_root()
+    config = get_verify_config(root, install_mode)
+
+    print("verifying the installation...")
+    result = verify_install(root, install_mode=install_mode, config=config)
+    if len(result.missing) + len(result.modified) + len(result.extra) > 0:
+        print(result.report(indent=2))
+    print(f"  {len(result.missing)} missing, {len(result.modified)} modified, {len(result.extra)} extra file(s)")
+    if result.is_healthy():
+        print(Color.color("✓ the installation matches its version", Color.GREEN))
+        return
+    if not "--repair" in args:
+        print("Run with --repair to download the missing and modified files again.")
+        return
+
+    repository_url = config.get("repository", "")
+    if len(repository_url) < 1:
+        print("No repository has been found in the config, aborting repair.")
+        return
+    print("repairing the installation...")
+    if repair_install(root, repository_url, result, install_mode=install_mode, config=config):
+        print("repair done!")
+    else:
+        print("Aborting the repair, nothing has been changed.")
+
+if __name__ == "__main__":
+    main(os.sys.argv)
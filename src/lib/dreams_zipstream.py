@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+import zlib
+import struct
+from zipfile import BadZipFile
+
+_LOCAL_SIGNATURE = b"PK\x03\x04"
+_CENTRAL_SIGNATURE = b"PK\x01\x02"
+_END_SIGNATURE = b"PK\x05\x06"
+# signature, version, flags, method, time, date, crc, compressed size,
+# size, name length, extra length
+_LOCAL_HEADER = struct.Struct("<4sHHHHHIIIHH")
+# signature, version made by, version, flags, method, time, date, crc,
+# compressed size, size, name length, extra length, comment length,
+# disk, internal attributes, external attributes, local header offset
+_CENTRAL_HEADER = struct.Struct("<4sHHHHHHIIIHHHHHII")
+# signature, disk, central directory disk, entries on disk, entries,
+# central directory size, central directory offset, comment length
+_END_RECORD = struct.Struct("<4sHHHHIIH")
+
+_FLAG_ENCRYPTED = 0x1
+_FLAG_DATA_DESCRIPTOR = 0x8
+_FLAG_UTF8 = 0x800
+_STORED = 0
+_DEFLATED = 8
+_ZIP64_LIMIT = 0xFFFFFFFF
+
+class UnsupportedLayout(Exception):
+    """The archive cannot be read sequentially (sizes in data descriptors,
+    zip64, encryption or unsupported compression), it has to be downloaded
+    before being extracted."""
+    pass
+
+class StreamMember:
+    """A member of a ZipStreamReader. Its content can only be read once,
+    with `chunks()`, before moving to the next member."""
+
+    def __init__(self, reader, name:str, method:int, crc:int, compress_size:int, file_size:int, offset:int):
+        self.name = name
+        self.method = method
+        self.crc = crc
+        self.compress_size = compress_size
+        self.file_size = file_size
+        self.offset = offset
+        self._reader = reader
+        self._remaining = compress_size
+
+    def is_dir(self) -> bool:
+        return self.name.endswith("/")
+
+    def chunks(self):
+        """yields the uncompressed content, the CRC and size are checked
+        once the last chunk has been read"""
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS) if self.method == _DEFLATED else None
+        crc = 0
+        size = 0
+        while self._remaining > 0:
+            data = self._reader._read_exact(min(self._reader.chunk_size, self._remaining))
+            self._remaining -= len(data)
+            if not decompressor is None:
+                data = decompressor.decompress(data)
+            if len(data) > 0:
+                crc = zlib.crc32(data, crc)
+                size += len(data)
+                yield data
+        if not decompressor is None:
+            data = decompressor.flush()
+            if len(data) > 0:
+                crc = zlib.crc32(data, crc)
+                size += len(data)
+                yield data
+        if not size == self.file_size or not crc == self.crc:
+            raise BadZipFile(f"archive member {self.name} is corrupted")
+
+    def _skip(self):
+        while self._remaining > 0:
+            self._remaining -= len(self._reader._read_exact(min(self._reader.chunk_size, self._remaining)))
+
+class ZipStreamReader:
+    """Reads a zip archive from a stream (anything with a `read(amount)`
+    method) without seeking, member by member from their local headers.
+
+    Iterating over the reader yields the StreamMember of each entry, the
+    content of a member that is not read is skipped. At the end of the
+    iteration, the members are checked against the central directory,
+    and a BadZipFile error is raised if they do not match.
+
+    `hash` : optional hash object updated with every byte of the stream
+    `progress` : optional dreams.Progress, updated with the bytes read"""
+
+    def __init__(self, stream, hash=None, progress=None, chunk_size=1024*1024):
+        self.stream = stream
+        self.hash = hash
+        self.progress = progress
+        self.chunk_size = chunk_size
+        self.position = 0
+        self.members = []
+
+    def _read_exact(self, amount:int) -> bytes:
+        if amount == 0:
+            return b""
+        data = self.stream.read(amount)
+        if len(data) < amount:
+            parts = [data]
+            missing = amount-len(data)
+            while missing > 0:
+                part = self.stream.read(missing)
+                if len(part) == 0:
+                    raise BadZipFile("archive is truncated")
+                parts.append(part)
+                missing -= len(part)
+            data = b"".join(parts)
+        self.position += amount
+        if not self.hash is None:
+            self.hash.update(data)
+        if not self.progress is None:
+            self.progress.update(amount)
+        return data
+
+    def __iter__(self):
+        while True:
+            offset = self.position
+            signature = self._read_exact(4)
+            if not signature == _LOCAL_SIGNATURE:
+                break
+            member = self._read_local_header(signature, offset)
+            self.members.append(member)
+            yield member
+            member._skip()
+        self._read_central_directory(signature, offset)
+
+    def _read_local_header(self, signature:bytes, offset:int) -> StreamMember:
+        (
+            _, _, flags, method, _, _,
+            crc, compress_size, file_size,
+            name_length, extra_length
+        ) = _LOCAL_HEADER.unpack(signature+self._read_exact(_LOCAL_HEADER.size-4))
+        raw_name = self._read_exact(name_length)
+        self._read_exact(extra_length)
+        name = raw_name.decode("UTF-8" if flags & _FLAG_UTF8 else "cp437")
+        if flags & _FLAG_ENCRYPTED:
+            raise UnsupportedLayout(f"archive member {name} is encrypted")
+        if flags & _FLAG_DATA_DESCRIPTOR:
+            raise UnsupportedLayout(f"size of archive member {name} is not known in advance")
+        if not method in (_STORED, _DEFLATED):
+            raise UnsupportedLayout(f"archive member {name} uses an unsupported compression")
+        if _ZIP64_LIMIT in (compress_size, file_size):
+            raise UnsupportedLayout(f"archive member {name} uses zip64")
+        return StreamMember(self, name, method, crc, compress_size, file_size, offset)
+
+    def _read_central_directory(self, signature:bytes, offset:int):
+        directory_offset = offset
+        entries = 0
+        while signature == _CENTRAL_SIGNATURE:
+            (
+                _, _, _, _, method, _, _,
+                crc, compress_size, file_size,
+                name_length, extra_length, comment_length,
+                _, _, _, header_offset
+            ) = _CENTRAL_HEADER.unpack(signature+self._read_exact(_CENTRAL_HEADER.size-4))
+            self._read_exact(name_length)
+            self._read_exact(extra_length+comment_length)
+            if entries >= len(self.members):
+                raise BadZipFile("central directory lists members missing from the archive")
+            member = self.members[entries]
+            if not (
+                header_offset == member.offset
+                and method == member.method
+                and crc == member.crc
+                and compress_size == member.compress_size
+                and file_size == member.file_size
+            ):
+                raise BadZipFile(f"archive member {member.name} does not match the central directory")
+            entries += 1
+            offset = self.position
+            signature = self._read_exact(4)
+
+        if not signature == _END_SIGNATURE:
+            raise UnsupportedLayout("archive does not end with a plain central directory")
+        (
+            _, _, _, _, total_entries,
+            directory_size, start_offset, comment_length
+        ) = _END_RECORD.unpack(signature+self._read_exact(_END_RECORD.size-4))
+        self._read_exact(comment_length)
+        if not (
+            entries == len(self.members) == total_entries
+            and start_offset == directory_offset
+            and directory_size == offset-directory_offset
+        ):
+            raise BadZipFile("central directory does not match the archive")
+        if len(self.stream.read(1)) > 0:
+            raise BadZipFile("unexpected data after the end of the archive")
@@ -0,0 +1,16 @@
+import os
+import sys
+
+# the toolkit imports its modules as `lib.*` from the src directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import pytest
+
+@pytest.fixture(autouse=True)
+def reset_root():
+    """the profile root is discovered once per process, and set by the
+    installs: every test starts without one"""
+    import lib.dreams as dreams
+    yield
+    dreams._ROOT = None
+    dreams.invalidate_config()
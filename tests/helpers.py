@@ -0,0 +1,125 @@
+import json
+from pathlib import Path
+from zipfile import ZipFile
+import lib.dreams as dreams
+from lib.dreams import DirNames
+
+def digest_of(data:bytes, algorithm=dreams.DEFAULT_HASH_ALGORITHM) -> str:
+    file_hash = dreams.new_hash(algorithm)
+    file_hash.update(data)
+    return file_hash.hexdigest()
+
+def make_pack(path:str, files:dict, algorithm=dreams.DEFAULT_HASH_ALGORITHM) -> dict:
+    """writes a modpack archive holding `files` ({relative_path: bytes})
+    and their version content file, returns the hashes of the files"""
+    from lib.dreams_upgrade import format_version_content
+    hashes = {name: digest_of(data, algorithm) for name, data in files.items()}
+    with ZipFile(path, "w") as archive:
+        for name, data in files.items():
+            archive.writestr(name, data)
+        archive.writestr(DirNames.FILE_VERSION_CONTENT, format_version_content(hashes, algorithm))
+    return hashes
+
+def make_repository(root, files:dict, version="1.0", config={}, server_config=None, algorithm=dreams.DEFAULT_HASH_ALGORITHM) -> dict:
+    """lays out in `root` a repository serving the release `version` of
+    `files` and its archive, returns the hashes of the files"""
+    from lib.dreams_upgrade import format_version_content
+    root = Path(root)
+    release = root / DirNames.Server.VERSIONS / version
+    root.mkdir(parents=True, exist_ok=True)
+    hashes = make_pack(str(root / DirNames.Server.LATEST_ARCHIVE), files, algorithm)
+    release_files = {
+        **files,
+        DirNames.FILE_VERSION_CONTENT: format_version_content(hashes, algorithm).encode("UTF-8"),
+        DirNames.FILE_CONFIG: json.dumps(config).encode("UTF-8")
+    }
+    if not server_config is None:
+        release_files[DirNames.FILE_CONFIG_SERVER] = json.dumps(server_config).encode("UTF-8")
+    for relative, data in release_files.items():
+        (release / relative).parent.mkdir(parents=True, exist_ok=True)
+        (release / relative).write_bytes(data)
+    archive = (root / DirNames.Server.LATEST_ARCHIVE).read_bytes()
+    (root / DirNames.Server.LATEST_META).write_text(json.dumps({
+        "version": version,
+        "version-name": version,
+        "archive-size": len(archive),
+        "archive-hash": digest_of(archive, algorithm),
+        "archive-hash-algorithm": algorithm
+    }))
+    return hashes
+
+class RepositoryServer:
+    """Local HTTP server of the files of `root`, supporting Range and
+    If-Range requests (ETag validators) like the repository web servers.
+    `requests` lists the `(method, path, range)` received."""
+
+    def __init__(self, root:str):
+        import threading
+        from http.server import ThreadingHTTPServer
+        self.root = str(root)
+        self.requests = []
+        self.ranges = True
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _make_handler(self))
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self) -> "RepositoryServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def paths(self, method="GET") -> list:
+        return [path for m, path, _ in self.requests if m == method]
+
+def _make_handler(repository:RepositoryServer):
+    import os
+    import re
+    from http.server import BaseHTTPRequestHandler
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_HEAD(self):
+            self._send(body=False)
+
+        def do_GET(self):
+            self._send(body=True)
+
+        def _send(self, body:bool):
+            repository.requests.append((self.command, self.path, self.headers.get("Range")))
+            path = os.path.join(repository.root, self.path.lstrip("/"))
+            if not os.path.isfile(path):
+                self.send_response(404)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            with open(path, "rb") as file:
+                data = file.read()
+            stat = os.stat(path)
+            etag = f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+            requested = self.headers.get("Range")
+            validator = self.headers.get("If-Range")
+            start, end = 0, len(data)
+            partial = repository.ranges and not requested is None and (validator is None or validator == etag)
+            if partial:
+                match = re.match(r"bytes=(\d+)-(\d*)", requested)
+                start = int(match.group(1))
+                end = min(int(match.group(2))+1, len(data)) if len(match.group(2)) > 0 else len(data)
+            self.send_response(206 if partial else 200)
+            self.send_header("Content-Length", str(end-start))
+            self.send_header("ETag", etag)
+            if repository.ranges:
+                self.send_header("Accept-Ranges", "bytes")
+            if partial:
+                self.send_header("Content-Range", f"bytes {start}-{end-1}/{len(data)}")
+            self.end_headers()
+            if body:
+                self.wfile.write(data[start:end])
+
+    return Handler
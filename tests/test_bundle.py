@@ -0,0 +1,28 @@
+import json
+import lib.dreams as dreams
+import lib.dreams_bundle as dreams_bundle
+from lib.dreams import DirNames
+from lib.dreams_manifest import write_manifest
+from lib.dreams_upgrade import ContentDifference
+
+def make_profile(root):
+    (root / "install/version").mkdir(parents=True)
+    (root / "mods").mkdir()
+    (root / DirNames.FILE_MANIFEST).write_text(json.dumps({"name": "pack", "version": "1.0"}))
+    (root / DirNames.FILE_CONFIG).write_text(json.dumps({"bundle-include": ["mods", "config", "install/version"]}))
+    (root / "mods/a.jar").write_bytes(b"a")
+
+def test_stale_binary_manifest_is_not_bundled(tmp_path, monkeypatch):
+    make_profile(tmp_path)
+    # left by an older bundle with --binary-content
+    write_manifest({"mods/old.jar": "00"*16}, str(tmp_path / DirNames.FILE_VERSION_CONTENT_BINARY), "blake2b")
+    monkeypatch.chdir(tmp_path)
+    dreams._set_root(str(tmp_path))
+
+    dreams_bundle.main(["bundle"])
+
+    release = tmp_path / DirNames.RELEASES / "1.0"
+    assert not (release / DirNames.FILE_VERSION_CONTENT_BINARY).exists()
+    content = ContentDifference.get_content(str(release))
+    assert "mods/a.jar" in content and not "mods/old.jar" in content
+    assert not DirNames.FILE_VERSION_CONTENT_BINARY in content
@@ -0,0 +1,71 @@
+import os
+import random
+from zipfile import ZipFile, ZIP_STORED
+import lib.dreams_upgrade as dreams_upgrade
+from lib.dreams import DirNames
+from lib.dreams_delta import download_delta, get_signature_path, write_signature, BLOCK_SIZE
+from lib.dreams_net import RepositoryClient, RepositoryError
+from lib.dreams_upgrade import ContentDifference, VersionContent, download_upgrade
+from tests.helpers import RepositoryServer, digest_of
+
+def make_jar(path, members:dict):
+    with ZipFile(path, "w", compression=ZIP_STORED) as jar:
+        for name, data in members.items():
+            jar.writestr(name, data)
+
+def make_versions(tmp_path):
+    """an installed jar and its next version, with one member changed"""
+    rng = random.Random(1)
+    members = {f"classes/c{i}.class": rng.randbytes(40_000) for i in range(30)}
+    installed = tmp_path / "install" / "mods" / "big.jar"
+    installed.parent.mkdir(parents=True)
+    make_jar(installed, members)
+    members["classes/c7.class"] = rng.randbytes(40_000)
+    release = tmp_path / "repository" / DirNames.Server.VERSIONS / "2.0"
+    new = release / "mods" / "big.jar"
+    new.parent.mkdir(parents=True)
+    make_jar(new, members)
+    write_signature(str(new), str(release / get_signature_path("mods/big.jar")))
+    return installed, new
+
+def test_delta_only_downloads_the_changed_blocks(tmp_path):
+    installed, new = make_versions(tmp_path)
+    target = tmp_path / "big.jar"
+    with RepositoryServer(tmp_path / "repository") as server:
+        client = RepositoryClient(f"{server.url}/{DirNames.Server.VERSIONS}/2.0")
+        digest, downloaded = download_delta(client, "mods/big.jar", str(installed), str(target))
+
+    assert target.read_bytes() == new.read_bytes()
+    assert digest == digest_of(new.read_bytes())
+    assert 0 < downloaded <= 2*BLOCK_SIZE
+    assert all(not r is None for m, p, r in server.requests if m == "GET" and p.endswith("big.jar"))
+
+def test_delta_is_not_used_without_range_support(tmp_path):
+    installed, _ = make_versions(tmp_path)
+    with RepositoryServer(tmp_path / "repository") as server:
+        server.ranges = False
+        client = RepositoryClient(f"{server.url}/{DirNames.Server.VERSIONS}/2.0")
+        assert download_delta(client, "mods/big.jar", str(installed), str(tmp_path / "big.jar")) is None
+    assert not (tmp_path / "big.jar").exists()
+
+def test_failed_delta_falls_back_to_a_whole_download(tmp_path, monkeypatch):
+    installed, new = make_versions(tmp_path)
+    def fail(*args, **kwargs):
+        raise RepositoryError("mods/big.jar changed on the server during the download")
+    monkeypatch.setattr(RepositoryClient, "download_range", fail)
+    old_data = installed.read_bytes()
+    new_data = new.read_bytes()
+    diff = ContentDifference(
+        VersionContent({"mods/big.jar": digest_of(old_data)}, algorithm="blake2b"),
+        VersionContent({"mods/big.jar": digest_of(new_data)}, algorithm="blake2b", sizes={"mods/big.jar": len(new_data)})
+        )
+    monkeypatch.setattr(dreams_upgrade, "DELTA_MIN_SIZE", 1)
+    staging = tmp_path / "staging"
+    staging.mkdir()
+
+    with RepositoryServer(tmp_path / "repository") as server:
+        failed = download_upgrade(server.url, str(staging), "2.0", diff, verbose=False, reference=str(tmp_path / "install"))
+
+    assert failed == []
+    assert (staging / "mods/big.jar").read_bytes() == new_data
+    assert not os.path.exists(f"{staging}/mods/big.jar.tmp")
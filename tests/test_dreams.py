@@ -0,0 +1,40 @@
+import pytest
+import lib.dreams as dreams
+
+def test_int_args_are_validated():
+    assert dreams.get_int_arg(["--segments=4"], "--segments", default=1) == 4
+    assert dreams.get_int_arg(["install"], "--segments", default=1) == 1
+    for bad in ("--segments=four", "--segments=0", "--segments=-2", "--segments="):
+        with pytest.raises(ValueError, match="--segments"):
+            dreams.get_int_arg([bad], "--segments")
+    assert dreams.get_int_arg(["--patches=0"], "--patches", minimum=0) == 0
+
+def test_path_matcher_matches_prefixes():
+    matcher = dreams.PathMatcher(["config/", "mods/extra", "mods\\extra/lib", "", "logs/latest.log"])
+    assert matcher.prefixes == ["config/", "logs/latest.log", "mods/extra"]
+    for path in ("config/a.toml", "config/sub/b.toml", "mods/extra.jar", "mods/extra/x.jar", "logs/latest.log"):
+        assert matcher.matches(path), path
+    for path in ("configs/a.toml", "config", "mods/a.jar", "mods/ext.jar", "logs/old.log", "a", ""):
+        assert not matcher.matches(path), path
+    assert matcher.matches_dir("config") and matcher.matches_dir("mods/extra/lib/")
+    assert not matcher.matches_dir("mods") and not matcher.matches_dir("logs")
+    assert len(dreams.PathMatcher()) == 0 and not dreams.PathMatcher().matches("a")
+    assert dreams.PathMatcher.as_matcher(matcher) is matcher
+
+def test_path_matcher_agrees_with_startswith():
+    prefixes = ["a/", "a/b", "ab", "b/c/", "b/cd", "c"]
+    matcher = dreams.PathMatcher(prefixes)
+    paths = [f"{x}{y}{z}" for x in "abc/" for y in "abcd/" for z in ("", "/", "x", "/y")]
+    for path in paths:
+        assert matcher.matches(path) == any(path.startswith(p) for p in prefixes), path
+
+def test_list_content_skips_excluded_directories(tmp_path, monkeypatch):
+    for name in ("mods/a.jar", "mods/skip/b.jar", "config/c.toml", "config/d.bak", "logs/e.log"):
+        (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / name).write_bytes(b"x")
+    walked = []
+    walk = dreams.os.walk
+    monkeypatch.setattr(dreams.os, "walk", lambda path: ((walked.append(r.replace("\\","/")) or (r, d, f)) for r, d, f in walk(path)))
+    content = dreams.list_content(str(tmp_path), include=["mods", "config/", "logs"], exclude=["mods/skip", "config/d.bak", "logs/"])
+    assert sorted(content) == ["config/c.toml", "mods/a.jar"]
+    assert not any(w.endswith("skip") for w in walked)
@@ -0,0 +1,115 @@
+import os
+import json
+import lib.dreams as dreams
+from lib.dreams_hash import HashCache, hash_files, write_hashed
+
+def make_profile(root, files:dict):
+    for name, data in files.items():
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+
+def count_reads(monkeypatch) -> list:
+    reads = []
+    get_file_hash = dreams.get_file_hash
+    def counting(path, **kwargs):
+        reads.append(path)
+        return get_file_hash(path, **kwargs)
+    monkeypatch.setattr(dreams, "get_file_hash", counting)
+    return reads
+
+def test_unchanged_files_are_not_read_again(tmp_path, monkeypatch):
+    make_profile(tmp_path, {"mods/a.jar": b"a", "config/b.toml": b"b"})
+    expected = dreams.get_file_hash(str(tmp_path / "mods/a.jar"))
+    reads = count_reads(monkeypatch)
+    cache = HashCache(str(tmp_path))
+    assert cache.get_file_hash("mods/a.jar") == expected
+    cache.get_file_hash("config/b.toml")
+    cache.save()
+
+    cache = HashCache(str(tmp_path))
+    assert cache.get_file_hash("mods/a.jar") == expected
+    assert cache.get_file_hash("mods\\a.jar") == expected
+    assert len(reads) == 2
+    assert (cache.hits, cache.misses) == (2, 0)
+
+def test_modified_file_is_hashed_again(tmp_path):
+    make_profile(tmp_path, {"mods/a.jar": b"a"})
+    cache = HashCache(str(tmp_path))
+    cache.get_file_hash("mods/a.jar")
+    stat = os.stat(tmp_path / "mods/a.jar")
+    # same size, the mtime alone tells the file changed
+    (tmp_path / "mods/a.jar").write_bytes(b"z")
+    os.utime(tmp_path / "mods/a.jar", ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    assert cache.get_file_hash("mods/a.jar") == dreams.get_file_hash(str(tmp_path / "mods/a.jar"))
+    assert cache.misses == 2
+
+def test_algorithms_are_cached_side_by_side(tmp_path, monkeypatch):
+    make_profile(tmp_path, {"mods/a.jar": b"a"})
+    path = str(tmp_path / "mods/a.jar")
+    expected = {algorithm: dreams.get_file_hash(path, algorithm=algorithm) for algorithm in ("md5", "sha256")}
+    cache = HashCache(str(tmp_path))
+    cache.get_file_hash("mods/a.jar", algorithm="md5")
+    cache.get_file_hash("mods/a.jar", algorithm="sha256")
+    reads = count_reads(monkeypatch)
+    assert cache.get_file_hash("mods/a.jar", algorithm="md5") == expected["md5"]
+    assert cache.get_file_hash("mods/a.jar", algorithm="sha256") == expected["sha256"]
+    assert reads == []
+
+def test_invalidate(tmp_path, monkeypatch):
+    make_profile(tmp_path, {"mods/a.jar": b"a", "mods/b.jar": b"b"})
+    cache = HashCache(str(tmp_path))
+    cache.get_file_hash("mods/a.jar")
+    cache.get_file_hash("mods/b.jar")
+    cache.save()
+    reads = count_reads(monkeypatch)
+
+    cache.invalidate("mods\\a.jar")
+    cache.save()
+    cache = HashCache(str(tmp_path))
+    cache.get_file_hash("mods/a.jar")
+    cache.get_file_hash("mods/b.jar")
+    assert [os.path.basename(p) for p in reads] == ["a.jar"]
+
+    cache.invalidate()
+    cache.save()
+    cache = HashCache(str(tmp_path))
+    cache.get_file_hash("mods/b.jar")
+    assert [os.path.basename(p) for p in reads] == ["a.jar", "b.jar"]
+
+def test_cache_of_another_format_is_ignored(tmp_path, monkeypatch):
+    make_profile(tmp_path, {"mods/a.jar": b"a"})
+    cache = HashCache(str(tmp_path))
+    expected = cache.get_file_hash("mods/a.jar")
+    cache.save()
+    with open(cache.path, "r") as file:
+        data = json.load(file)
+    # made by a newer version
+    data["version"] += 1
+    with open(cache.path, "w") as file:
+        json.dump(data, file)
+    reads = count_reads(monkeypatch)
+
+    assert HashCache(str(tmp_path)).get_file_hash("mods/a.jar") == expected
+    with open(cache.path, "w") as file:
+        file.write("not json")
+    assert HashCache(str(tmp_path)).get_file_hash("mods/a.jar") == expected
+    assert len(reads) == 2
+
+def test_recorded_hash_is_trusted(tmp_path, monkeypatch):
+    (tmp_path / "mods").mkdir()
+    cache = HashCache(str(tmp_path))
+    digest = write_hashed([b"ab", b"cd"], str(tmp_path / "mods/a.jar"))
+    cache.record("mods/a.jar", digest)
+    assert digest == dreams.get_file_hash(str(tmp_path / "mods/a.jar"))
+    reads = count_reads(monkeypatch)
+    assert cache.get_file_hash("mods/a.jar") == digest
+    assert reads == []
+
+def test_hash_files_keeps_the_order(tmp_path):
+    files = {f"mods/{i}.jar": bytes([i])*(i*100) for i in range(40)}
+    make_profile(tmp_path, files)
+    order = list(reversed(files))
+    hashes = hash_files(str(tmp_path), order, workers=4, max_inflight_bytes=1000)
+    assert list(hashes) == order
+    assert hashes == {name: dreams.get_file_hash(str(tmp_path / name)) for name in order}
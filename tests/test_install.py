@@ -0,0 +1,154 @@
+import os
+import json
+from lib.dreams_install import extract_pack
+from lib.dreams_hash import HashCache
+from lib.dreams_store import SharedStore
+from tests.helpers import make_pack, make_repository
+
+FILES = {
+    "mods/a.jar": b"a"*1000,
+    "mods/b.jar": b"b"*3000,
+    "config/a.toml": b"option = 1\n",
+}
+
+def test_extract_pack_records_hashes_and_adopts_into_store(tmp_path):
+    archive = str(tmp_path / "pack.zip")
+    hashes = make_pack(archive, FILES)
+    install = str(tmp_path / "install")
+    os.makedirs(install)
+    store = SharedStore(str(tmp_path / "store"))
+
+    errors = extract_pack(archive, install, verbose=False, workers=2, store=store)
+
+    assert errors == []
+    for name, data in FILES.items():
+        with open(f"{install}/{name}", "rb") as file:
+            assert file.read() == data
+    hash_cache = HashCache(install)
+    for name, digest in hashes.items():
+        assert hash_cache.get_file_hash(name) == digest
+    assert hash_cache.misses == 0
+    # mods are shared, configs are not
+    assert store.contains(hashes["mods/a.jar"]) and store.contains(hashes["mods/b.jar"])
+    assert not store.contains(hashes["config/a.toml"])
+    assert os.path.samefile(f"{install}/mods/a.jar", store.path_for(hashes["mods/a.jar"]))
+
+def test_extract_pack_links_shared_files_on_several_threads(tmp_path):
+    files = {f"mods/m{i}.jar": bytes([i])*(1000+i*100) for i in range(12)}
+    files["config/a.toml"] = b"option = 1\n"
+    archive = str(tmp_path / "pack.zip")
+    hashes = make_pack(archive, files)
+    store = SharedStore(str(tmp_path / "store"))
+    first = str(tmp_path / "first")
+    second = str(tmp_path / "second")
+    os.makedirs(first)
+    os.makedirs(second)
+
+    assert extract_pack(archive, first, verbose=False, workers=4, store=store) == []
+    assert extract_pack(archive, second, verbose=False, workers=4, store=store) == []
+
+    for name, data in files.items():
+        for install in (first, second):
+            with open(f"{install}/{name}", "rb") as file:
+                assert file.read() == data
+        if name.startswith("mods/"):
+            # extracted once, then linked from the store
+            assert os.path.samefile(f"{first}/{name}", f"{second}/{name}")
+    assert not os.path.samefile(f"{first}/config/a.toml", f"{second}/config/a.toml")
+    hash_cache = HashCache(second)
+    for name, digest in hashes.items():
+        assert hash_cache.get_file_hash(name) == digest
+    assert hash_cache.misses == 0
+
+def test_extract_pack_again_skips_unchanged_files(tmp_path):
+    archive = str(tmp_path / "pack.zip")
+    make_pack(archive, FILES)
+    install = str(tmp_path / "install")
+    os.makedirs(install)
+    assert extract_pack(archive, install, verbose=False) == []
+    with open(f"{install}/config/a.toml", "wb") as file:
+        file.write(b"changed\n")
+    before = os.stat(f"{install}/mods/a.jar").st_mtime_ns
+
+    assert extract_pack(archive, install, verbose=False) == []
+
+    with open(f"{install}/config/a.toml", "rb") as file:
+        assert file.read() == FILES["config/a.toml"]
+    assert os.stat(f"{install}/mods/a.jar").st_mtime_ns == before
+
+def test_server_install_reads_the_config_of_the_release(tmp_path, monkeypatch):
+    from lib.dreams_install import install_standalone, InstallMode
+    from lib.dreams import DirNames
+    from tests.helpers import RepositoryServer
+    monkeypatch.setenv("DREAMS_CACHE_DIR", str(tmp_path / "user-cache"))
+    repository = tmp_path / "repository"
+    make_repository(
+        repository,
+        {
+            **FILES,
+            "mods/client/shaders.jar": b"client",
+            DirNames.FILE_MANIFEST: b'{"name": "pack", "version": "1.0"}',
+        },
+        config={"download-cache-size": 0},
+        server_config={"client-side-only": ["mods/client"]}
+        )
+    install = tmp_path / "install"
+    install.mkdir()
+    # the toolkit runs from the profile
+    monkeypatch.chdir(install)
+
+    with RepositoryServer(repository) as server:
+        install_standalone(server.url, InstallMode.SERVER, str(install), verbose=False)
+
+    assert f"/{DirNames.Server.VERSIONS}/1.0/{DirNames.FILE_CONFIG_SERVER}" in server.paths()
+    assert (install / "mods/a.jar").read_bytes() == FILES["mods/a.jar"]
+    assert not (install / "mods/client/shaders.jar").exists()
+    # "download-cache-size" 0 disables the cache
+    assert not (tmp_path / "user-cache").exists()
+
+def test_streamed_pack_is_filed_under_its_algorithm(tmp_path):
+    from lib.dreams_install import stream_pack
+    from lib.dreams import DirNames
+    from tests.helpers import RepositoryServer
+    files = {**FILES, DirNames.FILE_MANIFEST: b'{"name": "pack", "version": "1.0"}'}
+    hashes = make_repository(tmp_path / "repository", files, algorithm="md5")
+    install = str(tmp_path / "install")
+    os.makedirs(install)
+    store = SharedStore(str(tmp_path / "store"))
+
+    with RepositoryServer(tmp_path / "repository") as server:
+        stream_pack(server.url, install, verbose=False, store=store)
+
+    assert store.contains(hashes["mods/a.jar"], "md5")
+    hash_cache = HashCache(install)
+    assert hash_cache.get_file_hash("mods/a.jar", algorithm="md5") == hashes["mods/a.jar"]
+    assert hash_cache.misses == 0
+
+def test_corrupted_cached_archive_is_downloaded_again(tmp_path):
+    from lib.dreams_install import download_pack
+    from lib.dreams_cache import DownloadCache
+    from lib.dreams import DirNames
+    from tests.helpers import RepositoryServer
+    files = {**FILES, DirNames.FILE_MANIFEST: b'{"name": "pack", "version": "1.0"}'}
+    make_repository(tmp_path / "repository", files)
+    archive = (tmp_path / "repository" / DirNames.Server.LATEST_ARCHIVE).read_bytes()
+    latest = json.loads((tmp_path / "repository" / DirNames.Server.LATEST_META).read_text())
+    cache = DownloadCache(str(tmp_path / "cache"))
+    # same size and valid members, the time of the first one changed:
+    # only the hash tells
+    corrupted = archive[0:10] + bytes([archive[10] ^ 0xFF]) + archive[11:]
+    cached = cache.path_for(latest["archive-hash"])
+    os.makedirs(os.path.dirname(cached))
+    with open(cached, "wb") as file:
+        file.write(corrupted)
+    downloads = tmp_path / "downloads"
+    downloads.mkdir()
+
+    with RepositoryServer(tmp_path / "repository") as server:
+        path = download_pack(server.url, str(downloads), verbose=False, cache=cache)
+
+    assert f"/{DirNames.Server.LATEST_ARCHIVE}" in server.paths()
+    with open(path, "rb") as file:
+        assert file.read() == archive
+    with open(cached, "rb") as file:
+        assert file.read() == archive
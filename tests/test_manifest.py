@@ -0,0 +1,78 @@
+import random
+import pytest
+from lib.dreams import DirNames
+from lib.dreams_manifest import BinaryManifest, write_manifest, diff_manifests
+from lib.dreams_upgrade import ContentDifference, VersionContent
+
+def random_hash(rng) -> str:
+    return rng.randbytes(16).hex()
+
+def make_contents(count=2000):
+    rng = random.Random(3)
+    old = {f"mods/d{i%37}/file{i}.jar": random_hash(rng) for i in range(count)}
+    new = dict(old)
+    paths = list(old)
+    for path in paths[0:50]:
+        del new[path]
+    for path in paths[50:150]:
+        new[path] = random_hash(rng)
+    for i in range(70):
+        new[f"config/new{i}.toml"] = random_hash(rng)
+    return old, new
+
+def test_manifest_lookup(tmp_path):
+    old, _ = make_contents()
+    path = str(tmp_path / "content.bin")
+    write_manifest(old, path, "blake2b", sizes={"mods/d1/file1.jar": 1234}, unhashed=[DirNames.FILE_VERSION_CONTENT])
+    manifest = BinaryManifest.open(path)
+    try:
+        assert manifest.algorithm == "blake2b"
+        assert len(manifest) == len(old) + 1
+        assert list(manifest) == sorted([*old, DirNames.FILE_VERSION_CONTENT])
+        for path, file_hash in old.items():
+            assert manifest[path] == file_hash
+        assert manifest[DirNames.FILE_VERSION_CONTENT] == ""
+        assert not "mods/d1/missing.jar" in manifest and not "" in manifest
+        assert dict(manifest.sizes) == {"mods/d1/file1.jar": 1234}
+        del manifest["mods/d1/file1.jar"]
+        assert not "mods/d1/file1.jar" in manifest and len(manifest) == len(old)
+        with pytest.raises(KeyError):
+            manifest["mods/d1/file1.jar"]
+    finally:
+        manifest.close()
+
+def test_manifest_rejects_hashes_of_another_algorithm(tmp_path):
+    with pytest.raises(ValueError):
+        write_manifest({"a": "00"*32}, str(tmp_path / "content.bin"), "blake2b")
+    with pytest.raises(ValueError):
+        BinaryManifest(b"DRMC")
+
+def test_merge_join_matches_the_dict_difference(tmp_path):
+    old, new = make_contents()
+    write_manifest(old, str(tmp_path / "old.bin"), "blake2b")
+    write_manifest(new, str(tmp_path / "new.bin"), "blake2b")
+    old_manifest = BinaryManifest.open(str(tmp_path / "old.bin"))
+    new_manifest = BinaryManifest.open(str(tmp_path / "new.bin"))
+    expected = ContentDifference(VersionContent(old, algorithm="blake2b"), VersionContent(new, algorithm="blake2b"))
+
+    added, removed, modified = diff_manifests(old_manifest, new_manifest)
+    diff = ContentDifference(old_manifest, new_manifest)
+
+    assert (sorted(added), sorted(removed), sorted(modified)) == (sorted(expected.added), sorted(expected.removed), sorted(expected.modified))
+    assert (len(added), len(removed), len(modified)) == (70, 50, 100)
+    assert list(diff.added) == added and list(diff.removed) == removed and list(diff.modified) == modified
+    old_manifest.close()
+    new_manifest.close()
+
+def test_local_manifest_of_another_algorithm_is_closed(tmp_path, monkeypatch):
+    closed = []
+    monkeypatch.setattr(BinaryManifest, "close", lambda self: closed.append(self))
+    (tmp_path / "mods").mkdir()
+    (tmp_path / "mods/a.jar").write_bytes(b"a")
+    (tmp_path / DirNames.FILE_VERSION_CONTENT_BINARY).parent.mkdir(parents=True)
+    write_manifest({"mods/a.jar": "00"*16}, str(tmp_path / DirNames.FILE_VERSION_CONTENT_BINARY), "md5")
+
+    content = ContentDifference.get_content(str(tmp_path), config={"bundle-include": ["mods"]}, algorithm="blake2b")
+
+    assert len(closed) == 1
+    assert content.algorithm == "blake2b" and list(content) == ["mods/a.jar"]
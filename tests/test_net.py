@@ -0,0 +1,70 @@
+import json
+import random
+import shutil
+import lib.dreams_net as dreams_net
+from lib.dreams_net import RepositoryClient
+from tests.helpers import RepositoryServer
+
+class KillAt:
+    """progress taking a copy of the partial download once `amount` bytes
+    are downloaded, as a download killed at that point would leave it"""
+
+    def __init__(self, target:str, amount:int):
+        self.target = target
+        self.amount = amount
+        self.done = 0
+        self.state = None
+
+    def update(self, amount=1):
+        self.done += amount
+        if self.state is None and self.done >= self.amount:
+            shutil.copy(f"{self.target}.part", f"{self.target}.killed")
+            with open(f"{self.target}.part.json") as file:
+                self.state = json.load(file)
+
+def serve_file(tmp_path, size:int) -> bytes:
+    data = random.Random(size).randbytes(size)
+    (tmp_path / "repository").mkdir()
+    (tmp_path / "repository" / "latest.zip").write_bytes(data)
+    return data
+
+def test_resumable_download_resumes_from_the_saved_state(tmp_path, monkeypatch):
+    monkeypatch.setattr(dreams_net, "DOWNLOAD_STATE_INTERVAL", 128*1024)
+    data = serve_file(tmp_path, 2*1024*1024)
+    target = str(tmp_path / "latest.zip")
+    with RepositoryServer(tmp_path / "repository") as server:
+        client = RepositoryClient(server.url)
+        killed = KillAt(target, 1024*1024)
+        client.download_resumable("latest.zip", target, progress=killed, segments=2, chunk_size=64*1024)
+        # saved while downloading, not only once done
+        resumed_at = [position for start, _, position in killed.state["segments"] if position > start]
+        assert len(resumed_at) > 0
+
+        shutil.move(f"{target}.killed", f"{target}.part")
+        with open(f"{target}.part.json", "w") as file:
+            json.dump(killed.state, file)
+        server.requests.clear()
+        client.download_resumable("latest.zip", target, segments=2, chunk_size=64*1024)
+
+    with open(target, "rb") as file:
+        assert file.read() == data
+    ranges = [r for m, _, r in server.requests if m == "GET"]
+    assert sorted(ranges) == sorted(f"bytes={p}-{e-1}" for _, e, p in killed.state["segments"] if p < e)
+
+def test_resumable_download_restarts_when_the_file_changed(tmp_path):
+    serve_file(tmp_path, 512*1024)
+    target = str(tmp_path / "latest.zip")
+    with RepositoryServer(tmp_path / "repository") as server:
+        client = RepositoryClient(server.url)
+        killed = KillAt(target, 256*1024)
+        client.download_resumable("latest.zip", target, progress=killed, chunk_size=64*1024)
+        shutil.move(f"{target}.killed", f"{target}.part")
+        with open(f"{target}.part.json", "w") as file:
+            json.dump(killed.state, file)
+        data = random.Random(0).randbytes(600*1024)
+        (tmp_path / "repository" / "latest.zip").write_bytes(data)
+
+        client.download_resumable("latest.zip", target, chunk_size=64*1024)
+
+    with open(target, "rb") as file:
+        assert file.read() == data
@@ -0,0 +1,34 @@
+import os
+import json
+from lib.dreams import DirNames
+from lib.dreams_publish import describe_release_archive
+from tests.helpers import digest_of
+
+class LocalSFTP:
+    """the part of paramiko's SFTPClient used by the publication, on local
+    files"""
+
+    def getfo(self, path:str, out):
+        with open(path, "rb") as file:
+            data = file.read()
+        out.write(data)
+        return len(data)
+
+    def open(self, path:str, mode="r"):
+        return open(path, mode)
+
+    def posix_rename(self, source:str, target:str):
+        os.replace(source, target)
+
+def test_release_archive_is_described_for_the_installs(tmp_path):
+    archive = os.urandom(5000)
+    (tmp_path / DirNames.Server.LATEST_ARCHIVE).write_bytes(archive)
+    (tmp_path / DirNames.Server.LATEST_META).write_text(json.dumps({"version": "1.0", "version-name": "pack-1.0"}))
+
+    meta = describe_release_archive(LocalSFTP(), str(tmp_path), algorithm="sha256")
+
+    assert meta == {"archive-size": 5000, "archive-hash": digest_of(archive, "sha256"), "archive-hash-algorithm": "sha256"}
+    assert json.loads((tmp_path / DirNames.Server.LATEST_META).read_text()) == {"version": "1.0", "version-name": "pack-1.0", **meta}
+    # the archive of the server is left as it is
+    assert (tmp_path / DirNames.Server.LATEST_ARCHIVE).read_bytes() == archive
+    assert sorted(os.listdir(tmp_path)) == [DirNames.Server.LATEST_META, DirNames.Server.LATEST_ARCHIVE]
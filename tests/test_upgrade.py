@@ -0,0 +1,229 @@
+import os
+import pytest
+import lib.dreams_upgrade as dreams_upgrade
+from lib.dreams import DirNames, PathMatcher
+from lib.dreams_install import InstallMode
+from lib.dreams_upgrade import ContentDifference, VersionContent, UpgradeMethod, UpgradeJournal, PathSet, plan_upgrade, install_upgrade, resume_upgrade, REQUEST_COST
+from lib.dreams_cache import DownloadCache
+from tests.helpers import digest_of
+
+def make_difference(files:dict) -> ContentDifference:
+    new = VersionContent(
+        {name: digest_of(data) for name, data in files.items()},
+        algorithm="blake2b",
+        sizes={name: len(data) for name, data in files.items()}
+        )
+    return ContentDifference(VersionContent(algorithm="blake2b"), new)
+
+UPGRADE = {f"mods/m{i}.jar": bytes([i])*100_000 for i in range(10)}
+
+def test_plan_prefers_a_smaller_patch_to_the_files():
+    plan = plan_upgrade(make_difference(UPGRADE), {}, patch_size=200_000)
+    assert plan.method == UpgradeMethod.PATCH
+
+def test_plan_ignores_the_patch_when_files_are_cached(tmp_path):
+    cache = DownloadCache(str(tmp_path / "cache"))
+    for name, data in list(UPGRADE.items())[1:]:
+        (tmp_path / "file").write_bytes(data)
+        cache.put(str(tmp_path / "file"), digest_of(data))
+    plan = plan_upgrade(make_difference(UPGRADE), {}, cache=cache, patch_size=900_000)
+    assert plan.method == UpgradeMethod.FILES
+    assert plan.file_count == 1
+    assert plan.files_size == 100_000 + REQUEST_COST
+
+def test_plan_uses_the_cheapest_archive():
+    latest = {"archive-size": 300_000, "archive-hash": "0"*32}
+    assert plan_upgrade(make_difference(UPGRADE), latest, patch_size=500_000).method == UpgradeMethod.ARCHIVE
+    assert plan_upgrade(make_difference(UPGRADE), latest, patch_size=200_000).method == UpgradeMethod.PATCH
+    # an archive that cannot be verified is never used
+    assert plan_upgrade(make_difference(UPGRADE), {"archive-size": 1}).method == UpgradeMethod.FILES
+
+OLD = {"mods/a.jar": b"old a", "mods/b.jar": b"b", "config/c.toml": b"c"}
+NEW = {"mods/a.jar": b"new a", "config/c.toml": b"c", "mods/d.jar": b"d"}
+
+def write_files(root, files:dict):
+    for relative, data in files.items():
+        os.makedirs(os.path.dirname(f"{root}/{relative}"), exist_ok=True)
+        with open(f"{root}/{relative}", "wb") as file:
+            file.write(data)
+
+def read_files(root) -> dict:
+    files = {}
+    for directory, _, names in os.walk(root):
+        for name in names:
+            path = f"{directory}/{name}".replace("\\","/")
+            with open(path, "rb") as file:
+                files[path[len(str(root))+1:]] = file.read()
+    return files
+
+def stage_upgrade(install) -> tuple:
+    write_files(install, OLD)
+    journal = UpgradeJournal(str(install))
+    write_files(journal.staging, {f: NEW[f] for f in ("mods/a.jar", "mods/d.jar")})
+    diff = ContentDifference(
+        VersionContent({f: digest_of(d) for f, d in OLD.items()}, algorithm="blake2b"),
+        VersionContent({f: digest_of(d) for f, d in NEW.items()}, algorithm="blake2b")
+        )
+    diff.old_version, diff.new_version = "1.0", "2.0"
+    return journal, diff
+
+def interrupt_after(monkeypatch, count:int):
+    place_file = dreams_upgrade.place_file
+    placed = []
+    def interrupted(*args, **kwargs):
+        if len(placed) >= count:
+            raise KeyboardInterrupt()
+        placed.append(args)
+        return place_file(*args, **kwargs)
+    monkeypatch.setattr(dreams_upgrade, "place_file", interrupted)
+
+def installed(install) -> dict:
+    return {f: d for f, d in read_files(install).items() if not f.startswith(DirNames.CACHE)}
+
+def test_journal_commits_the_upgrade(tmp_path):
+    journal, diff = stage_upgrade(tmp_path)
+    install_upgrade(journal.staging, str(tmp_path), diff, install_defaults=False, verbose=False, config={}, move=True, journal=journal)
+    journal.finish()
+    assert installed(tmp_path) == NEW
+    assert UpgradeJournal.load(str(tmp_path)) is None
+    assert not os.path.exists(journal.staging) and not os.path.exists(journal.backup)
+
+def test_journal_rolls_back_an_interrupted_upgrade(tmp_path, monkeypatch):
+    journal, diff = stage_upgrade(tmp_path)
+    interrupt_after(monkeypatch, 1)
+    with pytest.raises(KeyboardInterrupt):
+        install_upgrade(journal.staging, str(tmp_path), diff, install_defaults=False, verbose=False, config={}, move=True, journal=journal)
+    assert installed(tmp_path) != OLD
+
+    resume_upgrade(UpgradeJournal.load(str(tmp_path)), InstallMode.CLIENT, str(tmp_path), verbose=False, rollback=True)
+
+    assert installed(tmp_path) == OLD
+    assert UpgradeJournal.load(str(tmp_path)) is None
+    # kept staged for the next attempt
+    assert read_files(journal.staging) == {"mods/a.jar": NEW["mods/a.jar"], "mods/d.jar": NEW["mods/d.jar"]}
+
+def test_journal_resumes_an_interrupted_upgrade(tmp_path, monkeypatch):
+    journal, diff = stage_upgrade(tmp_path)
+    interrupt_after(monkeypatch, 1)
+    with pytest.raises(KeyboardInterrupt):
+        install_upgrade(journal.staging, str(tmp_path), diff, install_defaults=False, verbose=False, config={}, move=True, journal=journal)
+    monkeypatch.undo()
+
+    resumed = resume_upgrade(UpgradeJournal.load(str(tmp_path)), InstallMode.CLIENT, str(tmp_path), verbose=False)
+
+    assert {f: d for f, d in installed(tmp_path).items() if not f.startswith(DirNames.PATCHNOTES)} == NEW
+    assert len(resumed.added) + len(resumed.modified) == 1
+    # the patchnote lists the whole upgrade
+    with open(f"{tmp_path}/{DirNames.PATCHNOTES}/patchnote_1.0-2.0.log") as file:
+        patchnote = file.read()
+    assert all(line in patchnote for line in ("[+] mods/d.jar", "[-] mods/b.jar", "[~] mods/a.jar"))
+
+def test_path_set_keeps_the_order():
+    paths = PathSet(["mods/b.jar", "mods/a.jar", "mods/b.jar"])
+    paths.add("config/c.toml")
+    paths.update(["mods/a.jar", "mods/d.jar"])
+    paths.discard("mods/a.jar")
+    paths.discard("missing")
+    assert list(paths) == ["mods/b.jar", "config/c.toml", "mods/d.jar"]
+    assert "mods/d.jar" in paths and not "mods/a.jar" in paths
+    assert len(paths) == 3
+
+def test_path_set_copies_on_write():
+    paths = PathSet(["a", "b"])
+    copy = paths.copy()
+    second = copy.copy()
+    copy.add("c")
+    paths.discard("a")
+    assert list(paths) == ["b"] and list(copy) == ["a", "b", "c"] and list(second) == ["a", "b"]
+    second.discard("missing")
+    assert list(second) == ["a", "b"]
+
+def test_path_set_exclude():
+    paths = PathSet(["mods/a.jar", "config/b.toml", "mods/c.jar"])
+    kept = paths.exclude(PathMatcher(["config/"]))
+    assert list(kept) == ["mods/a.jar", "mods/c.jar"]
+    everything = paths.exclude(PathMatcher())
+    everything.discard("mods/a.jar")
+    assert list(paths) == ["mods/a.jar", "config/b.toml", "mods/c.jar"]
+    assert list(paths.filter(lambda p: p.endswith(".toml"))) == ["config/b.toml"]
+
+def install_release(tmp_path, monkeypatch, files:dict) -> str:
+    from lib.dreams_install import install_standalone
+    from tests.helpers import RepositoryServer, make_repository
+    monkeypatch.setenv("DREAMS_CACHE_DIR", str(tmp_path / "user-cache"))
+    make_repository(tmp_path / "repository", files)
+    install = tmp_path / "install"
+    install.mkdir()
+    monkeypatch.chdir(install)
+    with RepositoryServer(tmp_path / "repository") as server:
+        install_standalone(server.url, InstallMode.CLIENT, str(install), verbose=False)
+    return str(install)
+
+RELEASE = {
+    DirNames.FILE_MANIFEST: b'{"name": "pack", "version": "1.0"}',
+    DirNames.FILE_VERSION_CHECKER: b'{"modpackVersion": "1.0"}',
+    "mods/a.jar": b"a"*1000
+}
+
+def test_declined_upgrade_leaves_nothing(tmp_path, monkeypatch):
+    from tests.helpers import RepositoryServer, make_repository
+    install = install_release(tmp_path, monkeypatch, RELEASE)
+    make_repository(tmp_path / "next", {**RELEASE, DirNames.FILE_MANIFEST: b'{"name": "pack", "version": "1.1"}', "mods/b.jar": b"b"}, version="1.1")
+    monkeypatch.setattr(dreams_upgrade.dreams, "ask_user", lambda *args, **kwargs: False)
+
+    with RepositoryServer(tmp_path / "next") as server:
+        dreams_upgrade.upgrade_pack(InstallMode.CLIENT, install, server.url, verbose=False, wait_for_confirm=True)
+
+    assert not os.path.exists(f"{install}/{DirNames.STAGING}")
+    assert not os.path.exists(f"{install}/mods/b.jar")
+
+def test_upgrade_to_the_installed_version_does_nothing(tmp_path, monkeypatch):
+    from tests.helpers import RepositoryServer
+    install = install_release(tmp_path, monkeypatch, RELEASE)
+
+    with RepositoryServer(tmp_path / "repository") as server:
+        dreams_upgrade.upgrade_pack(InstallMode.CLIENT, install, server.url, verbose=False)
+
+    assert not os.path.exists(f"{install}/{DirNames.STAGING}")
+    assert not os.path.exists(f"{install}/{DirNames.FILE_UPGRADE_JOURNAL}")
+
+def test_upgrade_installs_the_new_release(tmp_path, monkeypatch):
+    from tests.helpers import RepositoryServer, make_repository
+    install = install_release(tmp_path, monkeypatch, RELEASE)
+    make_repository(tmp_path / "next", {
+        DirNames.FILE_MANIFEST: b'{"name": "pack", "version": "1.1"}',
+        DirNames.FILE_VERSION_CHECKER: b'{"modpackVersion": "1.1"}',
+        "mods/b.jar": b"b"
+        }, version="1.1")
+
+    with RepositoryServer(tmp_path / "next") as server:
+        dreams_upgrade.upgrade_pack(InstallMode.CLIENT, install, server.url, verbose=False, generate_patchnote=False)
+
+    assert read_files(f"{install}/mods") == {"b.jar": b"b"}
+    assert not os.path.exists(f"{install}/{DirNames.STAGING}")
+    assert not os.path.exists(f"{install}/{DirNames.FILE_UPGRADE_JOURNAL}")
+
+def test_corrupted_archive_member_is_downloaded_on_its_own(tmp_path):
+    from zipfile import ZipFile, ZIP_STORED
+    from tests.helpers import RepositoryServer
+    files = {"mods/a.jar": b"a"*5000, "mods/b.jar": b"b"*5000}
+    release = tmp_path / "repository" / DirNames.Server.VERSIONS / "1.1"
+    for name, data in files.items():
+        (release / name).parent.mkdir(parents=True, exist_ok=True)
+        (release / name).write_bytes(data)
+    archive = tmp_path / "patch.zip"
+    with ZipFile(archive, "w", compression=ZIP_STORED) as zip:
+        for name, data in files.items():
+            zip.writestr(name, data)
+    # the content of a.jar no longer matches its CRC
+    raw = archive.read_bytes()
+    archive.write_bytes(raw.replace(b"a"*100, b"x"*100, 1))
+    staging = tmp_path / "staging"
+    staging.mkdir()
+
+    with RepositoryServer(tmp_path / "repository") as server, ZipFile(archive) as zip:
+        failed = dreams_upgrade.download_upgrade(server.url, str(staging), "1.1", make_difference(files), verbose=False, archive=zip)
+
+    assert failed == []
+    assert server.paths() == [f"/{DirNames.Server.VERSIONS}/1.1/mods/a.jar"]
+    assert read_files(staging / "mods") == {"a.jar": files["mods/a.jar"], "b.jar": files["mods/b.jar"]}
@@ -0,0 +1,92 @@
+import io
+import hashlib
+import pytest
+from zipfile import ZipFile, ZIP_STORED, ZIP_DEFLATED, BadZipFile
+from lib.dreams_zipstream import ZipStreamReader, UnsupportedLayout
+
+FILES = {
+    "mods/": b"",
+    "mods/a.jar": bytes(range(256))*400,
+    "config/b.toml": b"key = value\n"*1000,
+    "ünicode.txt": b"x",
+    "empty.txt": b""
+}
+
+def make_archive(files=FILES, compression=ZIP_DEFLATED) -> bytes:
+    buffer = io.BytesIO()
+    with ZipFile(buffer, "w", compression=compression) as archive:
+        for name, data in files.items():
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+class TrickleStream:
+    """returns at most `step` bytes per read, like a network stream"""
+
+    def __init__(self, data:bytes, step=7):
+        self.data = io.BytesIO(data)
+        self.step = step
+
+    def read(self, amount:int) -> bytes:
+        return self.data.read(min(amount, self.step))
+
+    def write(self, data:bytes):
+        return self.data.write(data)
+
+    def flush(self):
+        pass
+
+@pytest.mark.parametrize("compression", [ZIP_STORED, ZIP_DEFLATED])
+def test_members_are_read_in_order(compression):
+    data = make_archive(compression=compression)
+    stream_hash = hashlib.sha256()
+    reader = ZipStreamReader(TrickleStream(data), hash=stream_hash, chunk_size=1000)
+    content = {}
+    for member in reader:
+        if member.is_dir():
+            continue
+        # members that are not read are skipped
+        if not member.name == "ünicode.txt":
+            content[member.name] = b"".join(member.chunks())
+    assert content == {name: data for name, data in FILES.items() if not name in ("mods/", "ünicode.txt")}
+    assert [m.name for m in reader.members] == list(FILES)
+    assert reader.position == len(data)
+    assert stream_hash.hexdigest() == hashlib.sha256(data).hexdigest()
+
+def test_corrupted_member_is_detected():
+    data = make_archive(compression=ZIP_STORED)
+    data = data.replace(b"key = value", b"key = VALUE", 1)
+    with pytest.raises(BadZipFile, match="config/b.toml"):
+        for member in ZipStreamReader(io.BytesIO(data)):
+            for _ in member.chunks():
+                pass
+
+def test_truncated_archive_is_detected():
+    data = make_archive()
+    for cut in (len(data)//2, len(data)-10):
+        with pytest.raises(BadZipFile):
+            for member in ZipStreamReader(io.BytesIO(data[0:cut])):
+                pass
+
+def test_trailing_data_is_detected():
+    with pytest.raises(BadZipFile, match="after the end"):
+        for member in ZipStreamReader(io.BytesIO(make_archive()+b"garbage")):
+            pass
+
+def test_central_directory_must_match_the_members():
+    data = bytearray(make_archive())
+    # the central directory records another CRC for the first file
+    central = data.rfind(b"PK\x01\x02", 0, data.rfind(b"mods/a.jar"))
+    data[central+16] ^= 0xFF
+    with pytest.raises(BadZipFile, match="central directory"):
+        for member in ZipStreamReader(io.BytesIO(bytes(data))):
+            pass
+
+def test_archive_written_to_a_stream_is_unsupported():
+    # without seeking, the sizes are written after the data of each member
+    stream = TrickleStream(b"")
+    with ZipFile(stream, "w", compression=ZIP_DEFLATED) as archive:
+        archive.writestr("a.txt", b"a"*1000)
+    stream.data.seek(0)
+    with pytest.raises(UnsupportedLayout):
+        for member in ZipStreamReader(stream):
+            pass